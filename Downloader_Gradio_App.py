@@ -1,26 +1,271 @@
-import gradio as gr
 import sys
 import subprocess
 import os
 import platform
 import shutil
+import signal
 import time
 import threading
 import queue
 import argparse
+import asyncio
+import calendar
+import contextlib
 import copy
+import ctypes
+import errno
+import filecmp
+import heapq
+import itertools
+import random
+import uuid
+import collections
+import hashlib
+import hmac
+import inspect
+import io
+import ipaddress
+import json
+import math
+import mmap
+import tarfile
+import tempfile
+import re
+import struct
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+    import fcntl # POSIX only; used to leave O_DIRECT for the final partial block
+except ImportError:
+    fcntl = None
+from urllib.parse import parse_qs, parse_qsl, quote, unquote, urlsplit
+from xml.etree import ElementTree
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Early Commands ---
+# `--install-nodes` and `--list-nodes` only need the standard library and git. They are
+# handled here, before the gradio/httpx/numpy imports and the Hub packages this file
+# pip-installs on import, so they work with any Python (e.g. ComfyUI's venv, or a fresh pod
+# before the app's own requirements are in). Everything they use is defined in this block.
+
+STATE_DIR_NAME = ".swarm_downloader" # Hidden per-directory state (manifests etc.), skipped by snapshot diffs
+
+def get_default_base_path():
+    """Determines the default base path based on the OS and known paths."""
+    system = platform.system()
+    if system == "Windows":
+        swarm_path = os.environ.get("SWARM_MODEL_PATH")
+        if swarm_path and os.path.isdir(swarm_path): return swarm_path
+        return os.path.join(os.getcwd(), "SwarmUI", "Models")
+    else:  # Linux/Unix systems
+        swarm_path = os.environ.get("SWARM_MODEL_PATH")
+        if swarm_path and os.path.isdir(swarm_path): return swarm_path
+        if os.path.exists("/home/Ubuntu/apps/StableSwarmUI"):
+            return "/home/Ubuntu/apps/StableSwarmUI/Models"
+        elif os.path.exists("/workspace/SwarmUI"):
+            return "/workspace/SwarmUI/Models"
+        else:
+            return os.path.join(os.getcwd(), "SwarmUI", "Models")
+
+# --- Custom Node Installer ---
+# `--install-nodes` installs ComfyUI custom nodes (COMFYUI_NODES, or --node URL). All nodes
+# are cloned (shallow) or updated concurrently. The requirements of every node that changed
+# then go to one pip run, so the resolver sees all constraints at once and one node's
+# install can't undo another's. pip's wheel/http cache lives next to ComfyUI and survives
+# pod restarts. A node is left alone when the remote's commit (git ls-remote) is the one it
+# has checked out and its requirements were installed at that commit; when nothing
+# changed, pip doesn't run at all.
+
+COMFYUI_NODES = [
+    "https://github.com/Comfy-Org/ComfyUI-Manager",
+    "https://github.com/kijai/ComfyUI-KJNodes",
+    "https://github.com/aria1th/ComfyUI-LogicUtils",
+    "https://github.com/crystian/ComfyUI-Crystools",
+    "https://github.com/Kosinkadink/ComfyUI-VideoHelperSuite",
+    "https://github.com/rgthree/rgthree-comfy",
+    "https://github.com/calcuis/gguf",
+    "https://github.com/city96/ComfyUI-GGUF",
+]
+NODE_INSTALL_SETTINGS = {
+    "parallel": 8, # Concurrent git clones/fetches
+    "git_timeout": 600.0,
+}
+NODE_STATE_NAME = "custom_nodes.json" # Per node: commit whose requirements were installed
+NODE_REQUIREMENTS_NAME = "custom_nodes_requirements.txt"
+NODE_PIP_CACHE_NAME = "pip-cache"
+
+def _run_git(args: list, cwd: str | None = None) -> subprocess.CompletedProcess:
+    return subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True, timeout=NODE_INSTALL_SETTINGS["git_timeout"],
+                          env=dict(os.environ, GIT_TERMINAL_PROMPT="0")) # A private or renamed repo fails instead of waiting for a password
+
+def _git_output(args: list, cwd: str | None = None) -> str:
+    result = _run_git(args, cwd)
+    if result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)}: {result.stderr.strip() or result.stdout.strip()}")
+    return result.stdout.strip()
+
+def custom_node_name(repo_url: str) -> str:
+    return repo_url.rstrip("/").rsplit("/", 1)[-1].removesuffix(".git")
+
+def sync_custom_node(repo_url: str, custom_nodes_dir: str) -> dict:
+    """
+    Shallow-clones a node, or brings an existing clone to the remote's default branch tip.
+    Returns {"name", "url", "path", "status": cloned | updated | unchanged | skipped | failed,
+    "commit", "previous_commit", "error"}. Local edits are kept; an update that would
+    overwrite them fails rather than discarding them.
+    """
+    name = custom_node_name(repo_url)
+    node_path = os.path.join(custom_nodes_dir, name)
+    result = {"name": name, "url": repo_url, "path": node_path, "status": "failed", "commit": None, "previous_commit": None, "error": None}
+    try:
+        if not os.path.exists(node_path):
+            _git_output(["clone", "--depth", "1", "--recurse-submodules", "--shallow-submodules", repo_url, node_path])
+            result.update(status="cloned", commit=_git_output(["rev-parse", "HEAD"], node_path))
+            return result
+        if not os.path.isdir(os.path.join(node_path, ".git")):
+            result.update(status="skipped", error=f"{node_path} exists but is not a git repository")
+            return result
+        result["previous_commit"] = result["commit"] = _git_output(["rev-parse", "HEAD"], node_path)
+        remote_head = _git_output(["ls-remote", "origin", "HEAD"], node_path).split()
+        if remote_head and remote_head[0] == result["previous_commit"]:
+            result["status"] = "unchanged"
+            return result
+        _git_output(["fetch", "--depth", "1", "origin", "HEAD"], node_path)
+        _git_output(["reset", "--keep", "FETCH_HEAD"], node_path)
+        _git_output(["submodule", "update", "--init", "--recursive", "--depth", "1"], node_path)
+        result["commit"] = _git_output(["rev-parse", "HEAD"], node_path)
+        result["status"] = "unchanged" if result["commit"] == result["previous_commit"] else "updated"
+    except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+        result["error"] = str(e)
+    return result
+
+def _node_requirement_lines(node_path: str) -> list:
+    """requirements.txt lines of a node, with -r/-c file references made absolute so they work from the merged file."""
+    requirements_path = os.path.join(node_path, "requirements.txt")
+    if not os.path.isfile(requirements_path):
+        return []
+    lines = []
+    with open(requirements_path, "r", encoding="utf-8", errors="replace") as f:
+        for raw_line in f:
+            line = raw_line.split(" #", 1)[0].strip()
+            if not line or line.startswith("#"):
+                continue
+            option = re.match(r"(-r|--requirement|-c|--constraint)\s*=?\s*(\S+)$", line)
+            if option and not os.path.isabs(option.group(2)):
+                line = f"{option.group(1)} {os.path.join(node_path, option.group(2))}"
+            lines.append(line)
+    return lines
+
+def _pip_install(python_executable: str, requirement_args: list, cache_dir: str) -> subprocess.CompletedProcess:
+    return subprocess.run([python_executable, "-m", "pip", "install", "--cache-dir", cache_dir, *requirement_args], capture_output=True, text=True)
+
+def install_custom_nodes(comfyui_dir: str, node_urls: list | None = None, python_executable: str | None = None) -> dict:
+    """
+    Syncs node_urls into comfyui_dir/custom_nodes and installs the changed nodes' requirements
+    with python_executable in one pip run. If that run fails (say, two nodes pin conflicting
+    versions), each node is installed on its own so the others still get their packages.
+    Returns {"nodes": [...], "requirements": {"nodes", "lines", "ok", "seconds", "error"}}.
+    """
+    node_urls = list(node_urls or COMFYUI_NODES)
+    python_executable = python_executable or sys.executable
+    custom_nodes_dir = os.path.join(comfyui_dir, "custom_nodes")
+    state_dir = os.path.join(comfyui_dir, STATE_DIR_NAME)
+    os.makedirs(custom_nodes_dir, exist_ok=True)
+    os.makedirs(state_dir, exist_ok=True)
+    state_path = os.path.join(state_dir, NODE_STATE_NAME)
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            installed = json.load(f)
+    except (OSError, ValueError):
+        installed = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(NODE_INSTALL_SETTINGS["parallel"], len(node_urls)))) as pool:
+        nodes = list(pool.map(lambda repo_url: sync_custom_node(repo_url, custom_nodes_dir), node_urls))
+    for node in nodes:
+        print(f"Custom node {node['name']}: {node['status']}" + (f" ({node['error']})" if node["error"] else ""))
+
+    # Requirements were installed for exactly this commit last time (and that run succeeded) -> nothing to do
+    pending = [node for node in nodes if node["commit"] and node["status"] != "skipped" and installed.get(node["name"], {}).get("commit") != node["commit"]]
+    node_lines = {node["name"]: _node_requirement_lines(node["path"]) for node in pending}
+    merged_lines = list(dict.fromkeys(line for lines in node_lines.values() for line in lines))
+    requirements = {"nodes": [node["name"] for node in pending], "lines": len(merged_lines), "ok": True, "seconds": 0.0, "error": None}
+    succeeded = [node["name"] for node in pending if not node_lines[node["name"]]]
+    if merged_lines:
+        cache_dir = os.path.join(state_dir, NODE_PIP_CACHE_NAME)
+        merged_path = os.path.join(state_dir, NODE_REQUIREMENTS_NAME)
+        with open(merged_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(merged_lines) + "\n")
+        print(f"Installing requirements of {len(node_lines)} custom node(s) ({len(merged_lines)} lines) in one pip run with {python_executable}...")
+        started = time.perf_counter()
+        pip_result = _pip_install(python_executable, ["-r", merged_path], cache_dir)
+        if pip_result.returncode == 0:
+            succeeded = list(node_lines)
+        else:
+            print("WARNING: Merged requirements did not resolve; installing each node's requirements separately.")
+            requirements.update(ok=False, error=(pip_result.stderr.strip() or pip_result.stdout.strip())[-2000:])
+            for node_name, lines in node_lines.items():
+                if lines and _pip_install(python_executable, ["-r", os.path.join(custom_nodes_dir, node_name, "requirements.txt")], cache_dir).returncode == 0:
+                    succeeded.append(node_name)
+                elif lines:
+                    print(f"ERROR: Requirements of custom node {node_name} failed to install.")
+        requirements["seconds"] = round(time.perf_counter() - started, 3)
+    for node in pending:
+        if node["name"] in succeeded:
+            installed[node["name"]] = {"url": node["url"], "commit": node["commit"], "installed_at": round(time.time(), 3)}
+        node["requirements_installed"] = node["name"] in succeeded
+    temp_path = state_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(installed, f, indent=1, sort_keys=True)
+    os.replace(temp_path, state_path)
+    return {"nodes": nodes, "requirements": requirements}
+
+def default_node_python(comfyui_dir: str) -> str:
+    """ComfyUI's own venv interpreter if it has one (and SWARM_NO_VENV isn't set), else this interpreter."""
+    venv_python = os.path.join(comfyui_dir, "venv", "Scripts" if platform.system() == "Windows" else "bin", "python")
+    return venv_python if os.path.exists(venv_python) and not os.environ.get("SWARM_NO_VENV") else sys.executable
+
+def add_node_installer_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--install-nodes", action="store_true", help="Clone/update ComfyUI custom nodes in parallel, install their requirements in one pip run, print JSON and exit")
+    parser.add_argument("--list-nodes", action="store_true", help="Print the built-in COMFYUI_NODES list as JSON and exit")
+    parser.add_argument("--comfyui-dir", type=str, default=None, help="ComfyUI folder for --install-nodes (default: dlbackend/ComfyUI next to the model path)")
+    parser.add_argument("--node", action="append", default=[], metavar="URL", help="Custom node git URL for --install-nodes (default: the built-in COMFYUI_NODES list); may be repeated")
+    parser.add_argument("--node-python", type=str, default=None, help="Python that runs ComfyUI, for node requirements (default: ComfyUI's venv, else this Python)")
+    parser.add_argument("--node-parallel", type=int, default=NODE_INSTALL_SETTINGS["parallel"], help="Custom nodes cloned/updated at once")
+
+def run_node_command(argv: list) -> int:
+    """--list-nodes / --install-nodes; other arguments are ignored. Returns the exit code."""
+    parser = argparse.ArgumentParser(description="SwarmUI Model Downloader - ComfyUI custom nodes")
+    parser.add_argument("--model-path", type=str, default=None)
+    add_node_installer_arguments(parser)
+    args, _ = parser.parse_known_args(argv)
+    if args.list_nodes:
+        print(json.dumps(COMFYUI_NODES))
+        return 0
+    NODE_INSTALL_SETTINGS["parallel"] = args.node_parallel
+    comfyui_dir = os.path.abspath(args.comfyui_dir or os.path.join(os.path.dirname(os.path.abspath(args.model_path or get_default_base_path())), "dlbackend", "ComfyUI"))
+    node_report = install_custom_nodes(comfyui_dir, args.node or None, args.node_python or default_node_python(comfyui_dir))
+    print(json.dumps(node_report)) # One line, last on stdout, for notebooks to parse
+    nodes_ok = all(node["status"] != "failed" and node.get("requirements_installed", True) for node in node_report["nodes"])
+    return 0 if nodes_ok else 1
+
+if __name__ == "__main__" and ({"--install-nodes", "--list-nodes"} & set(sys.argv[1:])):
+    sys.exit(run_node_command(sys.argv[1:]))
+
+import gradio as gr
+import httpx
+import numpy as np # Installed with gradio; vectorizes content-defined chunking
 
 try:
-    from huggingface_hub import hf_hub_download, snapshot_download, HfFileSystem
-    from huggingface_hub.utils import HfHubHTTPError, HFValidationError
+    from huggingface_hub import HfApi, hf_hub_url, get_hf_file_metadata
+    from huggingface_hub.utils import HfHubHTTPError, HFValidationError, filter_repo_objects, build_hf_headers
 except ImportError:
     print("huggingface_hub not found. Attempting installation...")
     try:
         subprocess.check_call([sys.executable, "-m", "pip", "install", "huggingface_hub>=0.20.0"]) # Added version specifier
         import importlib
         importlib.invalidate_caches()
-        from huggingface_hub import hf_hub_download, snapshot_download, HfFileSystem
-        from huggingface_hub.utils import HfHubHTTPError, HFValidationError
+        from huggingface_hub import HfApi, hf_hub_url, get_hf_file_metadata
+        from huggingface_hub.utils import HfHubHTTPError, HFValidationError, filter_repo_objects, build_hf_headers
         print("huggingface_hub installed and imported successfully.")
     except Exception as e:
         print(f"ERROR: Failed to install or import huggingface_hub: {e}")
@@ -39,9 +284,11 @@ def install_package(package_name, version_spec=""):
         if package_name == "huggingface_hub":
             import importlib
             importlib.invalidate_caches()
-            globals()['hf_hub_download'] = importlib.import_module('huggingface_hub').hf_hub_download
-            globals()['snapshot_download'] = importlib.import_module('huggingface_hub').snapshot_download
-            globals()['HfFileSystem'] = importlib.import_module('huggingface_hub').HfFileSystem
+            globals()['HfApi'] = importlib.import_module('huggingface_hub').HfApi
+            globals()['hf_hub_url'] = importlib.import_module('huggingface_hub').hf_hub_url
+            globals()['get_hf_file_metadata'] = importlib.import_module('huggingface_hub').get_hf_file_metadata
+            globals()['build_hf_headers'] = importlib.import_module('huggingface_hub.utils').build_hf_headers
+            globals()['filter_repo_objects'] = importlib.import_module('huggingface_hub.utils').filter_repo_objects
             globals()['HfHubHTTPError'] = importlib.import_module('huggingface_hub.utils').HfHubHTTPError
             globals()['HFValidationError'] = importlib.import_module('huggingface_hub.utils').HFValidationError
         elif package_name == "hf_transfer":
@@ -624,23 +871,6 @@ models_structure = {
 }
 
 
-def get_default_base_path():
-    """Determines the default base path based on the OS and known paths."""
-    system = platform.system()
-    if system == "Windows":
-        swarm_path = os.environ.get("SWARM_MODEL_PATH")
-        if swarm_path and os.path.isdir(swarm_path): return swarm_path
-        return os.path.join(os.getcwd(), "SwarmUI", "Models")
-    else:  # Linux/Unix systems
-        swarm_path = os.environ.get("SWARM_MODEL_PATH")
-        if swarm_path and os.path.isdir(swarm_path): return swarm_path
-        if os.path.exists("/home/Ubuntu/apps/StableSwarmUI"):
-            return "/home/Ubuntu/apps/StableSwarmUI/Models"
-        elif os.path.exists("/workspace/SwarmUI"):
-            return "/workspace/SwarmUI/Models"
-        else:
-            return os.path.join(os.getcwd(), "SwarmUI", "Models")
-
 DEFAULT_BASE_PATH = get_default_base_path()
 
 BASE_SUBDIRS = { # Renamed from SUBDIRS
@@ -774,10 +1004,34 @@ def ensure_directories_exist(base_path: str, is_comfy_ui_structure: bool):
 # --- Download Queue and Worker ---
 
 download_queue = queue.Queue()
-status_updates = queue.Queue()
 stop_worker = threading.Event()
 log_history = []
 log_lock = threading.Lock()
+log_state = {"seq": 0} # Bumped per message; each UI session compares it with the last one it rendered
+pending_task_keys = {} # Target key (see _task_dedup_key) -> id of the task queued or downloading for it; duplicates are dropped
+pending_lock = threading.Lock()
+task_states = collections.OrderedDict() # task id -> {"state", "name", ...}, oldest first; see update_task_state
+task_states_lock = threading.Lock()
+TASK_STATES_MAX_FINISHED = 2000 # Finished tasks kept for status queries
+FINISHED_TASK_STATES = ("success", "skipped", "failed")
+deferred_tasks = [] # Heap of (retry_at, seq, task) for tasks waiting out an open circuit breaker
+deferred_lock = threading.Lock()
+deferred_sequence = itertools.count()
+
+def update_task_state(task_id: str, **fields):
+    """Records a task's progress for status queries, dropping the oldest finished tasks beyond TASK_STATES_MAX_FINISHED."""
+    with task_states_lock:
+        state = task_states.setdefault(task_id, {"task_id": task_id})
+        state.update(fields)
+        state["updated_at"] = time.time()
+        finished = [tid for tid, s in task_states.items() if s.get("state") in FINISHED_TASK_STATES]
+        for old_task_id in finished[:max(0, len(finished) - TASK_STATES_MAX_FINISHED)]:
+            del task_states[old_task_id]
+
+def get_task_state(task_id: str) -> dict | None:
+    with task_states_lock:
+        state = task_states.get(task_id)
+        return dict(state) if state else None
 
 def add_log(message):
     """Adds a message to the log history and prints it."""
@@ -786,14 +1040,15 @@ def add_log(message):
         log_history.append(f"[{time.strftime('%H:%M:%S')}] {message}")
         if len(log_history) > 100:
             log_history.pop(0)
-    if status_updates:
-        try:
-            log_str = "\n".join(map(str, log_history))
-            status_updates.put_nowait(log_str) 
-        except queue.Full:
-            print("Warning: Status update queue is full, skipping update.") 
-        except Exception as e:
-            print(f"Error putting log update to queue: {e}")
+        log_state["seq"] += 1
+    publish_live_event({"ts": round(time.time(), 3), "event": "log", "message": str(message)})
+
+def render_log_since(cursor: int):
+    """(log text, new cursor), or (None, cursor) if nothing was logged since cursor."""
+    with log_lock:
+        if log_state["seq"] == cursor:
+            return None, cursor
+        return "\n".join(map(str, log_history)), log_state["seq"]
 
 
 def get_target_path(base_path: str, model_info: dict, sub_category_info: dict, is_comfy_ui_structure: bool) -> str:
@@ -821,282 +1076,4474 @@ def get_target_path(base_path: str, model_info: dict, sub_category_info: dict, i
         add_log(f"ERROR: Could not ensure target directory {target_dir} exists: {e}")
     return target_dir
 
-def _download_model_internal(model_info, sub_category_info, base_path, use_hf_transfer, is_comfy_ui_structure):
-    """Handles the download of a single model or snapshot directly to the target folder."""
-    model_name = model_info.get('name', model_info.get('repo_id'))
-    repo_id = model_info.get('repo_id')
-    filename = model_info.get('filename_in_repo') 
-    save_filename = model_info.get('save_filename') 
-    is_snapshot = model_info.get('is_snapshot', False)
-    allow_patterns = model_info.get('allow_patterns')
-    pre_delete = model_info.get('pre_delete_target', False)
-    allow_overwrite = model_info.get('allow_overwrite', False)
+# --- Metrics ---
+# Prometheus text-format metrics, served at /metrics by the service endpoint (see --service-port).
 
-    if not repo_id:
-        add_log(f"ERROR: Missing 'repo_id' for model {model_name}. Skipping.")
-        return
-    if not base_path:
-        add_log(f"ERROR: Missing 'base_path' for model {model_name}. Skipping.")
-        return
+METRIC_DEFINITIONS = {
+    "swarmdl_bytes_downloaded_total": ("counter", "Bytes written by the download engine."),
+    "swarmdl_files_downloaded_total": ("counter", "Files finalized by the download engine."),
+    "swarmdl_task_duration_seconds": ("histogram", "Wall-clock duration of queued download tasks."),
+    "swarmdl_tasks_total": ("counter", "Finished download tasks by outcome."),
+    "swarmdl_queue_depth": ("gauge", "Tasks waiting in the download queue, including tasks deferred by a circuit breaker."),
+    "swarmdl_retries_total": ("counter", "Transfer attempts retried after a transient error."),
+    "swarmdl_mirror_fetches_total": ("counter", "Files requested from LAN mirrors, by outcome (hit, miss, error)."),
+    "swarmdl_mirror_bytes_served_total": ("counter", "Bytes served to peers from the local content store."),
+    "swarmdl_inflight_transfers": ("gauge", "HTTP requests currently running on the async transfer core."),
+    "swarmdl_circuit_open": ("gauge", "1 while a host's circuit breaker is open (requests to it are deferred)."),
+    "swarmdl_cache_lookups_total": ("counter", "Checks that could avoid a transfer (skip-if-present, snapshot diff, queue dedup)."),
+    "swarmdl_cache_hits_total": ("counter", "Checks that did avoid a transfer."),
+    "swarmdl_throughput_bytes_per_second": ("gauge", "Download throughput over the last THROUGHPUT_WINDOW_SECONDS."),
+    "swarmdl_evicted_bytes_total": ("counter", "Bytes of least-recently-used models removed to make room, by target_dir_key."),
+    "swarmdl_warmed_bytes_total": ("counter", "Bytes read into the page cache ahead of model loading."),
+    "swarmdl_delta_reused_bytes_total": ("counter", "Bytes of new file versions copied from the old version instead of fetched (delta sync)."),
+}
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+THROUGHPUT_WINDOW_SECONDS = 10.0
 
-    target_dir = get_target_path(base_path, model_info, sub_category_info, is_comfy_ui_structure)
-    if not os.path.isdir(target_dir): # Re-check after get_target_path's makedirs attempt
-         add_log(f"ERROR: Target directory {target_dir} could not be confirmed for {model_name}. Skipping.")
-         return
+metrics_lock = threading.Lock()
+_metric_values = {} # (name, labels) -> float, for counters and gauges
+_metric_histograms = {} # (name, labels) -> {"buckets": [...], "sum": float, "count": int}
+_throughput_samples = collections.deque() # (timestamp, bytes)
+task_transfer_stats = {} # task_id -> {"bytes", "backends"} while the task runs
 
-    final_target_path = os.path.join(target_dir, save_filename) if save_filename else None
+def _metric_labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
 
-    if pre_delete and final_target_path and os.path.exists(final_target_path):
-        try:
-            if os.path.isfile(final_target_path):
-                 os.remove(final_target_path)
-                 add_log(f"INFO: Pre-deleted existing final target file: {final_target_path}")
-            else:
-                 add_log(f"WARNING: Pre-delete requested, but final target path is not a file: {final_target_path}")
-        except OSError as e:
-            add_log(f"WARNING: Could not pre-delete existing final target file {final_target_path}: {e}. Proceeding download attempt.")
+def metric_inc(name: str, amount=1, **labels):
+    key = (name, _metric_labels(labels))
+    with metrics_lock:
+        _metric_values[key] = _metric_values.get(key, 0) + amount
 
-    if not is_snapshot and final_target_path and os.path.exists(final_target_path) and not allow_overwrite and not pre_delete: # Added not pre_delete condition
-        add_log(f"INFO: Final target file '{final_target_path}' already exists and overwrite/pre-delete not allowed. Skipping download for '{model_name}'.")
-        return
+def metric_set(name: str, value, **labels):
+    with metrics_lock:
+        _metric_values[(name, _metric_labels(labels))] = value
 
-    if is_snapshot:
-        snapshot_target_dir_exists = os.path.exists(target_dir)
-        snapshot_target_dir_populated = snapshot_target_dir_exists and len(os.listdir(target_dir)) > 0 # Use os.listdir on resolved target_dir
-        if snapshot_target_dir_populated and not allow_overwrite:
-             add_log(f"INFO: Snapshot target directory '{target_dir}' exists and seems populated. Skipping snapshot download for '{repo_id}' as overwrite not allowed.")
-             return
+def metric_observe(name: str, value, **labels):
+    key = (name, _metric_labels(labels))
+    with metrics_lock:
+        histogram = _metric_histograms.setdefault(key, {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0})
+        for i, upper_bound in enumerate(DURATION_BUCKETS):
+            if value <= upper_bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
 
-    add_log(f"Starting download: {model_name}...")
-    try:
-        start_time = time.time()
-        actual_downloaded_path = None 
+def record_cache_lookup(kind: str, hit: bool, count: int = 1):
+    """Counts skip/dedup opportunities so the hit rate can be derived as hits / lookups."""
+    metric_inc("swarmdl_cache_lookups_total", count, kind=kind)
+    if hit:
+        metric_inc("swarmdl_cache_hits_total", count, kind=kind)
 
-        if is_snapshot:
-            add_log(f" -> Downloading snapshot from {repo_id} directly to {target_dir}...")
-            actual_downloaded_path = snapshot_download(
-                repo_id=repo_id,
-                local_dir=target_dir, # Use resolved target_dir
-                local_dir_use_symlinks=False,
-                allow_patterns=allow_patterns,
-                force_download=allow_overwrite, 
-            )
-            add_log(f" -> Snapshot download complete for {repo_id} into {actual_downloaded_path}.")
-            final_target_path = actual_downloaded_path
+def record_bytes_downloaded(num_bytes: int, repo: str, backend: str, task_id=None):
+    """Feeds the per-repo/backend byte counter, the rolling throughput window and the per-task totals."""
+    metric_inc("swarmdl_bytes_downloaded_total", num_bytes, repo=repo, backend=backend)
+    now = time.time()
+    with metrics_lock:
+        _throughput_samples.append((now, num_bytes))
+        if task_id is not None:
+            stats = task_transfer_stats.setdefault(task_id, {"bytes": 0, "backends": set()})
+            stats["bytes"] += num_bytes
+            stats["backends"].add(backend)
 
-        elif filename and save_filename and final_target_path:
-            add_log(f" -> Downloading file '{filename}' from {repo_id} into '{target_dir}' (preserving structure from filename)...")
+def pop_task_transfer_stats(task_id) -> dict:
+    """Returns and forgets what a finished task transferred: {"bytes", "backends"}."""
+    with metrics_lock:
+        return task_transfer_stats.pop(task_id, None) or {"bytes": 0, "backends": set()}
 
-            force_the_download = allow_overwrite or pre_delete 
+def current_throughput() -> float:
+    """Bytes per second across all transfers over the last THROUGHPUT_WINDOW_SECONDS."""
+    cutoff = time.time() - THROUGHPUT_WINDOW_SECONDS
+    with metrics_lock:
+        while _throughput_samples and _throughput_samples[0][0] < cutoff:
+            _throughput_samples.popleft()
+        return sum(num_bytes for _, num_bytes in _throughput_samples) / THROUGHPUT_WINDOW_SECONDS
 
-            actual_downloaded_path = hf_hub_download(
-                repo_id=repo_id,
-                filename=filename,
-                local_dir=target_dir, # Use resolved target_dir
-                local_dir_use_symlinks=False, 
-                force_download=force_the_download, 
-            )
-            add_log(f" -> File downloaded to actual path: {actual_downloaded_path}")
-
-            if actual_downloaded_path != final_target_path:
-                add_log(f" -> Renaming '{actual_downloaded_path}' to '{final_target_path}'...")
-
-                os.makedirs(os.path.dirname(final_target_path), exist_ok=True)
-
-                if os.path.exists(final_target_path):
-                    if allow_overwrite or pre_delete:
-                        add_log(f" -> Final target path {final_target_path} exists. Removing before rename...")
-                        try:
-                            if os.path.isfile(final_target_path):
-                                os.remove(final_target_path)
-                            else:
-                                add_log(f" -> WARNING: Cannot remove final target path as it's not a file: {final_target_path}")
-                                raise OSError(f"Target path for rename is not a file: {final_target_path}")
-                        except OSError as e:
-                            add_log(f"ERROR: Failed to remove existing file at final path '{final_target_path}' before rename: {e}. Aborting rename.")
-                            raise e 
-                    else:
-                        add_log(f"ERROR: Final target path {final_target_path} exists and overwrite not allowed. Cannot rename. Downloaded file remains at '{actual_downloaded_path}'.")
-                        return 
-                try:
-                    os.rename(actual_downloaded_path, final_target_path)
-                    add_log(f" -> Successfully renamed to: {final_target_path}")
-                except OSError as e:
-                    add_log(f"ERROR: Failed to rename '{actual_downloaded_path}' to '{final_target_path}': {e}")
-                    add_log(f" -> The originally downloaded file likely remains at: {actual_downloaded_path}")
-                    raise e 
-            else:
-                add_log(f" -> Actual download path matches desired final path. No rename needed.")
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
 
+def _format_metric_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in pairs) + "}"
+
+def render_metrics_text() -> str:
+    """Renders all metrics in the Prometheus text exposition format."""
+    with deferred_lock:
+        deferred_count = len(deferred_tasks)
+    metric_set("swarmdl_queue_depth", download_queue.qsize() + deferred_count)
+    metric_set("swarmdl_throughput_bytes_per_second", current_throughput())
+    with metrics_lock:
+        values = dict(_metric_values)
+        histograms = copy.deepcopy(_metric_histograms)
+    lines = []
+    for name, (metric_type, help_text) in METRIC_DEFINITIONS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if metric_type == "histogram":
+            for (h_name, labels), histogram in sorted(histograms.items()):
+                if h_name != name:
+                    continue
+                for upper_bound, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                    lines.append(f"{name}_bucket{_format_metric_labels(labels, (('le', str(upper_bound)),))} {count}")
+                lines.append(f"{name}_bucket{_format_metric_labels(labels, (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{name}_sum{_format_metric_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{_format_metric_labels(labels)} {histogram['count']}")
         else:
-             if is_snapshot: 
-                 add_log(f"ERROR: Internal logic error for snapshot {model_name}. Skipping.")
-             elif not filename:
-                  add_log(f"ERROR: Invalid configuration for model {model_name}. Missing 'filename_in_repo'. Skipping.")
-             elif not save_filename:
-                  add_log(f"ERROR: Invalid configuration for model {model_name}. Missing 'save_filename'. Skipping.")
-             else:
-                  add_log(f"ERROR: Invalid configuration for model {model_name}. Path issue? Skipping.")
-             return 
+            for (v_name, labels), value in sorted(values.items()):
+                if v_name == name:
+                    lines.append(f"{name}{_format_metric_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
 
-        end_time = time.time()
-        success_path = final_target_path if not is_snapshot else actual_downloaded_path 
-        add_log(f"SUCCESS: Downloaded and processed {model_name} in {end_time - start_time:.2f} seconds. Final location: {success_path}")
+# --- Event Log ---
+# Optional JSON-lines event log (--event-log). emit_event() only enqueues; a background
+# thread batches the writes and rotates by size, so download threads never block on disk.
 
-    except (HfHubHTTPError, HFValidationError) as e:
-        add_log(f"ERROR downloading {model_name} (HF Hub): {type(e).__name__} - {str(e)}")
-    except FileNotFoundError as e:
-         add_log(f"ERROR during file operation for {model_name} (File System): {type(e).__name__} - {str(e)}")
-    except OSError as e:
-         add_log(f"ERROR during file operation (rename/delete) for {model_name} (OS Error/Permissions): {type(e).__name__} - {str(e)}")
-    except Exception as e:
-        add_log(f"UNEXPECTED ERROR during download/process for {model_name}: {type(e).__name__} - {str(e)}")
-        if 'actual_downloaded_path' in locals() and actual_downloaded_path:
-             add_log(f" -> State before error: actual_downloaded_path='{actual_downloaded_path}'")
-        if 'final_target_path' in locals() and final_target_path:
-             add_log(f" -> State before error: final_target_path='{final_target_path}'")
+EVENT_LOG_QUEUE_SIZE = 10000
+EVENT_LOG_FLUSH_INTERVAL = 1.0
+EVENT_LOG_BUFFER_SIZE = 256 * 1024
 
-def download_worker():
-    """Worker thread function to process the download queue."""
-    print("Download worker thread started.")
-    while not stop_worker.is_set():
-        try:
-            task = download_queue.get(timeout=1)
-        except queue.Empty:
-            continue
+event_log_queue = None # queue.Queue while the writer runs, None when disabled
+event_log_thread = None
+event_log_dropped = 0
 
-        model_info, sub_category_info, base_path, use_hf_transfer, is_comfy_ui_structure = task # Added is_comfy_ui_structure
-        original_hf_transfer_env = None
-        try:
-            original_hf_transfer_env = os.environ.get('HF_HUB_ENABLE_HF_TRANSFER')
-            transfer_env_value = '1' if use_hf_transfer and HF_TRANSFER_AVAILABLE else '0'
-            os.environ['HF_HUB_ENABLE_HF_TRANSFER'] = transfer_env_value
-            
-            _download_model_internal(model_info, sub_category_info, base_path, use_hf_transfer, is_comfy_ui_structure) # Pass is_comfy_ui_structure
+def emit_event(event_type: str, **fields):
+    """Publishes a structured event to live observers and queues it for the event log, if enabled."""
+    global event_log_dropped
+    record = {"ts": round(time.time(), 3), "event": event_type}
+    record.update(fields)
+    publish_live_event(record)
+    if event_log_queue is None:
+        return
+    try:
+        event_log_queue.put_nowait(record)
+    except queue.Full:
+        event_log_dropped += 1 # Never stall a download for the log; the writer reports drops
 
-        except Exception as e:
-            model_name_for_log = model_info.get('name', 'unknown task')
-            add_log(f"CRITICAL WORKER ERROR processing '{model_name_for_log}': {type(e).__name__} - {e}")
-        finally:
-            if original_hf_transfer_env is None:
-                if 'HF_HUB_ENABLE_HF_TRANSFER' in os.environ:
-                    del os.environ['HF_HUB_ENABLE_HF_TRANSFER']
-            else:
-                os.environ['HF_HUB_ENABLE_HF_TRANSFER'] = original_hf_transfer_env
-            download_queue.task_done()
-    print("Download worker thread stopped.")
+def _rotate_event_log(log_path: str, backups: int):
+    """log -> log.1 -> log.2 ... keeping at most `backups` old files."""
+    for index in range(backups - 1, 0, -1):
+        older = f"{log_path}.{index}"
+        if os.path.exists(older):
+            os.replace(older, f"{log_path}.{index + 1}")
+    if backups > 0:
+        os.replace(log_path, f"{log_path}.1")
+    else:
+        os.remove(log_path)
 
+def _event_log_writer(events: queue.Queue, log_path: str, max_bytes: int, backups: int):
+    global event_log_dropped
+    log_file = open(log_path, "a", encoding="utf-8", buffering=EVENT_LOG_BUFFER_SIZE)
+    written = log_file.tell()
+    running = True
+    while running:
+        try:
+            batch = [events.get(timeout=EVENT_LOG_FLUSH_INTERVAL)]
+        except queue.Empty:
+            batch = []
+        while True:
+            try:
+                batch.append(events.get_nowait())
+            except queue.Empty:
+                break
+        if event_log_dropped:
+            dropped, event_log_dropped = event_log_dropped, 0
+            batch.append({"ts": round(time.time(), 3), "event": "events_dropped", "count": dropped})
+        for record in batch:
+            if record is None: # Shutdown sentinel
+                running = False
+                continue
+            line = json.dumps(record, default=str) + "\n"
+            if max_bytes and written + len(line) > max_bytes and written > 0:
+                log_file.close()
+                try:
+                    _rotate_event_log(log_path, backups)
+                except OSError as e:
+                    print(f"Warning: Could not rotate event log {log_path}: {e}")
+                log_file = open(log_path, "a", encoding="utf-8", buffering=EVENT_LOG_BUFFER_SIZE)
+                written = log_file.tell()
+            log_file.write(line)
+            written += len(line)
+        log_file.flush()
+    log_file.close()
 
-# --- Filtering Logic ---
-# No changes needed in filter_models for this request.
-def filter_models(structure, search_term):
-    search_term = search_term.lower().strip()
-    visibility = {} 
-    if not search_term:
-        for cat_name, cat_data in structure.items():
-            cat_key = f"cat_{cat_name}"
-            visibility[cat_key] = True
-            if "sub_categories" in cat_data:
-                for sub_cat_name in cat_data["sub_categories"]:
-                    sub_cat_key = f"subcat_{cat_name}_{sub_cat_name}"
-                    visibility[sub_cat_key] = True
-            elif "bundles" in cat_data:
-                for i, bundle_data in enumerate(cat_data["bundles"]):
-                     bundle_key = f"bundle_{cat_name}_{i}"
-                     visibility[bundle_key] = True
-                     bundle_button_key = f"bundlebutton_{cat_name}_{i}"
-                     visibility[bundle_button_key] = True
-        return visibility
-    for cat_name, cat_data in structure.items():
-        cat_key = f"cat_{cat_name}"
-        visibility[cat_key] = False 
-        if "sub_categories" in cat_data:
-            for sub_cat_name in cat_data["sub_categories"]:
-                sub_cat_key = f"subcat_{cat_name}_{sub_cat_name}"
-                visibility[sub_cat_key] = False
-        elif "bundles" in cat_data:
-             for i, bundle_data in enumerate(cat_data["bundles"]):
-                 bundle_key = f"bundle_{cat_name}_{i}"
-                 visibility[bundle_key] = False
-                 bundle_button_key = f"bundlebutton_{cat_name}_{i}"
-                 visibility[bundle_button_key] = False
-    for cat_name, cat_data in structure.items():
-        cat_key = f"cat_{cat_name}"
-        cat_match = search_term in cat_name.lower()
-        cat_becomes_visible = cat_match 
-        if "sub_categories" in cat_data:
-            for sub_cat_name, sub_cat_data in cat_data["sub_categories"].items():
-                sub_cat_key = f"subcat_{cat_name}_{sub_cat_name}"
-                sub_cat_match = search_term in sub_cat_name.lower()
-                sub_cat_becomes_visible = sub_cat_match 
-                model_match_found = False
-                for model_info in sub_cat_data.get("models", []):
-                    model_name = model_info.get("name", "").lower()
-                    if search_term in model_name:
-                        model_match_found = True
-                        break 
-                if model_match_found or sub_cat_match:
-                    visibility[sub_cat_key] = True 
-                    cat_becomes_visible = True 
-            if cat_becomes_visible:
-                 visibility[cat_key] = True 
-        elif "bundles" in cat_data:
-             bundle_match_found_in_cat = False
-             for i, bundle_data in enumerate(cat_data["bundles"]):
-                 bundle_key = f"bundle_{cat_name}_{i}"
-                 bundle_button_key = f"bundlebutton_{cat_name}_{i}"
-                 bundle_name = bundle_data.get("name", "").lower()
-                 bundle_info = bundle_data.get("info", "").lower() 
-                 if search_term in bundle_name or search_term in bundle_info:
-                     visibility[bundle_key] = True
-                     visibility[bundle_button_key] = True
-                     bundle_match_found_in_cat = True
-             if bundle_match_found_in_cat or cat_match: 
-                 visibility[cat_key] = True
-    return visibility
+def start_event_log(log_path: str, max_bytes: int, backups: int):
+    """Enables emit_event() and starts the background writer."""
+    global event_log_queue, event_log_thread
+    os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+    event_log_queue = queue.Queue(maxsize=EVENT_LOG_QUEUE_SIZE)
+    event_log_thread = threading.Thread(target=_event_log_writer, args=(event_log_queue, log_path, max_bytes, backups), daemon=True)
+    event_log_thread.start()
+    print(f"Writing JSON event log to {log_path} (rotating at {format_bytes(max_bytes)}, {backups} backups)")
 
-# --- Bundle Helper ---
-# No changes needed in find_model_by_key for this request.
-def find_model_by_key(category_name, sub_category_name, model_name):
+def stop_event_log(timeout: float = 5.0):
+    """Flushes pending events and stops the writer."""
+    global event_log_queue
+    if event_log_queue is None:
+        return
+    pending_queue, event_log_queue = event_log_queue, None
     try:
-        category_data = models_structure[category_name]
-        sub_category_data = category_data["sub_categories"][sub_category_name]
-        for model_info in sub_category_data["models"]:
-            if model_info["name"] == model_name:
-                return model_info, sub_category_data
-        add_log(f"ERROR: Model '{model_name}' not found in '{category_name}' -> '{sub_category_name}'.")
-        return None, None
-    except KeyError:
-        add_log(f"ERROR: Category '{category_name}' or Sub-category '{sub_category_name}' not found while searching for model '{model_name}'.")
-        return None, None
-    except Exception as e:
-        add_log(f"ERROR: Unexpected error finding model '{model_name}': {e}")
-        return None, None
+        pending_queue.put(None, timeout=timeout)
+    except queue.Full:
+        pass
+    if event_log_thread is not None:
+        event_log_thread.join(timeout=timeout)
 
+# --- Live Event Stream ---
+# Fan-out of log lines and structured events to any number of observers: GET /api/events
+# (server-sent events) and the UI's log box. Publishing appends to a ring buffer under a
+# lock and never waits for a reader. Each observer keeps its own cursor (the last sequence
+# number it saw) and catches up at its own pace, so observers never take events from each
+# other. bytes_progress events aren't buffered but coalesced: only the latest per
+# (task, file) is kept, and observers pick up what changed at most every
+# LIVE_PROGRESS_INTERVAL.
 
-# --- Gradio UI Builder ---
+LIVE_EVENT_BUFFER_SIZE = 2000
+LIVE_PROGRESS_INTERVAL = 1.0
+LIVE_KEEPALIVE_SECONDS = 15.0
+COALESCED_EVENT_TYPES = {"bytes_progress"}
 
-def create_ui(default_base_path):
-    """Creates the Gradio interface."""
-    tracked_components = {}
+live_events = collections.deque(maxlen=LIVE_EVENT_BUFFER_SIZE) # (seq, record), seqs contiguous
+live_progress = {} # (task_id, file) -> (version, record)
+live_condition = threading.Condition()
+live_state = {"seq": 0, "progress_version": 0}
 
-    with gr.Blocks(theme=gr.themes.Soft(), title=APP_TITLE) as app:
-        gr.Markdown(f"## {APP_TITLE} V40 > Source : https://www.patreon.com/posts/114517862")
-        gr.Markdown(f"### ComfyUI Installer for SwarmUI's Back-End > https://www.patreon.com/posts/105023709")
-        gr.Markdown(f"### 5 May 2025 Main How To Install & Use Tutorial : https://youtu.be/fTzlQ0tjxj0")
-        gr.Markdown(f"### 19 May 2025 Wan 2.1 I2V & T2V With CausVid LoRA Tutorial : https://youtu.be/fTzlQ0tjxj0")
-        gr.Markdown("### Select models or bundles to download. Downloads will be added to a queue. Use the search bar to filter.")
+def publish_live_event(record: dict):
+    """Hands an event to live observers. Never blocks on them; progress events don't even wake them."""
+    with live_condition:
+        if record.get("event") in COALESCED_EVENT_TYPES:
+            live_state["progress_version"] += 1
+            live_progress[(record.get("task_id"), record.get("file"))] = (live_state["progress_version"], record)
+            return
+        live_state["seq"] += 1
+        live_events.append((live_state["seq"], dict(record, seq=live_state["seq"])))
+        if record.get("event") == "task_finished":
+            for key in [key for key in live_progress if key[0] == record.get("task_id")]:
+                del live_progress[key]
+        live_condition.notify_all()
 
-        log_output = gr.Textbox(label="Download Status / Log - Watch CMD / Terminal To See Download Status & Speed", lines=10, max_lines=20, interactive=False, value="Welcome! Logs will appear here.")
-        queue_status_label = gr.Markdown(f"Queue Size: {download_queue.qsize()}")
+def read_live_events(cursor: int, progress_cursor: int, timeout: float = 0.0) -> dict:
+    """
+    Events after cursor (waiting up to timeout if there are none yet) and the progress
+    records newer than progress_cursor. Returns {"events", "progress", "cursor",
+    "progress_cursor", "missed"}; missed counts events that left the buffer unread.
+    """
+    with live_condition:
+        if timeout and live_state["seq"] <= cursor:
+            live_condition.wait(timeout)
+        oldest = live_events[0][0] if live_events else live_state["seq"] + 1
+        missed = max(0, oldest - 1 - cursor)
+        events = [record for _, record in itertools.islice(live_events, max(0, cursor + 1 - oldest), None)]
+        progress = [record for version, record in live_progress.values() if version > progress_cursor]
+        return {"events": events, "progress": progress, "cursor": live_state["seq"], "progress_cursor": live_state["progress_version"], "missed": missed}
 
-        with gr.Row():
-             search_box = gr.Textbox(placeholder="Search models or bundles...", label="Search", scale=2, interactive=True)
-             use_hf_transfer_checkbox = gr.Checkbox(label="Enable hf_transfer (Faster Downloads)", value=HF_TRANSFER_AVAILABLE, scale=1)
-        
-        with gr.Row():
-             base_path_input = gr.Textbox(label="Base Download Path (SwarmUI/Models)", value=default_base_path, scale=3)
-             comfy_ui_structure_checkbox = gr.Checkbox(label="ComfyUI Folder Structure (e.g. 'loras' folder)", value=False, scale=1)
+
+# --- Retries and Circuit Breaker ---
+
+RETRY_SETTINGS = {
+    "max_retries": 5,
+    "base_delay": 2.0, # Seconds; doubled per attempt, with jitter
+    "max_delay": 120.0,
+    "breaker_threshold": 5, # Consecutive transient failures before a host is paused
+    "breaker_cooldown": 300.0, # Seconds a paused host is left alone before one trial request
+}
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+RETRYABLE_ERRNOS = {errno.ECONNRESET, errno.ECONNABORTED, errno.ECONNREFUSED, errno.ETIMEDOUT, errno.EPIPE, errno.ENETUNREACH, errno.EHOSTUNREACH}
+# requests' exception names, raised by huggingface_hub versions that still use requests
+RETRYABLE_EXCEPTION_NAMES = {"ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout", "ChunkedEncodingError"}
+
+class IncompleteTransferError(OSError):
+    """The transfer ended before the expected number of bytes arrived."""
+
+class ChecksumMismatchError(OSError):
+    """The downloaded bytes do not hash to the digest the Hub reports."""
+
+class RangeNotSupportedError(OSError):
+    """The server answered a Range request with the whole file."""
+
+class CircuitOpenError(Exception):
+    """Raised instead of contacting a host whose circuit breaker is open."""
+    def __init__(self, host: str, retry_at: float):
+        super().__init__(f"Circuit breaker open for {host} until {time.strftime('%H:%M:%S', time.localtime(retry_at))}")
+        self.host = host
+        self.retry_at = retry_at
+
+circuit_lock = threading.Lock()
+host_circuits = {} # host -> {"failures": int, "opened_at": float | None, "trial_at": float | None}
+
+def is_retryable_error(e: BaseException) -> bool:
+    """Transient network/server errors are retryable; client errors (404, 401, validation) are fatal."""
+    if isinstance(e, (CircuitOpenError, HFValidationError)):
+        return False
+    status_code = getattr(getattr(e, "response", None), "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    if isinstance(e, (IncompleteTransferError, ChecksumMismatchError, httpx.TransportError, TimeoutError, ConnectionError)):
+        return True
+    if type(e).__name__ in RETRYABLE_EXCEPTION_NAMES:
+        return True
+    return isinstance(e, OSError) and e.errno in RETRYABLE_ERRNOS
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with equal jitter: half the capped delay plus a random half."""
+    capped = min(RETRY_SETTINGS["max_delay"], RETRY_SETTINGS["base_delay"] * (2 ** attempt))
+    return capped / 2 + random.uniform(0, capped / 2)
+
+def check_circuit(host: str, take_trial: bool = True):
+    """
+    Raises CircuitOpenError while host is cooling down. After the cooldown the first caller
+    becomes the half-open trial and the others keep getting CircuitOpenError until its
+    outcome is recorded, or until it has run for a whole cooldown without one.
+    take_trial=False is for callers that don't report an outcome: they only pass a closed circuit.
+    """
+    now = time.time()
+    with circuit_lock:
+        circuit = host_circuits.get(host)
+        if not circuit or circuit["opened_at"] is None:
+            return
+        cooldown = RETRY_SETTINGS["breaker_cooldown"]
+        retry_at = circuit["opened_at"] + cooldown
+        if now >= retry_at:
+            trial_at = circuit.get("trial_at")
+            if take_trial and (trial_at is None or now - trial_at >= cooldown):
+                circuit["trial_at"] = now
+                return
+            retry_at = min(trial_at + cooldown, now + RETRY_SETTINGS["max_delay"]) if trial_at is not None else now + RETRY_SETTINGS["base_delay"]
+    raise CircuitOpenError(host, retry_at)
+
+def release_circuit_trial(host: str):
+    """Lets another caller take the half-open trial when this one ended without a transient failure or a success."""
+    with circuit_lock:
+        circuit = host_circuits.get(host)
+        if circuit:
+            circuit["trial_at"] = None
+
+def record_host_success(host: str):
+    with circuit_lock:
+        was_open = host_circuits.pop(host, {}).get("opened_at") is not None
+    if was_open:
+        metric_set("swarmdl_circuit_open", 0, host=host)
+        add_log(f"INFO: {host} is responding again; circuit breaker closed.")
+
+def record_host_failure(host: str):
+    with circuit_lock:
+        circuit = host_circuits.setdefault(host, {"failures": 0, "opened_at": None})
+        circuit["failures"] += 1
+        failures = circuit["failures"]
+        trips = failures >= RETRY_SETTINGS["breaker_threshold"]
+        if trips:
+            circuit["opened_at"] = time.time() # Also re-opens after a failed half-open trial
+            circuit["trial_at"] = None
+    if trips:
+        metric_set("swarmdl_circuit_open", 1, host=host)
+        emit_event("circuit_open", host=host, failures=failures, cooldown_seconds=RETRY_SETTINGS["breaker_cooldown"])
+        add_log(f"WARNING: {host} failed {failures} times in a row. Pausing requests to it for {RETRY_SETTINGS['breaker_cooldown']:.0f}s; other downloads continue.")
+
+def call_with_retries(operation, description: str, task_id=None, max_retries: int | None = None):
+    """
+    Runs operation(contact) with jittered exponential backoff on transient errors.
+    The operation calls contact(host) before talking to a host: that enforces the
+    host's circuit breaker and attributes a failure to the host last contacted.
+    Fatal errors and CircuitOpenError are raised immediately.
+    """
+    if max_retries is None:
+        max_retries = RETRY_SETTINGS["max_retries"]
+    attempt = 0
+    while True:
+        contacted = []
+        def contact(host):
+            check_circuit(host)
+            contacted.append(host)
+        try:
+            result = operation(contact)
+        except Exception as e:
+            if not is_retryable_error(e):
+                for host in set(contacted):
+                    release_circuit_trial(host)
+                raise
+            host = contacted[-1] if contacted else "unknown"
+            if contacted: # Failing before any request (e.g. a full disk) is no host's fault
+                record_host_failure(host)
+            if attempt >= max_retries:
+                raise
+            delay = retry_delay(attempt)
+            attempt += 1
+            metric_inc("swarmdl_retries_total", host=host)
+            emit_event("retry", task_id=task_id, file=description, host=host, attempt=attempt, delay_seconds=round(delay, 2), error_type=type(e).__name__, message=str(e))
+            add_log(f" -> Transient error on '{description}' ({type(e).__name__}: {e}). Retry {attempt}/{max_retries} in {delay:.1f}s...")
+            if stop_worker.wait(delay):
+                raise
+            continue
+        for host in set(contacted):
+            record_host_success(host)
+        return result
+
+
+# --- Write Path ---
+# Downloads are written through TransferFileWriter: the file is preallocated to its
+# expected size (fewer extents on ext4/XFS) and network chunks are coalesced into large
+# page-aligned writes. "dontneed" additionally flushes each written window and drops it
+# from the page cache; "direct" bypasses the cache with O_DIRECT. Both keep a multi-GB
+# download from evicting the weights an inference server on the same host is using.
+
+WRITE_MODES = ("buffered", "dontneed", "direct")
+WRITE_SETTINGS = {
+    "mode": "buffered",
+    "buffer_size": 16 * 1024 * 1024, # Multiple of DIRECT_IO_ALIGNMENT
+    "preallocate": True,
+}
+DIRECT_IO_ALIGNMENT = 4096
+FALLOC_FL_KEEP_SIZE = 0x01
+
+_libc = None
+
+def preallocate_file(fd: int, size: int) -> bool:
+    """
+    Reserves size bytes for fd with fallocate(FALLOC_FL_KEEP_SIZE): blocks are allocated but
+    the file length is unchanged, so resume offsets stay valid. Unlike posix_fallocate this
+    never falls back to writing zeros on filesystems without support. Linux only.
+    """
+    global _libc
+    if not sys.platform.startswith("linux") or size <= 0:
+        return False
+    try:
+        if _libc is None:
+            _libc = ctypes.CDLL(None, use_errno=True)
+            _libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+        return _libc.fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) == 0
+    except (OSError, AttributeError):
+        return False
+
+def drop_cached_range(fd: int, offset: int, length: int):
+    """Writes back and evicts a range from the page cache (dirty pages can't be dropped before writeback)."""
+    if not hasattr(os, "posix_fadvise") or length <= 0:
+        return
+    os.fdatasync(fd)
+    os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+class StreamingDigest:
+    """
+    Digest of a file that is written sequentially, fed with the bytes as they go to disk so
+    verifying a download needs no second read. Survives retries: resume() only re-reads the
+    kept prefix of a partial file when this object didn't hash it itself (e.g. after a
+    restart or a failed write). Algorithms are as in compute_file_digest.
+    """
+    def __init__(self, algorithm: str = "sha256", size: int | None = None):
+        self.algorithm = algorithm
+        self.size = size # Needed for git-sha1's header
+        self.hasher = None
+        self.position = 0
+
+    def _new_hasher(self):
+        if self.algorithm != "git-sha1":
+            return hashlib.new(self.algorithm)
+        hasher = hashlib.sha1()
+        hasher.update(f"blob {self.size}\0".encode())
+        return hasher
+
+    def resume(self, path: str, offset: int):
+        """Makes the digest cover exactly the first offset bytes of path."""
+        if self.hasher is not None and self.position == offset:
+            return
+        self.hasher, self.position = self._new_hasher(), 0
+        if not offset:
+            return
+        with open(path, "rb") as f:
+            while self.position < offset:
+                chunk = f.read(min(HASH_READ_CHUNK_SIZE, offset - self.position))
+                if not chunk:
+                    raise IncompleteTransferError(f"{path} is shorter than its resume offset {offset}")
+                self.update(chunk)
+
+    def update(self, data):
+        self.hasher.update(data)
+        self.position += len(data)
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+class TransferFileWriter:
+    """
+    Sequential writer for a partial download, starting at offset (the resume point).
+    Use append() while has_room() and flush() when it doesn't; flush() does the disk I/O
+    so async callers can run it off the event loop. A StreamingDigest, if given, is fed
+    every byte as it is written (the caller resumes it to offset first).
+    """
+    def __init__(self, path: str, offset: int = 0, expected_size=None, mode: str | None = None, digest: StreamingDigest | None = None):
+        self.mode = mode or WRITE_SETTINGS["mode"]
+        if self.mode == "direct" and (offset % DIRECT_IO_ALIGNMENT or not hasattr(os, "O_DIRECT") or fcntl is None):
+            self.mode = "dontneed" # O_DIRECT needs aligned offsets; a mid-block resume point falls back
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0) | (0 if offset else os.O_TRUNC)
+        if self.mode == "direct":
+            flags |= os.O_DIRECT
+        self.fd = os.open(path, flags, 0o644)
+        if offset:
+            os.ftruncate(self.fd, offset) # Drop anything past the resume point
+        self.position = offset
+        self.cache_window_start = offset
+        self.buffer = mmap.mmap(-1, WRITE_SETTINGS["buffer_size"]) # Anonymous mmap: page-aligned, as O_DIRECT requires
+        self.view = memoryview(self.buffer)
+        self.used = 0
+        self.digest = digest
+        if WRITE_SETTINGS["preallocate"] and expected_size:
+            preallocate_file(self.fd, expected_size)
+
+    def has_room(self, size: int) -> bool:
+        return self.used == 0 or self.used + size <= len(self.buffer)
+
+    def append(self, data: bytes):
+        if self.used + len(data) > len(self.buffer):
+            self.flush()
+        if len(data) > len(self.buffer): # Oversized chunk: write it through
+            self._write(memoryview(data))
+            return
+        self.view[self.used:self.used + len(data)] = data
+        self.used += len(data)
+
+    def _write(self, data):
+        written = 0
+        if not hasattr(os, "pwrite"): # Windows
+            os.lseek(self.fd, self.position, os.SEEK_SET)
+        while written < len(data):
+            if hasattr(os, "pwrite"):
+                written += os.pwrite(self.fd, data[written:], self.position + written)
+            else:
+                written += os.write(self.fd, data[written:])
+        self.position += written
+        if self.digest is not None:
+            self.digest.update(data) # hashlib drops the GIL here, and flush() runs off the event loop
+
+    def flush(self, final: bool = False):
+        if not self.used:
+            return
+        if self.mode == "direct":
+            aligned = self.used - self.used % DIRECT_IO_ALIGNMENT
+            if aligned:
+                self._write(self.view[:aligned])
+            tail = self.used - aligned
+            if tail and not final:
+                self.view[:tail] = self.view[aligned:self.used] # Carry the unaligned tail into the next write
+                self.used = tail
+                return
+            if tail:
+                fcntl.fcntl(self.fd, fcntl.F_SETFL, fcntl.fcntl(self.fd, fcntl.F_GETFL) & ~os.O_DIRECT) # Last partial block goes through the cache
+                self._write(self.view[aligned:self.used])
+        else:
+            self._write(self.view[:self.used])
+        self.used = 0
+        if self.mode != "buffered":
+            drop_cached_range(self.fd, self.cache_window_start, self.position - self.cache_window_start)
+            self.cache_window_start = self.position
+
+    def close(self):
+        try:
+            self.flush(final=True)
+        finally:
+            self.view.release()
+            self.buffer.close()
+            os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def benchmark_write_modes(directory: str, size_bytes: int, chunk_size: int | None = None) -> list:
+    """
+    Writes size_bytes of incompressible data through each write mode and reports
+    throughput, CPU time and how much of the file is left in the page cache (Linux).
+    """
+    os.makedirs(directory, exist_ok=True)
+    chunk_size = chunk_size or TRANSFER_BUFFER_SIZE # Same chunking as network reads
+    chunk = os.urandom(chunk_size)
+    results = []
+    for mode in WRITE_MODES:
+        path = os.path.join(directory, f".swarmdl-write-benchmark-{mode}{PARTIAL_SUFFIX}")
+        cached_before = _meminfo_cached_bytes()
+        cpu_before, wall_before = time.process_time(), time.perf_counter()
+        with TransferFileWriter(path, 0, size_bytes, mode) as writer:
+            effective_mode = writer.mode
+            remaining = size_bytes
+            while remaining > 0:
+                piece = chunk[:min(chunk_size, remaining)]
+                writer.append(piece)
+                remaining -= len(piece)
+        with open(path, "rb+") as f:
+            os.fsync(f.fileno())
+        wall = time.perf_counter() - wall_before
+        cpu = time.process_time() - cpu_before
+        cached_after = _meminfo_cached_bytes()
+        results.append({
+            "mode": mode,
+            "effective_mode": effective_mode,
+            "bytes": size_bytes,
+            "seconds": round(wall, 3),
+            "mb_per_second": round(size_bytes / wall / (1024 * 1024), 1) if wall else None,
+            "cpu_seconds": round(cpu, 3),
+            "page_cache_growth_bytes": cached_after - cached_before if cached_before is not None and cached_after is not None else None,
+        })
+        os.remove(path)
+    return results
+
+def _meminfo_cached_bytes():
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("Cached:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+# --- Async Transfer Core ---
+# All HTTP byte transfers run as coroutines on one event loop thread with a shared
+# httpx.AsyncClient, so connections are kept alive and reused across files and an idle
+# in-flight stream costs a coroutine rather than a thread. Concurrency is bounded by a
+# global semaphore and one semaphore per host. Worker threads (the queue worker, snapshot
+# pools, the UI) call in through run_transfer/submit_transfer, which are thread-safe.
+
+TRANSFER_SETTINGS = {
+    "max_connections": 64, # Concurrent requests across all hosts
+    "max_connections_per_host": 16,
+    "keepalive_expiry": 30.0, # Seconds an idle pooled connection is kept open
+    "parallel_streams": 8, # Range requests per file on the "parallel" backend
+}
+
+transfer_loop = None
+transfer_loop_lock = threading.Lock()
+_transfer_client = None # httpx.AsyncClient; created and used on the transfer loop only
+_transfer_global_slots = None
+_transfer_host_slots = {} # host -> asyncio.Semaphore
+_transfer_inflight = 0
+
+def _transfer_loop_main(loop, ready: threading.Event):
+    asyncio.set_event_loop(loop)
+    loop.call_soon(ready.set)
+    loop.run_forever()
+
+def get_transfer_loop():
+    """Returns the transfer event loop, starting its thread on first use."""
+    global transfer_loop
+    with transfer_loop_lock:
+        if transfer_loop is None:
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            threading.Thread(target=_transfer_loop_main, args=(loop, ready), name="transfer-core", daemon=True).start()
+            ready.wait()
+            transfer_loop = loop
+    return transfer_loop
+
+def submit_transfer(coro):
+    """Schedules a coroutine on the transfer loop from any thread. Returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_transfer_loop())
+
+def run_transfer(coro):
+    """Runs a coroutine on the transfer loop and blocks the calling thread until it finishes."""
+    future = submit_transfer(coro)
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel() # E.g. KeyboardInterrupt in the caller: don't leave the stream running
+        raise
+
+def stop_transfer_core(timeout: float = 5.0):
+    """Closes pooled connections and stops the loop thread."""
+    global transfer_loop, _transfer_client
+    with transfer_loop_lock:
+        loop, transfer_loop = transfer_loop, None
+    if loop is None:
+        return
+    async def close_client():
+        global _transfer_client
+        if _transfer_client is not None:
+            await _transfer_client.aclose()
+            _transfer_client = None
+    try:
+        asyncio.run_coroutine_threadsafe(close_client(), loop).result(timeout)
+    except Exception as e:
+        print(f"Warning: Could not close transfer connections cleanly: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+
+def _transfer_client_on_loop() -> httpx.AsyncClient:
+    global _transfer_client, _transfer_global_slots
+    if _transfer_client is None:
+        limits = httpx.Limits(
+            max_connections=TRANSFER_SETTINGS["max_connections"],
+            max_keepalive_connections=TRANSFER_SETTINGS["max_connections"],
+            keepalive_expiry=TRANSFER_SETTINGS["keepalive_expiry"],
+        )
+        _transfer_client = httpx.AsyncClient(limits=limits, timeout=TRANSFER_TIMEOUT, follow_redirects=True)
+        _transfer_global_slots = asyncio.Semaphore(TRANSFER_SETTINGS["max_connections"])
+    return _transfer_client
+
+@contextlib.asynccontextmanager
+async def transfer_slot(host: str):
+    """Holds one global and one per-host concurrency slot for the duration of a request."""
+    global _transfer_inflight
+    _transfer_client_on_loop()
+    host_slots = _transfer_host_slots.setdefault(host, asyncio.Semaphore(TRANSFER_SETTINGS["max_connections_per_host"]))
+    async with _transfer_global_slots, host_slots:
+        _transfer_inflight += 1
+        metric_set("swarmdl_inflight_transfers", _transfer_inflight)
+        try:
+            yield
+        finally:
+            _transfer_inflight -= 1
+            metric_set("swarmdl_inflight_transfers", _transfer_inflight)
+
+async def _request_async(method: str, url: str, headers=None, follow_redirects: bool = True) -> httpx.Response:
+    async with transfer_slot(httpx.URL(url).host):
+        return await _transfer_client_on_loop().request(method, url, headers=headers, follow_redirects=follow_redirects)
+
+def transfer_request(method: str, url: str, headers=None, follow_redirects: bool = True) -> httpx.Response:
+    """A small request (HEAD, listing) over the shared pool. The body is read before returning."""
+    return run_transfer(_request_async(method, url, headers, follow_redirects))
+
+async def _stream_url_to_file_async(url: str, dest_path: str, headers: dict, progress=None, expected_size=None, digest: StreamingDigest | None = None):
+    offset = os.path.getsize(dest_path) if os.path.exists(dest_path) else 0
+    if expected_size is not None and offset > expected_size:
+        offset = 0
+    if expected_size is not None and offset == expected_size:
+        if digest is not None:
+            await asyncio.to_thread(digest.resume, dest_path, offset)
+        return
+    request_headers = dict(headers)
+    if offset:
+        request_headers["Range"] = f"bytes={offset}-"
+    async with transfer_slot(httpx.URL(url).host):
+        async with _transfer_client_on_loop().stream("GET", url, headers=request_headers) as response:
+            response.raise_for_status()
+            if offset and response.status_code != 206:
+                offset = 0 # Server ignored the range; start over
+            if digest is not None:
+                await asyncio.to_thread(digest.resume, dest_path, offset)
+            # Buffer flushes run off the loop; a stalled disk still throttles this stream, which is the backpressure we want
+            writer = TransferFileWriter(dest_path, offset, expected_size, digest=digest)
+            try:
+                async for chunk in response.aiter_bytes(TRANSFER_BUFFER_SIZE):
+                    if not writer.has_room(len(chunk)):
+                        await asyncio.to_thread(writer.flush)
+                    writer.append(chunk)
+                    if progress:
+                        progress(len(chunk))
+            finally:
+                await asyncio.to_thread(writer.close)
+
+async def _fetch_range_async(url: str, headers: dict, start: int, end: int) -> bytes:
+    """One Range GET for bytes [start, end), read into memory."""
+    async with transfer_slot(httpx.URL(url).host):
+        response = await _transfer_client_on_loop().get(url, headers=dict(headers, Range=f"bytes={start}-{end - 1}"))
+    response.raise_for_status()
+    if response.status_code == 200:
+        raise RangeNotSupportedError(f"{httpx.URL(url).host} ignored the Range header")
+    if response.status_code != 206 or len(response.content) != end - start:
+        raise IncompleteTransferError(f"Range {start}-{end - 1} returned {response.status_code} with {len(response.content)} bytes")
+    return response.content
+
+async def _stream_url_parallel_async(url: str, dest_path: str, headers: dict, expected_size: int, progress=None, digest: StreamingDigest | None = None):
+    """
+    Downloads the rest of dest_path as concurrent Range requests of PARALLEL_CHUNK_SIZE
+    (TRANSFER_SETTINGS["parallel_streams"] at a time). Chunks are written, and hashed,
+    strictly in file order: one that arrives early waits in memory for those before it, so
+    the partial file is always a contiguous prefix that later attempts can resume.
+    """
+    offset = os.path.getsize(dest_path) if os.path.exists(dest_path) else 0
+    if offset > expected_size:
+        offset = 0
+    if digest is not None:
+        await asyncio.to_thread(digest.resume, dest_path, offset)
+    if offset == expected_size:
+        return
+    chunk_starts = iter(range(offset, expected_size, PARALLEL_CHUNK_SIZE))
+    in_flight = collections.deque()
+    def start_next():
+        start = next(chunk_starts, None)
+        if start is not None:
+            in_flight.append(asyncio.ensure_future(_fetch_range_async(url, headers, start, min(start + PARALLEL_CHUNK_SIZE, expected_size))))
+    writer = TransferFileWriter(dest_path, offset, expected_size, digest=digest)
+    try:
+        for _ in range(TRANSFER_SETTINGS["parallel_streams"]):
+            start_next()
+        while in_flight:
+            chunk = await in_flight.popleft()
+            start_next()
+            if progress:
+                progress(len(chunk))
+            if not writer.has_room(len(chunk)):
+                await asyncio.to_thread(writer.flush)
+            writer.append(chunk)
+    finally:
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        await asyncio.to_thread(writer.close)
+
+
+# --- Transfer Engine ---
+
+PARTIAL_SUFFIX = ".swarmdl-partial" # Temp files live next to their target (same filesystem) until renamed over it
+PARTIAL_RESUME_SECONDS = 24 * 3600 # Startup cleanup keeps partials written to more recently than this, so a re-queue resumes them
+TRANSFER_BUFFER_SIZE = 1024 * 1024
+TRANSFER_TIMEOUT = httpx.Timeout(60.0, connect=15.0)
+HF_TRANSFER_MIN_SIZE = 50 * 1024 * 1024 # Below this the plain streaming path is just as fast
+HF_TRANSFER_MAX_FILES = 100
+HF_TRANSFER_CHUNK_SIZE = 10 * 1024 * 1024
+HF_TRANSFER_PARALLEL_FAILURES = 3
+HF_TRANSFER_MAX_RETRIES = 5
+PARALLEL_CHUNK_SIZE = 16 * 1024 * 1024 # Per Range request; at most TRANSFER_SETTINGS["parallel_streams"] of these are held for reordering
+PROGRESS_PRINT_INTERVAL = 5.0
+PROGRESS_EVENT_INTERVAL = 1.0
+
+def format_bytes(num_bytes) -> str:
+    """Human readable byte count for logs."""
+    value = float(num_bytes or 0)
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.2f} TB"
+
+def partial_path_for(final_path: str, suffix: str = PARTIAL_SUFFIX) -> str:
+    """Hidden temp path in the same directory as final_path, so the final rename is atomic."""
+    directory, name = os.path.split(final_path)
+    return os.path.join(directory, f".{name}{suffix}")
+
+def _fsync_directory(directory: str):
+    """Persists a rename by fsyncing the containing directory (no-op where unsupported)."""
+    if platform.system() == "Windows":
+        return
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+def _make_progress_reporter(label: str, total_size, task_id=None):
+    """
+    Returns a callback(bytes_increment) that prints throttled progress/speed to the
+    console and emits throttled bytes_progress events to the event log.
+    """
+    state = {"done": 0, "start": time.time(), "last_print": time.time(), "last_event": 0.0}
+    def update(increment):
+        state["done"] += increment
+        now = time.time()
+        speed = state["done"] / max(now - state["start"], 1e-6)
+        if now - state["last_event"] >= PROGRESS_EVENT_INTERVAL:
+            state["last_event"] = now
+            emit_event("bytes_progress", task_id=task_id, file=label, bytes_done=state["done"], total_bytes=total_size, bytes_per_second=round(speed))
+        if now - state["last_print"] < PROGRESS_PRINT_INTERVAL:
+            return
+        state["last_print"] = now
+        total_str = f" / {format_bytes(total_size)}" if total_size else ""
+        print(f"   {label}: {format_bytes(state['done'])}{total_str} ({format_bytes(speed)}/s)")
+    return update
+
+def _stream_url_to_file(url: str, dest_path: str, headers: dict, progress=None, expected_size=None, digest: StreamingDigest | None = None):
+    """
+    Streaming GET into dest_path on the async transfer core. If dest_path already holds
+    part of the file (an earlier attempt), only the remainder is requested with a Range header.
+    """
+    run_transfer(_stream_url_to_file_async(url, dest_path, headers, progress, expected_size, digest))
+
+def _copy_local_file(source_path: str, dest_path: str, progress=None, digest: StreamingDigest | None = None):
+    """
+    Copies a local/NFS file into dest_path, resuming after whatever dest_path already holds.
+    With a digest the bytes pass through user space to be hashed instead of copy_file_range.
+    """
+    offset = os.path.getsize(dest_path) if os.path.exists(dest_path) else 0
+    # Not opened in append mode: copy_file_range rejects O_APPEND destinations
+    with open(source_path, "rb") as src, open(dest_path, "r+b" if offset else "wb") as dst:
+        size = os.fstat(src.fileno()).st_size
+        if offset > size:
+            dst.truncate(0)
+            offset = 0
+        dst.seek(offset)
+        if digest is not None:
+            digest.resume(dest_path, offset)
+        if WRITE_SETTINGS["preallocate"]:
+            preallocate_file(dst.fileno(), size)
+        cache_window_start = offset
+        use_copy_file_range = hasattr(os, "copy_file_range") and digest is None
+        while offset < size:
+            count = min(size - offset, TRANSFER_BUFFER_SIZE * 8)
+            copied = 0
+            if use_copy_file_range:
+                try:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), count, offset)
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                        raise
+                    use_copy_file_range = False
+            if not use_copy_file_range:
+                src.seek(offset)
+                chunk = src.read(count)
+                dst.write(chunk)
+                copied = len(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+            if copied == 0:
+                break
+            offset += copied
+            if progress:
+                progress(copied)
+            if WRITE_SETTINGS["mode"] != "buffered" and offset - cache_window_start >= WRITE_SETTINGS["buffer_size"]:
+                dst.flush()
+                drop_cached_range(dst.fileno(), cache_window_start, offset - cache_window_start)
+                cache_window_start = offset
+        if WRITE_SETTINGS["mode"] != "buffered":
+            dst.flush()
+            drop_cached_range(dst.fileno(), cache_window_start, offset - cache_window_start)
+
+def _hf_transfer_url_to_file(url: str, dest_path: str, headers: dict, progress=None) -> bool:
+    """
+    Parallel Rust downloader, used when the hf_transfer checkbox is on and the file is large.
+    Returns False when this hf_transfer version cannot report progress.
+    """
+    kwargs = {}
+    supports_callback = "callback" in inspect.signature(hf_transfer.download).parameters
+    if progress and supports_callback:
+        kwargs["callback"] = progress
+    try:
+        hf_transfer.download(
+            url=url,
+            filename=dest_path,
+            max_files=HF_TRANSFER_MAX_FILES,
+            chunk_size=HF_TRANSFER_CHUNK_SIZE,
+            headers=headers,
+            parallel_failures=HF_TRANSFER_PARALLEL_FAILURES,
+            max_retries=HF_TRANSFER_MAX_RETRIES,
+            **kwargs,
+        )
+    except Exception as e:
+        # Chunks land out of order, so what's on disk is not a prefix a later attempt could resume
+        with contextlib.suppress(OSError):
+            os.remove(dest_path)
+        # hf_transfer has already retried internally; surface it as a transient failure so the outer loop can back off
+        raise IncompleteTransferError(f"hf_transfer failed: {e}") from e
+    return supports_callback
+
+def _fetch_attempt(resolved: dict, partial_path: str, use_hf_transfer: bool, label: str, repo: str, task_id, expected_sha256=None, backend=None,
+                   digest: StreamingDigest | None = None) -> str:
+    """
+    One transfer attempt into partial_path, fsynced, size-checked and hash-checked against
+    expected_sha256, or else the Hub's LFS oid (the resolved etag). The hash is computed
+    while writing. Large files use hf_transfer when it is enabled and installed; it writes
+    chunks out of order, so its files are hashed with one read after the download. With
+    hf_transfer enabled but not installed they use the "parallel" backend (ordered Range
+    requests, hashed while writing). With resolved["delta"] (see prepare_delta) the file is
+    rebuilt from the old version plus Range requests.
+    Returns the backend used.
+    """
+    delta = resolved.get("delta")
+    expected_size = resolved.get("size") if resolved.get("size") is not None else (delta or {}).get("size")
+    local_source = resolved.get("path") # Set by FileSource instead of a URL
+    etag = resolved.get("etag") or ""
+    expected_sha256 = expected_sha256 or (etag if SHA256_PATTERN.fullmatch(etag) else None) or (delta or {}).get("sha256")
+    use_fast_path = use_hf_transfer and not local_source and (expected_size or 0) >= HF_TRANSFER_MIN_SIZE
+    use_hf_transfer_backend = use_fast_path and HF_TRANSFER_AVAILABLE
+    use_parallel = use_fast_path and not use_hf_transfer_backend
+    backend = backend or ("file" if local_source else "delta" if delta else "parallel" if use_parallel else "hf_transfer" if use_hf_transfer_backend else "http")
+    if expected_sha256:
+        digest = digest or StreamingDigest("sha256")
+    else:
+        digest = None
+    report_progress = _make_progress_reporter(label, expected_size, task_id)
+    def progress(increment):
+        report_progress(increment)
+        record_bytes_downloaded(increment, repo, backend, task_id)
+
+    if local_source:
+        _copy_local_file(local_source, partial_path, progress, digest)
+    elif delta:
+        try:
+            run_transfer(_rebuild_from_delta_async(delta, partial_path, progress, digest))
+        except RangeNotSupportedError:
+            _stream_url_to_file(resolved["url"], partial_path, resolved.get("headers") or {}, progress, expected_size, digest)
+    elif use_hf_transfer_backend:
+        if digest is not None:
+            digest.resume(partial_path, 0) # Nothing hashed while writing; the check below reads the finished file
+        if not _hf_transfer_url_to_file(resolved["url"], partial_path, resolved.get("headers") or {}, progress):
+            record_bytes_downloaded(os.path.getsize(partial_path), repo, backend, task_id)
+    elif use_parallel:
+        try:
+            run_transfer(_stream_url_parallel_async(resolved["url"], partial_path, resolved.get("headers") or {}, expected_size, progress, digest))
+        except RangeNotSupportedError:
+            _stream_url_to_file(resolved["url"], partial_path, resolved.get("headers") or {}, progress, expected_size, digest)
+    else:
+        _stream_url_to_file(resolved["url"], partial_path, resolved.get("headers") or {}, progress, expected_size, digest)
+
+    with open(partial_path, "rb+") as f:
+        os.fsync(f.fileno())
+    actual_size = os.path.getsize(partial_path)
+    if expected_size is not None and actual_size != expected_size:
+        if actual_size > expected_size:
+            os.remove(partial_path) # Can't be resumed, next attempt starts clean
+        raise IncompleteTransferError(f"Size mismatch for {label}: expected {expected_size} bytes, got {actual_size}")
+    if model_file_format(partial_path):
+        validation = validate_model_file(partial_path)
+        if not validation["ok"]:
+            os.remove(partial_path) # An error page or a corrupt upload won't get better by resuming it
+            raise InvalidModelFileError(f"{label} is not a valid {validation['format']} file: {validation['error']}")
+    if expected_sha256:
+        if digest.position != actual_size:
+            digest.resume(partial_path, actual_size) # Only if the writer lost track, e.g. a failed write
+        actual_sha256 = digest.hexdigest()
+        if actual_sha256 != expected_sha256:
+            os.remove(partial_path)
+            raise ChecksumMismatchError(f"sha256 mismatch for {label}: expected {expected_sha256}, got {actual_sha256}")
+    return backend
+
+def download_atomic(source, final_path: str, use_hf_transfer: bool = False, label: str | None = None, repo: str = "", task_id=None, source_host: str | None = None,
+                    expected_sha256: str | None = None, backend: str | None = None, max_retries: int | None = None, chunk_index_url: str | None = None,
+                    partial_path: str | None = None) -> str:
+    """
+    Downloads to a hidden temp file next to final_path, fsyncs it and atomically
+    renames it over final_path. An existing file at final_path stays intact until the
+    new one is complete, so a crash never leaves a missing or half-written model.
+
+    `source` is {"url", "headers", "size"} (or {"path", "size"} for a local file) or a callable returning one. A callable is
+    re-invoked on every attempt, so expired signed CDN links are refreshed on retry;
+    source_host names the host that callable contacts. Transient failures are retried
+    (see call_with_retries) and resume from the partial file's current size.
+    With expected_sha256 (or an LFS oid from the resolve) the file is hashed as it is
+    written and checked before it is moved into place. Replacing an existing file tries a
+    delta sync against it first (see Delta Sync), falling back to a full download.
+    partial_path overrides the temp file, for bytes that must not mix with the usual partial.
+    """
+    target_dir = os.path.dirname(final_path)
+    os.makedirs(target_dir, exist_ok=True)
+    partial_path = partial_path or partial_path_for(final_path)
+    digest = StreamingDigest("sha256") # Shared by all attempts, so a resumed attempt doesn't re-read what was already hashed
+    label = label or os.path.basename(final_path)
+    try:
+        delta_basis = final_path if DELTA_SETTINGS["enabled"] and os.path.getsize(final_path) >= DELTA_SETTINGS["min_size"] else None
+    except OSError:
+        delta_basis = None
+    delta_state = {"checked": delta_basis is None, "delta": None}
+    if not delta_state["checked"] and (expected_sha256 or chunk_index_url):
+        # Chunk the old file before any request, so no resolved (signed) URL waits on it
+        delta_state["checked"] = True
+        delta_state["delta"] = prepare_delta(delta_basis, expected_sha256, chunk_index_url, label)
+    if not callable(source):
+        make_room_for_download(final_path, source.get("size"), partial_path)
+    room_state = {"made": not callable(source)} # A callable source's size is only known once it resolves
+
+    def attempt(contact):
+        if callable(source):
+            if source_host:
+                contact(source_host)
+            resolved = source()
+        else:
+            resolved = source
+        if not room_state["made"]:
+            room_state["made"] = True # Once per download; retries resume into space already made
+            make_room_for_download(final_path, resolved.get("size"), partial_path)
+        if not delta_state["checked"] and "url" in resolved:
+            delta_state["checked"] = True # Once per download: chunking the old file is the expensive part
+            etag = resolved.get("etag") or ""
+            delta_state["delta"] = prepare_delta(delta_basis, etag if SHA256_PATTERN.fullmatch(etag) else None, None, label)
+            if delta_state["delta"] and callable(source):
+                resolved = source() # Chunking may have outlived a signed link
+        contact(httpx.URL(resolved["url"]).host if "url" in resolved else "local")
+        delta = delta_state["delta"]
+        if delta and "url" in resolved:
+            if resolved.get("size") is not None and delta["size"] != resolved["size"]:
+                delta_state["delta"] = None # The index describes another version than the one resolved
+            else:
+                # The plan holds across attempts; fetched ranges use this attempt's URL unless a mirror serves them
+                resolved = dict(resolved, delta=dict(delta, url=delta["url"] or resolved["url"],
+                                                     headers=delta["headers"] if delta["url"] else (resolved.get("headers") or {})))
+        try:
+            return _fetch_attempt(resolved, partial_path, use_hf_transfer, label, repo, task_id, expected_sha256, backend, digest)
+        except ChecksumMismatchError:
+            if delta_state["delta"]:
+                add_log(f" -> Delta rebuild of '{label}' did not match its sha256. Retrying as a full download.")
+                delta_state["delta"] = None
+            raise
+
+    try:
+        used_backend = call_with_retries(attempt, label, task_id, max_retries)
+    except Exception as e:
+        # Keep the partial for transient/deferred failures so a re-queue resumes it, also after a restart
+        # (see PARTIAL_RESUME_SECONDS); fatal errors start clean
+        if not isinstance(e, CircuitOpenError) and not is_retryable_error(e) and os.path.exists(partial_path):
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+        raise
+    os.replace(partial_path, final_path)
+    _fsync_directory(target_dir)
+    record_model_access(final_path)
+    metric_inc("swarmdl_files_downloaded_total", repo=repo, backend=used_backend)
+    if used_backend == "delta":
+        metric_inc("swarmdl_delta_reused_bytes_total", delta_state["delta"]["reused_bytes"], repo=repo)
+    if WARM_SETTINGS["after_download"] and os.path.getsize(final_path) >= WARM_SETTINGS["min_size"]:
+        queue_page_cache_warm([final_path])
+    return final_path
+
+def resolve_hf_file(repo_id: str, filename: str) -> dict:
+    """
+    Resolves a Hub file to a direct download location. Mirrors hf_hub_download's
+    behaviour of dropping the auth header when redirected to a (signed) CDN URL.
+    Returns {"url", "headers", "size", "etag", "commit_hash"}.
+    """
+    url = hf_hub_url(repo_id, filename)
+    headers = build_hf_headers()
+    metadata = get_hf_file_metadata(url)
+    download_url = metadata.location or url
+    if httpx.URL(download_url).host != httpx.URL(url).host:
+        headers = {k: v for k, v in headers.items() if k.lower() != "authorization"}
+    return {"url": download_url, "headers": headers, "size": metadata.size, "etag": metadata.etag, "commit_hash": metadata.commit_hash}
+
+def hf_endpoint_host(repo_id: str) -> str:
+    return httpx.URL(hf_hub_url(repo_id, "_")).host
+
+def download_hf_file(repo_id: str, filename: str, final_path: str, use_hf_transfer: bool = False, task_id=None, chunk_index_url: str | None = None) -> str:
+    """
+    Downloads a single Hub file straight to final_path through the atomic temp-then-rename path.
+    With LAN mirrors configured, the file's sha256 is looked up on the Hub first and the
+    mirrors are tried before the Hub itself. Completed LFS files are added to the local
+    content index so this node can serve them as a mirror too.
+    """
+    hub_host = hf_endpoint_host(repo_id)
+    resolved = {}
+    def resolve():
+        resolved.update(resolve_hf_file(repo_id, filename))
+        return dict(resolved)
+
+    if MIRROR_SETTINGS["mirrors"]:
+        def resolve_metadata(contact):
+            contact(hub_host)
+            return resolve()
+        call_with_retries(resolve_metadata, f"{filename} metadata", task_id)
+        sha256 = resolved.get("etag") if SHA256_PATTERN.fullmatch(resolved.get("etag") or "") else None
+        if sha256 and fetch_from_mirrors(sha256, resolved.get("size"), final_path, filename, repo_id, task_id):
+            register_content(sha256, final_path)
+            return final_path
+
+    download_atomic(resolve, final_path, use_hf_transfer, label=filename, repo=repo_id, task_id=task_id, source_host=hub_host, chunk_index_url=chunk_index_url)
+    if SHA256_PATTERN.fullmatch(resolved.get("etag") or ""):
+        register_content(resolved["etag"], final_path) # LFS etags are the file's sha256
+    return final_path
+
+def _partial_target_is_leased(target_path: str, stop_dir: str) -> bool:
+    """Whether target_path, or a snapshot folder containing it below stop_dir, has a live download lease."""
+    stop_dir = os.path.normpath(stop_dir)
+    path = os.path.normpath(target_path)
+    while path != stop_dir and os.path.dirname(path) != path:
+        lease_path = lease_path_for(path)
+        try:
+            token, record = _read_lease(lease_path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return True # Can't tell; leave the partial alone
+        else:
+            if not _lease_is_stale(lease_path, token, record):
+                return True
+        path = os.path.dirname(path)
+    return False
+
+def cleanup_orphaned_partials(base_path: str, lease_root: str | None = None) -> int:
+    """
+    Removes temp files left behind by a crash or kill. Call at startup, before any worker runs.
+    Partials written to within PARTIAL_RESUME_SECONDS are kept: download_atomic resumes them
+    when the same download is queued again, also after a restart. A partial whose target is
+    leased belongs to another process sharing the folder (see Download Leases) and is kept.
+    lease_root is the tree the leases live in when base_path is a placement volume, whose
+    files are leased under their linked path in the base path.
+    """
+    removed = 0
+    if not base_path or not os.path.isdir(base_path):
+        return removed
+    lease_root = lease_root or base_path
+    for root, dirs, files in os.walk(base_path):
+        for name in files:
+            if not name.endswith(PARTIAL_SUFFIX):
+                continue
+            orphan_path = os.path.join(root, name)
+            try:
+                if time.time() - os.path.getmtime(orphan_path) < PARTIAL_RESUME_SECONDS:
+                    continue
+            except OSError:
+                continue
+            target_name = name[1:-len(PARTIAL_SUFFIX)] if name.startswith(".") else name[:-len(PARTIAL_SUFFIX)]
+            leased_target = os.path.join(lease_root, os.path.relpath(root, base_path), target_name)
+            if _partial_target_is_leased(leased_target, lease_root):
+                continue
+            try:
+                os.remove(orphan_path)
+                removed += 1
+                print(f"Removed orphaned partial download: {orphan_path}")
+            except OSError as e:
+                print(f"Warning: Could not remove orphaned partial download {orphan_path}: {e}")
+    return removed
+
+# --- Model File Validation ---
+# Structural checks of .safetensors and .gguf files that read only the header (through
+# mmap, so a 30 GB file costs a few pages): the header must parse and every tensor's
+# declared byte range must lie inside the file. This catches truncated downloads and
+# HTML error pages saved under a model name in milliseconds, long before a UI loads them.
+
+class InvalidModelFileError(OSError):
+    """A downloaded model file's header is malformed or describes more data than the file holds."""
+
+MODEL_FILE_FORMATS = {".safetensors": "safetensors", ".sft": "safetensors", ".gguf": "gguf"}
+SAFETENSORS_MAX_HEADER_SIZE = 100 * 1024 * 1024
+SAFETENSORS_DTYPE_SIZES = {"BOOL": 1, "U8": 1, "I8": 1, "F8_E4M3": 1, "F8_E5M2": 1, "F8_E8M0": 1, "U16": 2, "I16": 2, "F16": 2, "BF16": 2,
+                           "U32": 4, "I32": 4, "F32": 4, "U64": 8, "I64": 8, "F64": 8}
+GGUF_MAGIC = b"GGUF"
+GGUF_DEFAULT_ALIGNMENT = 32
+GGUF_SCALAR_FORMATS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+GGUF_STRING_TYPE, GGUF_ARRAY_TYPE = 8, 9
+GGML_TYPE_BLOCKS = { # ggml type id -> (elements per block, bytes per block)
+    0: (1, 4), 1: (1, 2), 2: (32, 18), 3: (32, 20), 6: (32, 22), 7: (32, 24), 8: (32, 34),
+    10: (256, 84), 11: (256, 110), 12: (256, 144), 13: (256, 176), 14: (256, 210), 15: (256, 292),
+    16: (256, 66), 17: (256, 74), 18: (256, 98), 19: (256, 50), 20: (32, 18), 21: (256, 110), 22: (256, 82),
+    23: (256, 136), 24: (1, 1), 25: (1, 2), 26: (1, 4), 27: (1, 8), 28: (1, 8), 29: (256, 56), 30: (1, 2),
+    34: (256, 54), 35: (256, 66), 39: (32, 17), 40: (64, 36), 41: (128, 18),
+} # Types missing here (e.g. Q8_1, never stored in files) only get the offset bounds check
+VALIDATION_MAX_WORKERS = 8
+
+def model_file_format(path: str) -> str | None:
+    """'safetensors', 'gguf' or None, judged by extension (partial download names included)."""
+    name = os.path.basename(path)
+    if name.endswith(PARTIAL_SUFFIX):
+        name = name[:-len(PARTIAL_SUFFIX)]
+    return MODEL_FILE_FORMATS.get(os.path.splitext(name)[1].lower())
+
+def _validate_safetensors(view, file_size: int) -> int:
+    if file_size < 8:
+        raise InvalidModelFileError("File is shorter than the 8-byte safetensors header length")
+    (header_size,) = struct.unpack_from("<Q", view, 0)
+    if header_size > min(SAFETENSORS_MAX_HEADER_SIZE, file_size - 8):
+        raise InvalidModelFileError(f"Header length {header_size} does not fit in a {file_size}-byte file (not a safetensors file, or truncated)")
+    try:
+        header = json.loads(bytes(view[8:8 + header_size]))
+    except ValueError as e:
+        raise InvalidModelFileError(f"Header is not valid JSON: {e}")
+    if not isinstance(header, dict):
+        raise InvalidModelFileError("Header is not a JSON object")
+    data_size = file_size - 8 - header_size
+    tensor_count = 0
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        try:
+            begin, end = info["data_offsets"]
+            element_count = math.prod(info["shape"])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidModelFileError(f"Tensor '{name}' has no valid data_offsets/shape")
+        if not 0 <= begin <= end or end > data_size:
+            raise InvalidModelFileError(f"Tensor '{name}' spans bytes {begin}-{end} but the file only holds {data_size} data bytes (truncated?)")
+        dtype_size = SAFETENSORS_DTYPE_SIZES.get(info.get("dtype"))
+        if dtype_size and end - begin != element_count * dtype_size:
+            raise InvalidModelFileError(f"Tensor '{name}' occupies {end - begin} bytes but {info['dtype']}{info['shape']} needs {element_count * dtype_size}")
+        tensor_count += 1
+    return tensor_count
+
+def _validate_gguf(view, file_size: int) -> int:
+    position = 0
+    def read(fmt):
+        nonlocal position
+        size = struct.calcsize(fmt)
+        if position + size > file_size:
+            raise InvalidModelFileError(f"Header runs past the end of the file at byte {position} (truncated?)")
+        values = struct.unpack_from(fmt, view, position)
+        position += size
+        return values[0]
+    def read_string():
+        nonlocal position
+        length = read("<Q")
+        if position + length > file_size:
+            raise InvalidModelFileError(f"String at byte {position} runs past the end of the file (truncated?)")
+        value = bytes(view[position:position + length])
+        position += length
+        return value.decode("utf-8", errors="replace")
+    def read_value(value_type):
+        if value_type == GGUF_STRING_TYPE:
+            return read_string()
+        if value_type == GGUF_ARRAY_TYPE:
+            item_type, count = read("<I"), read("<Q")
+            if item_type in GGUF_SCALAR_FORMATS: # Skip numeric arrays (e.g. token scores) without decoding them
+                nonlocal position
+                position += count * struct.calcsize(GGUF_SCALAR_FORMATS[item_type])
+                return None
+            for _ in range(count):
+                read_value(item_type)
+            return None
+        if value_type not in GGUF_SCALAR_FORMATS:
+            raise InvalidModelFileError(f"Unknown metadata value type {value_type} at byte {position}")
+        return read(GGUF_SCALAR_FORMATS[value_type])
+
+    if file_size < 4 or bytes(view[0:4]) != GGUF_MAGIC:
+        raise InvalidModelFileError("Missing GGUF magic (not a GGUF file)")
+    position = 4
+    version = read("<I")
+    if version not in (2, 3):
+        raise InvalidModelFileError(f"Unsupported GGUF version {version}")
+    tensor_count, kv_count = read("<Q"), read("<Q")
+    alignment = GGUF_DEFAULT_ALIGNMENT
+    for _ in range(kv_count):
+        key = read_string()
+        value = read_value(read("<I"))
+        if key == "general.alignment" and isinstance(value, int) and value > 0:
+            alignment = value
+    tensors = []
+    for _ in range(tensor_count):
+        name = read_string()
+        dimensions = [read("<Q") for _ in range(read("<I"))]
+        tensors.append((name, dimensions, read("<I"), read("<Q")))
+    data_start = -(-position // alignment) * alignment
+    data_size = file_size - data_start
+    for name, dimensions, ggml_type, offset in tensors:
+        if offset % alignment:
+            raise InvalidModelFileError(f"Tensor '{name}' offset {offset} is not {alignment}-byte aligned")
+        block = GGML_TYPE_BLOCKS.get(ggml_type)
+        size = math.prod(dimensions) // block[0] * block[1] if block else 0
+        if offset + size > data_size:
+            raise InvalidModelFileError(f"Tensor '{name}' ends at data byte {offset + size} but the file only holds {data_size} (truncated?)")
+    return tensor_count
+
+def validate_model_file(path: str) -> dict | None:
+    """
+    Checks a .safetensors/.gguf file's header against its size. Returns
+    {"path", "format", "ok", "tensors", "error", "seconds"}, or None for other file types.
+    """
+    file_format = model_file_format(path)
+    if not file_format:
+        return None
+    started = time.perf_counter()
+    result = {"path": path, "format": file_format, "ok": False, "tensors": None, "error": None}
+    try:
+        with open(path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size == 0:
+                raise InvalidModelFileError("File is empty")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                validate = _validate_safetensors if file_format == "safetensors" else _validate_gguf
+                result["tensors"] = validate(mapped, file_size)
+        result["ok"] = True
+    except (InvalidModelFileError, struct.error) as e:
+        result["error"] = str(e)
+    except (OSError, ValueError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - started, 4)
+    return result
+
+def validate_installed_models(base_path: str, max_workers: int = VALIDATION_MAX_WORKERS) -> list:
+    """Validates every .safetensors/.gguf file under base_path concurrently. Returns the results, failures first."""
+    model_paths = []
+    for root, dirs, files in os.walk(base_path):
+        dirs[:] = [d for d in dirs if d not in (".cache", STATE_DIR_NAME)]
+        model_paths.extend(os.path.join(root, name) for name in files if not name.endswith(PARTIAL_SUFFIX) and model_file_format(name))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(validate_model_file, model_paths))
+    return sorted(results, key=lambda result: (result["ok"], result["path"]))
+
+# --- LAN Mirror ---
+# Nodes started with --serve-mirror expose the files they have downloaded at
+# /mirror/sha256/<digest> on the service port (and their chunk indexes at
+# /mirror/chunks/<digest>, see Delta Sync). Nodes started with --mirror URL ask those
+# peers first and only fall back to the Hub on a miss; the sha256 always comes from the
+# Hub, so a stale or corrupt mirror can never put bad bytes into place.
+
+MIRROR_SETTINGS = {
+    "mirrors": [], # Base URLs of peer service ports, e.g. http://10.0.0.5:7861
+    "max_retries": 0, # A flaky peer is not worth waiting for; the Hub is the fallback
+}
+CONTENT_INDEX_NAME = "content_index.json"
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+MIRROR_SEND_CHUNK_SIZE = 8 * 1024 * 1024
+MIRROR_PARTIAL_SUFFIX = ".mirror" + PARTIAL_SUFFIX # Peer bytes never touch the Hub's resumable partial; still matched by orphan cleanup
+
+content_index = {} # sha256 -> absolute path of a local file with that content
+content_index_lock = threading.Lock()
+content_index_path = None # Set by load_content_index; None keeps the index in memory only
+
+def load_content_index(base_path: str):
+    """Loads the content index kept in base_path's state directory and makes it the active one."""
+    global content_index_path
+    index_path = os.path.join(base_path, STATE_DIR_NAME, CONTENT_INDEX_NAME)
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+    except (OSError, ValueError):
+        loaded = {}
+    with content_index_lock:
+        content_index.clear()
+        content_index.update({digest: path for digest, path in loaded.items() if os.path.isfile(path)})
+        content_index_path = index_path
+    return len(content_index)
+
+def _save_content_index():
+    """Writes the index via a temp file. Caller holds content_index_lock."""
+    if not content_index_path:
+        return
+    try:
+        os.makedirs(os.path.dirname(content_index_path), exist_ok=True)
+        temp_path = content_index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(content_index, f, indent=1, sort_keys=True)
+        os.replace(temp_path, content_index_path)
+    except OSError as e:
+        add_log(f"WARNING: Could not save content index {content_index_path}: {e}")
+
+def register_content(sha256: str, path: str):
+    """Records that path holds content with the given sha256 (dropping older digests for the same path)."""
+    path = os.path.abspath(path)
+    with content_index_lock:
+        for digest in [d for d, p in content_index.items() if p == path and d != sha256]:
+            del content_index[digest]
+        if content_index.get(sha256) == path:
+            return
+        content_index[sha256] = path
+        _save_content_index()
+
+def lookup_content(sha256: str) -> str | None:
+    with content_index_lock:
+        path = content_index.get(sha256)
+    return path if path and os.path.isfile(path) else None
+
+def fetch_from_mirrors(sha256: str, size, final_path: str, label: str, repo: str, task_id=None) -> bool:
+    """
+    Tries each configured mirror in turn. Returns True once one of them delivered the verified file.
+    Mirrors stage into their own partial: the Hub download's partial is neither resumed nor
+    removed here, and a mirror's bytes (same sha256 on every peer) are resumed by the next mirror.
+    """
+    mirror_partial_path = partial_path_for(final_path, MIRROR_PARTIAL_SUFFIX)
+    for mirror in MIRROR_SETTINGS["mirrors"]:
+        source = {"url": f"{mirror.rstrip('/')}/mirror/sha256/{sha256}", "headers": {}, "size": size}
+        try:
+            download_atomic(source, final_path, label=label, repo=repo, task_id=task_id, expected_sha256=sha256,
+                            backend="mirror", max_retries=MIRROR_SETTINGS["max_retries"], partial_path=mirror_partial_path)
+        except Exception as e:
+            miss = getattr(getattr(e, "response", None), "status_code", None) == 404
+            metric_inc("swarmdl_mirror_fetches_total", outcome="miss" if miss else "error")
+            if not miss:
+                add_log(f" -> Mirror {mirror} failed for '{label}' ({type(e).__name__}: {e}). Trying next source.")
+            continue
+        metric_inc("swarmdl_mirror_fetches_total", outcome="hit")
+        record_cache_lookup("mirror", True)
+        add_log(f" -> Fetched '{label}' from mirror {mirror} (sha256 verified).")
+        return True
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(mirror_partial_path) # The Hub download that follows starts from its own partial
+    record_cache_lookup("mirror", False)
+    return False
+
+def _parse_range_header(range_header: str, size: int):
+    """Returns (start, end) inclusive for a single 'bytes=' range, or None if unsatisfiable."""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1): # Suffix range: the last N bytes
+        start, end = max(0, size - int(match.group(2))), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start >= size or start > end:
+        return None
+    return start, end
+
+def _send_file_range(request, f, start: int, length: int):
+    """Copies length bytes of f from start to the client, with sendfile when the platform has it."""
+    if hasattr(os, "sendfile"):
+        try:
+            while length > 0:
+                sent = os.sendfile(request.connection.fileno(), f.fileno(), start, min(length, MIRROR_SEND_CHUNK_SIZE))
+                if sent == 0:
+                    break
+                start += sent
+                length -= sent
+            return
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+    f.seek(start)
+    while length > 0:
+        chunk = f.read(min(length, TRANSFER_BUFFER_SIZE))
+        if not chunk:
+            break
+        request.wfile.write(chunk)
+        length -= len(chunk)
+
+def handle_mirror_blob(request):
+    """Serves GET/HEAD /mirror/sha256/<digest>, with single-range support so peers can resume."""
+    digest = request.path.split("?", 1)[0].rsplit("/", 1)[-1].lower()
+    path = lookup_content(digest) if SHA256_PATTERN.fullmatch(digest) else None
+    if not path:
+        return 404, "text/plain", b"Not found\n"
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start, end, status = 0, size - 1, 200
+        if request.headers.get("Range"):
+            byte_range = _parse_range_header(request.headers["Range"], size)
+            if byte_range is None:
+                request.send_response(416)
+                request.send_header("Content-Range", f"bytes */{size}")
+                request.send_header("Content-Length", "0")
+                request.end_headers()
+                return None
+            (start, end), status = byte_range, 206
+        request.send_response(status)
+        request.send_header("Content-Type", "application/octet-stream")
+        request.send_header("Content-Length", str(end - start + 1))
+        request.send_header("Accept-Ranges", "bytes")
+        request.send_header("ETag", f'"{digest}"')
+        if status == 206:
+            request.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        request.end_headers()
+        if request.command == "HEAD":
+            return None
+        try:
+            _send_file_range(request, f, start, end - start + 1)
+        except (BrokenPipeError, ConnectionResetError):
+            return None # Peer went away; it will resume or fall back to the Hub
+    metric_inc("swarmdl_mirror_bytes_served_total", end - start + 1)
+    return None
+
+def enable_mirror_serving():
+    service_routes[("GET", "/mirror/sha256/")] = handle_mirror_blob
+    service_routes[("HEAD", "/mirror/sha256/")] = handle_mirror_blob
+    service_routes[("GET", "/mirror/chunks/")] = handle_mirror_chunks
+
+
+# --- Delta Sync ---
+# When a file is replaced by a new version (allow_overwrite / pre_delete, a changed file in a
+# snapshot sync), most of its bytes are often unchanged, just shifted, e.g. after a metadata
+# edit. Both versions are cut into content-defined chunks: a boundary wherever a rolling hash
+# of the last CDC_WINDOW bytes matches a mask, so an insertion only moves the boundaries next
+# to it. Chunks the old file already has are copied from it; only the rest is fetched, with
+# Range requests. This needs the new version's chunk list (its "chunk index") up front:
+# --serve-mirror nodes serve one for every file they hold at /mirror/chunks/<sha256>, and a
+# catalog entry may name one with "chunk_index_url" (write them with --chunk-index). The Hub
+# doesn't publish chunk indexes, so without either this is a normal full download. The
+# rebuilt file is checked against the new sha256 like any other download.
+
+DELTA_SETTINGS = {
+    "enabled": True,
+    "min_size": 64 * 1024 * 1024, # Smaller files aren't worth chunking the old copy for
+}
+CDC_ALGORITHM = "gear-window-sum-v1"
+CDC_PARAMS = {
+    "window": 48, # Bytes the rolling hash covers
+    "mask_bits": 20, # Average distance between boundaries is 2**mask_bits bytes (1 MiB)
+    "min_size": 256 * 1024,
+    "max_size": 8 * 1024 * 1024,
+}
+CDC_SEGMENT_SIZE = 8 * 1024 * 1024 # Bytes chunked per numpy pass
+CHUNK_INDEX_DIR_NAME = "chunk_indexes"
+CHUNK_INDEX_SUFFIX = ".chunks.json"
+
+# 32-bit gear values derived from sha256 rather than a PRNG, so every node (and numpy version) agrees on boundaries
+CDC_GEAR = np.array([int.from_bytes(hashlib.sha256(b"swarmdl-cdc" + bytes([i])).digest()[:4], "little") for i in range(256)], dtype=np.uint32)
+
+chunk_index_jobs = set() # sha256 digests whose index is being computed for /mirror/chunks
+chunk_index_jobs_lock = threading.Lock()
+
+def _cdc_candidates(data: bytes, tail: bytes, params: dict):
+    """
+    Offsets into data just past each byte where the window sum of gear values (mod 2**32)
+    has its mask bits clear. tail is the end of the previous segment, so windows straddle
+    segments. A window sum rather than a shifted gear hash lets numpy do it in a few passes.
+    """
+    window = params["window"]
+    values = CDC_GEAR[np.frombuffer(tail + data, dtype=np.uint8)]
+    sums = np.cumsum(values, dtype=np.uint32)
+    window_sums = sums[window - 1:].copy()
+    window_sums[1:] -= sums[:-window]
+    mask = np.uint32(((1 << params["mask_bits"]) - 1) << 8) # Skip the lowest bits, which mix least
+    return np.flatnonzero((window_sums & mask) == 0) + window - len(tail)
+
+def compute_chunk_index(path: str, params: dict | None = None) -> dict:
+    """
+    Chunk index of a file: {"algorithm", "params", "size", "sha256", "chunks": [[length, sha256], ...]}.
+    Reads the file once; chunks are contiguous from offset 0.
+    """
+    params = dict(params or CDC_PARAMS)
+    chunks = []
+    file_hasher = hashlib.sha256()
+    chunk_hasher = hashlib.sha256()
+    chunk_start = 0
+    position = 0
+    tail = b""
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(CDC_SEGMENT_SIZE)
+            if not data:
+                break
+            file_hasher.update(data)
+            cuts = []
+            last_cut = chunk_start
+            for candidate in _cdc_candidates(data, tail, params).tolist():
+                cut = position + candidate
+                while cut - last_cut > params["max_size"]:
+                    last_cut += params["max_size"]
+                    cuts.append(last_cut)
+                if cut - last_cut >= params["min_size"]:
+                    cuts.append(cut)
+                    last_cut = cut
+            while position + len(data) - last_cut >= params["max_size"]:
+                last_cut += params["max_size"]
+                cuts.append(last_cut)
+            view = memoryview(data)
+            consumed = 0
+            for cut in cuts:
+                chunk_hasher.update(view[consumed:cut - position])
+                chunks.append([cut - chunk_start, chunk_hasher.hexdigest()])
+                chunk_hasher = hashlib.sha256()
+                consumed, chunk_start = cut - position, cut
+            chunk_hasher.update(view[consumed:])
+            position += len(data)
+            tail = data[-(params["window"] - 1):]
+    if position > chunk_start:
+        chunks.append([position - chunk_start, chunk_hasher.hexdigest()])
+    return {"algorithm": CDC_ALGORITHM, "params": params, "size": position, "sha256": file_hasher.hexdigest(), "chunks": chunks}
+
+def _chunk_index_cache_path(sha256: str) -> str | None:
+    if not content_index_path:
+        return None
+    return os.path.join(os.path.dirname(content_index_path), CHUNK_INDEX_DIR_NAME, f"{sha256}.json")
+
+def chunk_index_for_content(sha256: str, path: str, params: dict | None = None) -> dict:
+    """The chunk index of a file whose sha256 is known, cached in the state directory by digest."""
+    params = dict(params or CDC_PARAMS)
+    cache_path = _chunk_index_cache_path(sha256)
+    if cache_path:
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("algorithm") == CDC_ALGORITHM and cached.get("params") == params and cached.get("size") == os.path.getsize(path):
+                return cached
+        except (OSError, ValueError):
+            pass
+    index = compute_chunk_index(path, params)
+    if cache_path and index["sha256"] == sha256:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temp_path = cache_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            add_log(f"WARNING: Could not cache chunk index {cache_path}: {e}")
+    return index
+
+def _known_digest_of(path: str) -> str | None:
+    path = os.path.abspath(path)
+    with content_index_lock:
+        return next((digest for digest, indexed_path in content_index.items() if indexed_path == path), None)
+
+def _compute_mirror_chunk_index(sha256: str, path: str):
+    try:
+        chunk_index_for_content(sha256, path)
+    except OSError as e:
+        add_log(f"WARNING: Could not compute chunk index for {path}: {e}")
+    finally:
+        with chunk_index_jobs_lock:
+            chunk_index_jobs.discard(sha256)
+
+def handle_mirror_chunks(request):
+    """
+    Serves GET /mirror/chunks/<digest>. Indexes are computed on first request, in the
+    background (a large file takes a while), with 202 until then; peers just do a full fetch.
+    """
+    digest = request.path.split("?", 1)[0].rsplit("/", 1)[-1].lower()
+    path = lookup_content(digest) if SHA256_PATTERN.fullmatch(digest) else None
+    if not path:
+        return 404, "text/plain", b"Not found\n"
+    cache_path = _chunk_index_cache_path(digest)
+    if cache_path and os.path.isfile(cache_path):
+        with open(cache_path, "rb") as f:
+            return 200, "application/json", f.read()
+    with chunk_index_jobs_lock:
+        if digest not in chunk_index_jobs:
+            chunk_index_jobs.add(digest)
+            threading.Thread(target=_compute_mirror_chunk_index, args=(digest, path), daemon=True).start()
+    return 202, "application/json", json.dumps({"status": "computing"}).encode("utf-8")
+
+def fetch_chunk_index(sha256: str | None, index_url: str | None = None) -> dict | None:
+    """
+    The new version's chunk index from index_url, else from the first mirror that has one.
+    Returns {"index", "url", "headers"}, where url is where to send Range requests (None:
+    the download's own URL), or None. An index that doesn't match sha256 is ignored.
+    """
+    candidates = [(index_url, None)] if index_url else []
+    if sha256:
+        candidates += [(f"{mirror.rstrip('/')}/mirror/chunks/{sha256}", f"{mirror.rstrip('/')}/mirror/sha256/{sha256}") for mirror in MIRROR_SETTINGS["mirrors"]]
+    for url, blob_url in candidates:
+        try:
+            response = transfer_request("GET", url)
+            index = response.json() if response.status_code == 200 else None
+        except (httpx.HTTPError, ValueError):
+            index = None
+        if not isinstance(index, dict) or index.get("algorithm") != CDC_ALGORITHM or not isinstance(index.get("chunks"), list):
+            continue
+        if sha256 and index.get("sha256") != sha256:
+            continue
+        return {"index": index, "url": blob_url, "headers": {}}
+    return None
+
+def plan_delta(index: dict, basis_index: dict) -> tuple:
+    """
+    Maps each chunk of the new version to the old file (by chunk hash) or to a Range fetch.
+    Returns ([(length, basis_offset or None)], reused_bytes), with neighbouring chunks merged.
+    """
+    basis_offsets = {}
+    offset = 0
+    for length, chunk_hash in basis_index["chunks"]:
+        basis_offsets.setdefault((length, chunk_hash), offset)
+        offset += length
+    plan = []
+    reused = 0
+    for length, chunk_hash in index["chunks"]:
+        basis_offset = basis_offsets.get((length, chunk_hash))
+        if basis_offset is not None:
+            reused += length
+        if plan:
+            previous_length, previous_offset = plan[-1]
+            if basis_offset is None and previous_offset is None:
+                plan[-1] = (previous_length + length, None)
+                continue
+            if basis_offset is not None and previous_offset is not None and previous_offset + previous_length == basis_offset:
+                plan[-1] = (previous_length + length, previous_offset)
+                continue
+        plan.append((length, basis_offset))
+    return plan, reused
+
+def prepare_delta(basis_path: str, sha256: str | None, index_url: str | None, label: str) -> dict | None:
+    """
+    The plan for rebuilding the new version (sha256) from basis_path, or None if no usable
+    chunk index was found or the old file shares nothing with the new one. "url" and
+    "headers" are set when a mirror serves the fetched ranges; with url None download_atomic
+    fills in each attempt's resolved URL.
+    """
+    found = fetch_chunk_index(sha256, index_url)
+    if not found:
+        return None
+    index = found["index"]
+    basis_sha256 = _known_digest_of(basis_path)
+    basis_index = chunk_index_for_content(basis_sha256, basis_path, index["params"]) if basis_sha256 else compute_chunk_index(basis_path, index["params"])
+    plan, reused = plan_delta(index, basis_index)
+    if not reused:
+        return None
+    add_log(f" -> Delta sync for '{label}': {format_bytes(reused)} of {format_bytes(index['size'])} reused from the old file, fetching {format_bytes(index['size'] - reused)}.")
+    return {"plan": plan, "basis_path": basis_path, "url": found["url"], "headers": found["headers"], "sha256": index["sha256"], "size": index["size"], "reused_bytes": reused}
+
+def _read_file_range(path: str, start: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(length)
+    if len(data) != length:
+        raise IncompleteTransferError(f"{path} changed while being reused: short read at {start}")
+    return data
+
+async def _rebuild_from_delta_async(delta: dict, dest_path: str, progress=None, digest: StreamingDigest | None = None):
+    """
+    Writes the new version into dest_path in file order, like _stream_url_parallel_async:
+    pieces of at most PARALLEL_CHUNK_SIZE are read from the old file or fetched with Range
+    requests, TRANSFER_SETTINGS["parallel_streams"] at a time, and written as they come due.
+    Only fetched bytes count as progress.
+    """
+    expected_size = delta["size"]
+    offset = os.path.getsize(dest_path) if os.path.exists(dest_path) else 0
+    if offset > expected_size:
+        offset = 0
+    if digest is not None:
+        await asyncio.to_thread(digest.resume, dest_path, offset)
+    if offset == expected_size:
+        return
+    def pieces():
+        position = 0
+        for length, basis_offset in delta["plan"]:
+            start = max(offset, position)
+            while start < position + length:
+                end = min(start + PARALLEL_CHUNK_SIZE, position + length)
+                yield start, end, None if basis_offset is None else basis_offset + start - position
+                start = end
+            position += length
+    pending = pieces()
+    in_flight = collections.deque()
+    def start_next():
+        piece = next(pending, None)
+        if piece is None:
+            return
+        start, end, basis_start = piece
+        if basis_start is None:
+            in_flight.append((True, asyncio.ensure_future(_fetch_range_async(delta["url"], delta["headers"], start, end))))
+        else:
+            in_flight.append((False, asyncio.ensure_future(asyncio.to_thread(_read_file_range, delta["basis_path"], basis_start, end - start))))
+    writer = TransferFileWriter(dest_path, offset, expected_size, digest=digest)
+    try:
+        for _ in range(TRANSFER_SETTINGS["parallel_streams"]):
+            start_next()
+        while in_flight:
+            fetched, task = in_flight.popleft()
+            chunk = await task
+            start_next()
+            if progress and fetched:
+                progress(len(chunk))
+            if not writer.has_room(len(chunk)):
+                await asyncio.to_thread(writer.flush)
+            writer.append(chunk)
+    finally:
+        for _, task in in_flight:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in in_flight), return_exceptions=True)
+        await asyncio.to_thread(writer.close)
+
+def write_chunk_index_file(path: str) -> str:
+    """Writes path's chunk index next to it as <path>.chunks.json, for publishing alongside the file."""
+    index = compute_chunk_index(path)
+    index_path = path + CHUNK_INDEX_SUFFIX
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    return index_path
+
+
+# --- Model Sources ---
+# A catalog entry's "source" picks where its bytes come from (default "hf"):
+#   "hf":   repo_id + filename_in_repo, or repo_id + is_snapshot/allow_patterns
+#   "http": url (single files only)
+#   "s3":   bucket + key, or bucket + prefix with is_snapshot; optional s3_endpoint and
+#           s3_region, credentials from AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY
+#   "file": path to a file, or to a directory with is_snapshot (e.g. an NFS share)
+# Any entry may carry "sha256" to have a single-file download verified before it is
+# moved into place, and "chunk_index_url" to let a replacement be delta-synced (see Delta
+# Sync). All sources share the same queue, retries, resume and progress.
+
+S3_PRESIGN_EXPIRES = 3600
+S3_XML_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+class ModelSource(ABC):
+    """Base class: resolves a catalog entry's files to something download_atomic can fetch."""
+    kind = ""
+    identity_fields = () # Catalog keys that identify what is downloaded
+    supports_snapshots = False
+
+    def __init__(self, model_info: dict):
+        self.model_info = model_info
+
+    @property
+    @abstractmethod
+    def label(self) -> str:
+        """Short name for logs and the metrics 'repo' label."""
+
+    def validate(self) -> str | None:
+        """Returns a configuration error message, or None if the entry can be downloaded."""
+        return None
+
+    @abstractmethod
+    def default_path(self) -> str | None:
+        """The file a single-file entry downloads."""
+
+    @abstractmethod
+    def host(self) -> str:
+        """The host contacted for this entry, for circuit breaking."""
+
+    @abstractmethod
+    def list_files(self, allow_patterns=None) -> dict:
+        """Snapshot listing as {relative_path: {"size", "sha256", "blob_id"}}. Only called when supports_snapshots."""
+
+    @abstractmethod
+    def resolve(self, rel_path: str, remote_info: dict | None = None) -> dict:
+        """{"url", "headers", "size", ...} or {"path", "size"} for download_atomic."""
+
+    def direct_request(self, rel_path: str) -> dict | None:
+        """{"url", "headers"} for a one-shot GET of a snapshot file without a resolve round trip, or None."""
+        return None
+
+    def _chunk_index_url(self) -> str | None:
+        """The entry's published chunk index (single files only; snapshot files are found through mirrors)."""
+        return None if self.model_info.get("is_snapshot") else self.model_info.get("chunk_index_url")
+
+    def fetch(self, rel_path: str, final_path: str, use_hf_transfer: bool = False, task_id=None, remote_info: dict | None = None) -> str:
+        """Downloads one file to final_path, trying LAN mirrors first when its sha256 is known up front."""
+        expected_sha256 = (remote_info or {}).get("sha256") or (None if self.model_info.get("is_snapshot") else self.model_info.get("sha256"))
+        label = rel_path.rsplit("/", 1)[-1]
+        if expected_sha256 and MIRROR_SETTINGS["mirrors"] and fetch_from_mirrors(expected_sha256, (remote_info or {}).get("size"), final_path, label, self.label, task_id):
+            register_content(expected_sha256, final_path)
+            return final_path
+        download_atomic(lambda: self.resolve(rel_path, remote_info), final_path, use_hf_transfer, label=label, repo=self.label,
+                        task_id=task_id, source_host=self.host(), expected_sha256=expected_sha256, chunk_index_url=self._chunk_index_url())
+        if expected_sha256:
+            register_content(expected_sha256, final_path)
+        return final_path
+
+class HfSource(ModelSource):
+    kind = "hf"
+    identity_fields = ("repo_id", "filename_in_repo")
+    supports_snapshots = True
+
+    @property
+    def label(self):
+        return self.model_info.get("repo_id", "")
+
+    def validate(self):
+        return None if self.model_info.get("repo_id") else "Missing 'repo_id'"
+
+    def default_path(self):
+        return self.model_info.get("filename_in_repo")
+
+    def host(self):
+        return hf_endpoint_host(self.model_info["repo_id"])
+
+    def list_files(self, allow_patterns=None):
+        return list_remote_snapshot_files(self.model_info["repo_id"], allow_patterns)
+
+    def resolve(self, rel_path, remote_info=None):
+        return resolve_hf_file(self.model_info["repo_id"], rel_path)
+
+    def direct_request(self, rel_path):
+        # httpx drops the Authorization header itself if the Hub redirects to another origin
+        return {"url": hf_hub_url(self.model_info["repo_id"], rel_path), "headers": build_hf_headers()}
+
+    def fetch(self, rel_path, final_path, use_hf_transfer=False, task_id=None, remote_info=None):
+        return download_hf_file(self.model_info["repo_id"], rel_path, final_path, use_hf_transfer, task_id, self._chunk_index_url())
+
+class HttpSource(ModelSource):
+    kind = "http"
+    identity_fields = ("url",)
+
+    @property
+    def label(self):
+        return self.host()
+
+    def validate(self):
+        return None if self.model_info.get("url") else "Missing 'url'"
+
+    def default_path(self):
+        return httpx.URL(self.model_info["url"]).path.rsplit("/", 1)[-1] or self.model_info.get("save_filename")
+
+    def host(self):
+        return httpx.URL(self.model_info["url"]).host
+
+    def list_files(self, allow_patterns=None):
+        raise ValueError("HTTP sources are single files; snapshots are not supported")
+
+    def resolve(self, rel_path, remote_info=None):
+        url = self.model_info["url"]
+        size = None
+        response = transfer_request("HEAD", url)
+        if response.status_code == 404 or response.status_code in RETRYABLE_STATUS_CODES:
+            response.raise_for_status()
+        if response.status_code < 300 and "content-length" in response.headers and "content-encoding" not in response.headers:
+            size = int(response.headers["content-length"])
+        # Some servers and presigned links refuse HEAD; the GET still works, just without a size check
+        return {"url": url, "headers": {}, "size": size}
+
+def _s3_credentials():
+    return os.environ.get("AWS_ACCESS_KEY_ID"), os.environ.get("AWS_SECRET_ACCESS_KEY"), os.environ.get("AWS_SESSION_TOKEN")
+
+def s3_presign_url(method: str, endpoint: str, region: str, bucket: str, key: str = "", query: dict | None = None, expires: int = S3_PRESIGN_EXPIRES) -> str:
+    """
+    Builds a path-style S3 URL, presigned with SigV4 query parameters when credentials are
+    set (works with AWS and S3-compatible stores such as MinIO). Without credentials the
+    plain URL is returned for public buckets.
+    """
+    endpoint_url = httpx.URL(endpoint)
+    netloc = endpoint_url.netloc.decode("ascii")
+    canonical_uri = "/" + quote(bucket, safe="-_.~") + ("/" + quote(key, safe="/-_.~") if key else "")
+    params = dict(query or {})
+    access_key, secret_key, session_token = _s3_credentials()
+    if access_key and secret_key:
+        now = time.gmtime()
+        amz_date = time.strftime("%Y%m%dT%H%M%SZ", now)
+        scope = f"{amz_date[:8]}/{region}/s3/aws4_request"
+        params.update({
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{access_key}/{scope}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expires),
+            "X-Amz-SignedHeaders": "host",
+        })
+        if session_token:
+            params["X-Amz-Security-Token"] = session_token
+    canonical_query = "&".join(f"{quote(k, safe='-_.~')}={quote(str(v), safe='-_.~')}" for k, v in sorted(params.items()))
+    url = f"{endpoint_url.scheme}://{netloc}{canonical_uri}"
+    if not (access_key and secret_key):
+        return f"{url}?{canonical_query}" if canonical_query else url
+    signature = s3_sigv4_signature(secret_key, region, amz_date, method, canonical_uri, canonical_query, netloc)
+    return f"{url}?{canonical_query}&X-Amz-Signature={signature}"
+
+def s3_sigv4_signature(secret_key: str, region: str, amz_date: str, method: str, canonical_uri: str, canonical_query: str, host: str) -> str:
+    """The X-Amz-Signature of a presigned request that signs only the host header, with an unsigned payload."""
+    scope = f"{amz_date[:8]}/{region}/s3/aws4_request"
+    canonical_request = "\n".join([method, canonical_uri, canonical_query, f"host:{host}\n", "host", "UNSIGNED-PAYLOAD"])
+    string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()])
+    signing_key = ("AWS4" + secret_key).encode("utf-8")
+    for part in (amz_date[:8], region, "s3", "aws4_request"):
+        signing_key = hmac.new(signing_key, part.encode("utf-8"), hashlib.sha256).digest()
+    return hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+
+class S3Source(ModelSource):
+    kind = "s3"
+    identity_fields = ("s3_endpoint", "bucket", "key", "prefix")
+    supports_snapshots = True
+
+    @property
+    def region(self):
+        return self.model_info.get("s3_region") or os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or "us-east-1"
+
+    @property
+    def endpoint(self):
+        return (self.model_info.get("s3_endpoint") or os.environ.get("AWS_ENDPOINT_URL_S3") or os.environ.get("AWS_ENDPOINT_URL")
+                or f"https://s3.{self.region}.amazonaws.com")
+
+    @property
+    def label(self):
+        return f"s3://{self.model_info.get('bucket', '')}"
+
+    def validate(self):
+        if not self.model_info.get("bucket"):
+            return "Missing 'bucket'"
+        if not self.model_info.get("prefix" if self.model_info.get("is_snapshot") else "key"):
+            return "Missing 'prefix'" if self.model_info.get("is_snapshot") else "Missing 'key'"
+        return None
+
+    def default_path(self):
+        return self.model_info.get("key")
+
+    def host(self):
+        return httpx.URL(self.endpoint).host
+
+    def _object_key(self, rel_path):
+        if not self.model_info.get("is_snapshot"):
+            return rel_path
+        return self.model_info["prefix"].rstrip("/") + "/" + rel_path
+
+    def list_files(self, allow_patterns=None):
+        """Pages through ListObjectsV2 under the entry's prefix."""
+        prefix = self.model_info["prefix"].rstrip("/") + "/"
+        remote_files, continuation = {}, None
+        while True:
+            query = {"list-type": "2", "prefix": prefix}
+            if continuation:
+                query["continuation-token"] = continuation
+            response = transfer_request("GET", s3_presign_url("GET", self.endpoint, self.region, self.model_info["bucket"], query=query))
+            response.raise_for_status()
+            root = ElementTree.fromstring(response.content)
+            for entry in root.iter(f"{S3_XML_NAMESPACE}Contents"):
+                object_key = entry.findtext(f"{S3_XML_NAMESPACE}Key")
+                if object_key.endswith("/"):
+                    continue # Folder placeholder objects
+                remote_files[object_key[len(prefix):]] = {"size": int(entry.findtext(f"{S3_XML_NAMESPACE}Size")), "sha256": None, "blob_id": None}
+            if root.findtext(f"{S3_XML_NAMESPACE}IsTruncated") != "true":
+                break
+            continuation = root.findtext(f"{S3_XML_NAMESPACE}NextContinuationToken")
+        return {rel_path: remote_files[rel_path] for rel_path in filter_repo_objects(list(remote_files), allow_patterns=allow_patterns)}
+
+    def resolve(self, rel_path, remote_info=None):
+        object_key = self._object_key(rel_path)
+        size = (remote_info or {}).get("size")
+        if size is None:
+            response = transfer_request("HEAD", s3_presign_url("HEAD", self.endpoint, self.region, self.model_info["bucket"], object_key), follow_redirects=False)
+            response.raise_for_status()
+            size = int(response.headers["content-length"])
+        return {"url": s3_presign_url("GET", self.endpoint, self.region, self.model_info["bucket"], object_key), "headers": {}, "size": size}
+
+    def direct_request(self, rel_path):
+        return {"url": s3_presign_url("GET", self.endpoint, self.region, self.model_info["bucket"], self._object_key(rel_path)), "headers": {}}
+
+class FileSource(ModelSource):
+    kind = "file"
+    identity_fields = ("path",)
+    supports_snapshots = True
+
+    @property
+    def label(self):
+        return self.model_info.get("path", "")
+
+    def validate(self):
+        return None if self.model_info.get("path") else "Missing 'path'"
+
+    def default_path(self):
+        return os.path.basename(self.model_info["path"].rstrip("/\\"))
+
+    def host(self):
+        return "local"
+
+    def _source_path(self, rel_path):
+        if not self.model_info.get("is_snapshot"):
+            return self.model_info["path"]
+        return os.path.join(self.model_info["path"], *rel_path.split("/"))
+
+    def list_files(self, allow_patterns=None):
+        root_dir = self.model_info["path"]
+        if not os.path.isdir(root_dir):
+            raise FileNotFoundError(f"Source directory not found: {root_dir}")
+        return {rel_path: {"size": os.path.getsize(os.path.join(root_dir, *rel_path.split("/"))), "sha256": None, "blob_id": None}
+                for rel_path in _local_snapshot_files(root_dir, allow_patterns)}
+
+    def resolve(self, rel_path, remote_info=None):
+        source_path = self._source_path(rel_path)
+        return {"path": source_path, "size": os.path.getsize(source_path)}
+
+SOURCE_TYPES = {source_class.kind: source_class for source_class in (HfSource, HttpSource, S3Source, FileSource)}
+
+def get_model_source(model_info: dict) -> ModelSource:
+    kind = model_info.get("source", "hf")
+    if kind not in SOURCE_TYPES:
+        raise ValueError(f"Unknown source '{kind}' (expected one of: {', '.join(SOURCE_TYPES)})")
+    return SOURCE_TYPES[kind](model_info)
+
+def source_identity(model_info: dict) -> tuple:
+    kind = model_info.get("source", "hf")
+    source_class = SOURCE_TYPES.get(kind)
+    return (kind,) + tuple(model_info.get(field) for field in (source_class.identity_fields if source_class else ()))
+
+
+# --- Download Leases ---
+# Pods that share one Models volume (e.g. over NFS) coordinate through a lease file next to
+# each target (".<name>.swarmdl-lease", created with O_EXCL). The holder rewrites it every
+# LEASE_HEARTBEAT_SECONDS. A process that finds someone else's lease defers the task, and
+# once the lease is gone reuses the finished file instead of downloading it again. A lease
+# whose content hasn't changed for LEASE_STALE_SECONDS, timed on the observer's own clock
+# so clock skew between pods doesn't matter, is taken over; so is one left by a dead
+# process on this host.
+
+LEASE_SUFFIX = ".swarmdl-lease"
+LEASE_HEARTBEAT_SECONDS = 10.0
+LEASE_STALE_SECONDS = 60.0
+LEASE_RECHECK_SECONDS = 5.0 # How soon a task deferred by a lease is retried
+LEASE_HOSTNAME = platform.node()
+LEASE_OWNER = f"{LEASE_HOSTNAME}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class LeaseBusyError(Exception):
+    """Another process holds the lease for a target; the task is deferred until retry_at."""
+    def __init__(self, target_path: str, owner: str, retry_at: float):
+        super().__init__(f"'{os.path.basename(target_path)}' is being downloaded by {owner}")
+        self.target_path = target_path
+        self.owner = owner
+        self.retry_at = retry_at
+
+lease_lock = threading.Lock()
+held_leases = {} # lease path -> heartbeat count, for leases this process holds
+lease_observations = {} # lease path -> (content token, monotonic time first seen) for staleness timing
+lease_waits = {} # (target path, task id) -> the target's stat signature when that task first found it leased
+lease_heartbeat_thread = None
+
+def lease_path_for(target_path: str) -> str:
+    directory, name = os.path.split(os.path.normpath(target_path))
+    return os.path.join(directory, f".{name}{LEASE_SUFFIX}")
+
+def _lease_record(beats: int) -> bytes:
+    return json.dumps({"owner": LEASE_OWNER, "host": LEASE_HOSTNAME, "pid": os.getpid(), "beats": beats, "written_at": time.time()}).encode("utf-8")
+
+def _read_lease(lease_path: str):
+    """(token, record) where token changes on every heartbeat; record is None if unparseable. Raises FileNotFoundError."""
+    with open(lease_path, "rb") as f:
+        raw = f.read(4096)
+        st = os.fstat(f.fileno())
+    try:
+        record = json.loads(raw)
+    except ValueError:
+        record = None # Caught mid-rewrite; the token still moves
+    return (st.st_mtime_ns, st.st_size, raw), record if isinstance(record, dict) else None
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except (ProcessLookupError, ValueError, TypeError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _lease_is_stale(lease_path: str, token, record) -> bool:
+    if record and record.get("host") == LEASE_HOSTNAME and not _pid_alive(record.get("pid")):
+        return True
+    now = time.monotonic()
+    with lease_lock:
+        seen = lease_observations.get(lease_path)
+        if not seen or seen[0] != token:
+            lease_observations[lease_path] = (token, now)
+            return False
+    return now - seen[1] >= LEASE_STALE_SECONDS
+
+def _target_signature(target_path: str):
+    try:
+        st = os.stat(target_path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+def _take_over_lease(lease_path: str, stale_token) -> bool:
+    """Moves a stale lease aside. If it was refreshed in the meantime, puts it back and returns False."""
+    grave_path = f"{lease_path}.stale-{uuid.uuid4().hex[:8]}"
+    try:
+        os.rename(lease_path, grave_path)
+    except FileNotFoundError:
+        return True # Released or taken over by someone else; just try to create it
+    try:
+        token, _ = _read_lease(grave_path)
+        if token[2] != stale_token[2]:
+            with contextlib.suppress(FileExistsError):
+                os.link(grave_path, lease_path) # A live holder's lease: restore it (unless another one exists by now)
+            return False
+        return True
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(grave_path)
+
+def acquire_download_lease(target_path: str, task_id=None, reuse_result: bool = True) -> bool:
+    """
+    Takes the lease for target_path. With reuse_result, returns True if another process
+    replaced the target while this one waited; the lease is then released again and the
+    result can be reused. (Snapshots pass False: their sync diff decides what's left.)
+    Raises LeaseBusyError while a live lease is held elsewhere.
+    """
+    lease_path = lease_path_for(target_path)
+    os.makedirs(os.path.dirname(lease_path), exist_ok=True)
+    while True:
+        try:
+            fd = os.open(lease_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            try:
+                token, record = _read_lease(lease_path)
+            except FileNotFoundError:
+                continue # Released between the two calls
+            if _lease_is_stale(lease_path, token, record):
+                owner = (record or {}).get("owner", "unknown")
+                if _take_over_lease(lease_path, token):
+                    add_log(f"WARNING: Taking over stale download lease for '{os.path.basename(target_path)}' from {owner}.")
+                    emit_event("lease_takeover", task_id=task_id, path=target_path, previous_owner=owner)
+                continue
+            with lease_lock:
+                first_wait = (target_path, task_id) not in lease_waits
+                lease_waits.setdefault((target_path, task_id), _target_signature(target_path))
+            owner = (record or {}).get("owner", "another process")
+            if first_wait:
+                add_log(f"INFO: '{os.path.basename(target_path)}' is being downloaded by {owner}. Waiting for it to finish.")
+            raise LeaseBusyError(target_path, owner, time.time() + LEASE_RECHECK_SECONDS)
+        try:
+            os.write(fd, _lease_record(0))
+        finally:
+            os.close(fd)
+        break
+    _start_lease_heartbeat()
+    with lease_lock:
+        held_leases[lease_path] = 0
+        lease_observations.pop(lease_path, None)
+        waited = (target_path, task_id) in lease_waits
+        signature_before = lease_waits.pop((target_path, task_id), None)
+    if reuse_result and waited and _target_signature(target_path) not in (None, signature_before):
+        release_download_lease(target_path)
+        return True
+    return False
+
+def release_download_lease(target_path: str):
+    lease_path = lease_path_for(target_path)
+    with lease_lock:
+        if held_leases.pop(lease_path, None) is None:
+            return
+    try:
+        _, record = _read_lease(lease_path)
+        if record and record.get("owner") == LEASE_OWNER: # Never delete a lease another process took over
+            os.remove(lease_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        add_log(f"WARNING: Could not release download lease {lease_path}: {e}")
+
+def _lease_heartbeat_loop():
+    while True:
+        time.sleep(LEASE_HEARTBEAT_SECONDS)
+        with lease_lock:
+            leases = list(held_leases.items())
+        for lease_path, beats in leases:
+            try:
+                _, record = _read_lease(lease_path)
+                if record is not None and record.get("owner") != LEASE_OWNER:
+                    raise FileNotFoundError
+                with open(lease_path, "r+b") as f:
+                    f.write(_lease_record(beats + 1))
+                    f.truncate()
+            except FileNotFoundError:
+                with lease_lock:
+                    lost = held_leases.pop(lease_path, None) is not None
+                if lost:
+                    add_log(f"WARNING: Lost download lease {lease_path} (taken over after a stall?); another process may now fetch the same file.")
+                    emit_event("lease_lost", path=lease_path)
+                continue
+            except OSError as e:
+                add_log(f"WARNING: Could not refresh download lease {lease_path}: {e}")
+                continue
+            with lease_lock:
+                if lease_path in held_leases:
+                    held_leases[lease_path] = beats + 1
+
+def _start_lease_heartbeat():
+    global lease_heartbeat_thread
+    with lease_lock:
+        if lease_heartbeat_thread is None:
+            lease_heartbeat_thread = threading.Thread(target=_lease_heartbeat_loop, name="lease-heartbeat", daemon=True)
+            lease_heartbeat_thread.start()
+
+
+# --- Snapshot Sync ---
+
+SNAPSHOT_MANIFEST_NAME = "snapshot_manifest.json"
+SNAPSHOT_MAX_WORKERS = 8
+SMALL_FILE_MAX_SIZE = 8 * 1024 * 1024 # Snapshot files up to this size skip the per-file resolve and are pipelined
+SMALL_FILE_CONCURRENCY = 64
+HASH_READ_CHUNK_SIZE = 8 * 1024 * 1024
+
+def compute_file_digest(file_path: str, algorithm: str = "sha256") -> str:
+    """
+    Hashes a local file in chunks. 'git-sha1' reproduces the git blob id the Hub
+    reports for small (non-LFS) files; anything else is passed to hashlib.
+    """
+    if algorithm == "git-sha1":
+        hasher = hashlib.sha1()
+        hasher.update(f"blob {os.path.getsize(file_path)}\0".encode())
+    else:
+        hasher = hashlib.new(algorithm)
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def list_remote_snapshot_files(repo_id: str, allow_patterns=None) -> dict:
+    """
+    Lists the files of a Hub repo as {relative_path: {"size", "sha256", "blob_id"}}.
+    allow_patterns is applied the same way snapshot_download applies it.
+    """
+    remote_entries = [entry for entry in HfApi().list_repo_tree(repo_id, recursive=True) if getattr(entry, "blob_id", None)] # Folders have no blob_id
+    remote_files = {}
+    for entry in filter_repo_objects(remote_entries, allow_patterns=allow_patterns, key=lambda e: e.path):
+        lfs_info = entry.lfs or {}
+        remote_files[entry.path] = {"size": entry.size, "sha256": lfs_info.get("sha256"), "blob_id": entry.blob_id}
+    return remote_files
+
+def _expected_snapshot_digest(remote_info: dict):
+    """Returns (algorithm, digest) to compare a local file against: LFS sha256 when known, otherwise the git blob id."""
+    if remote_info.get("sha256"):
+        return "sha256", remote_info["sha256"]
+    return "git-sha1", remote_info.get("blob_id")
+
+def _snapshot_local_path(target_dir: str, rel_path: str) -> str:
+    return os.path.join(target_dir, *rel_path.split("/"))
+
+def _snapshot_manifest_path(target_dir: str) -> str:
+    return os.path.join(target_dir, STATE_DIR_NAME, SNAPSHOT_MANIFEST_NAME)
+
+def load_snapshot_manifest(target_dir: str) -> dict:
+    """
+    Loads the cached {relative_path: {size, mtime_ns, algorithm, digest, source}} records for a
+    snapshot directory. "source" (see snapshot_owner) names the snapshot a file belongs to:
+    a folder can hold several snapshots plus single-file downloads.
+    """
+    try:
+        with open(_snapshot_manifest_path(target_dir), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_snapshot_manifest(target_dir: str, manifest: dict):
+    """Writes the snapshot manifest via a temp file so a crash never leaves it half-written."""
+    manifest_path = _snapshot_manifest_path(target_dir)
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        temp_path = manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(temp_path, manifest_path)
+    except OSError as e:
+        add_log(f"WARNING: Could not save snapshot manifest {manifest_path}: {e}")
+
+def _record_snapshot_file(manifest: dict, local_path: str, rel_path: str, algorithm: str, digest: str, owner: str | None = None):
+    st = os.stat(local_path)
+    manifest[rel_path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "algorithm": algorithm, "digest": digest,
+                          "source": owner or manifest.get(rel_path, {}).get("source")}
+
+def snapshot_owner(model_info: dict) -> str:
+    """The "source" value of a snapshot's manifest records."""
+    return ":".join(str(part) for part in source_identity(model_info) if part is not None)
+
+def snapshot_owned_files(target_dir: str, model_info: dict) -> set:
+    """
+    Relative paths the folder's manifest records for this snapshot. Records written before
+    they named their snapshot count too; files another snapshot or a single-file download
+    put in the same folder don't.
+    """
+    owner = snapshot_owner(model_info)
+    return {rel_path for rel_path, record in load_snapshot_manifest(target_dir).items() if record.get("source") in (owner, None)}
+
+def _snapshot_file_is_current(target_dir: str, rel_path: str, remote_info: dict, manifest: dict, verify_hashes: bool) -> bool:
+    """
+    Size is always compared. A digest is compared when the manifest has one for the
+    file's current size/mtime, or computed (and cached) when verify_hashes is set.
+    """
+    local_path = _snapshot_local_path(target_dir, rel_path)
+    try:
+        st = os.stat(local_path)
+    except OSError:
+        return False
+    if st.st_size != remote_info.get("size"):
+        return False
+    algorithm, expected_digest = _expected_snapshot_digest(remote_info)
+    cached = manifest.get(rel_path)
+    if cached and cached.get("size") == st.st_size and cached.get("mtime_ns") == st.st_mtime_ns and cached.get("algorithm") == algorithm:
+        return cached.get("digest") == expected_digest
+    if not verify_hashes or not expected_digest:
+        return True
+    local_digest = compute_file_digest(local_path, algorithm)
+    _record_snapshot_file(manifest, local_path, rel_path, algorithm, local_digest)
+    return local_digest == expected_digest
+
+def _local_snapshot_files(target_dir: str, allow_patterns=None) -> list:
+    """Relative paths of the files in a snapshot directory that allow_patterns covers."""
+    rel_paths = []
+    for root, dirs, files in os.walk(target_dir):
+        if root == target_dir:
+            dirs[:] = [d for d in dirs if d not in (".cache", STATE_DIR_NAME)] # Legacy hf_hub_download metadata and our own state
+        for name in files:
+            if not name.endswith(PARTIAL_SUFFIX):
+                rel_paths.append(os.path.relpath(os.path.join(root, name), target_dir).replace(os.sep, "/"))
+    return sorted(filter_repo_objects(rel_paths, allow_patterns=allow_patterns))
+
+def diff_snapshot(target_dir: str, remote_files: dict, manifest: dict, verify_hashes: bool = False, allow_patterns=None, owner: str | None = None):
+    """
+    Compares a snapshot directory against the remote listing. Returns (missing, changed, stale)
+    relative paths. Only files the manifest records for owner (see snapshot_owner) can be stale.
+    """
+    missing, changed = [], []
+    for rel_path, remote_info in remote_files.items():
+        if not os.path.isfile(_snapshot_local_path(target_dir, rel_path)):
+            missing.append(rel_path)
+        elif not _snapshot_file_is_current(target_dir, rel_path, remote_info, manifest, verify_hashes):
+            changed.append(rel_path)
+
+    # Only files this snapshot put there, and that the allow_patterns cover, are ours to call stale
+    stale = [rel_path for rel_path in _local_snapshot_files(target_dir, allow_patterns)
+             if rel_path not in remote_files and owner and manifest.get(rel_path, {}).get("source") == owner]
+    return missing, changed, stale
+
+async def _fetch_small_file_async(request: dict, final_path: str, remote_info: dict, repo: str, task_id, slots: asyncio.Semaphore):
+    """One pipelined small-file GET into a partial file, checked against the listing's size and digest, then renamed into place."""
+    async with slots:
+        await asyncio.to_thread(os.makedirs, os.path.dirname(final_path), exist_ok=True) # Filesystem calls can block on a network volume
+        partial_path = partial_path_for(final_path)
+        progress = lambda increment: record_bytes_downloaded(increment, repo, "batch", task_id)
+        algorithm, expected_digest = _expected_snapshot_digest(remote_info)
+        digest = StreamingDigest(algorithm, remote_info.get("size")) if expected_digest else None
+        try:
+            await _stream_url_to_file_async(request["url"], partial_path, request["headers"], progress, remote_info.get("size"), digest)
+            def finalize():
+                if remote_info.get("size") is not None and os.path.getsize(partial_path) != remote_info["size"]:
+                    raise IncompleteTransferError(f"Size mismatch: expected {remote_info['size']} bytes, got {os.path.getsize(partial_path)}")
+                if digest is not None and digest.hexdigest() != expected_digest:
+                    raise ChecksumMismatchError(f"{algorithm} mismatch")
+                with open(partial_path, "rb+") as f:
+                    os.fsync(f.fileno())
+                os.replace(partial_path, final_path)
+            await asyncio.to_thread(finalize) # Hashing, fsync and the rename stay off the event loop
+        except BaseException:
+            def discard():
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(partial_path)
+            await asyncio.to_thread(discard)
+            raise
+    metric_inc("swarmdl_files_downloaded_total", repo=repo, backend="batch")
+
+def fetch_small_files(source: ModelSource, target_dir: str, rel_paths: list, remote_files: dict, task_id=None) -> tuple:
+    """
+    Fetches many small snapshot files at once over the pooled keep-alive connections,
+    so per-file latency overlaps instead of adding up. Returns (fetched, failed); failed
+    files are left for the regular per-file path with its retries.
+    """
+    async def fetch_all():
+        slots = asyncio.Semaphore(SMALL_FILE_CONCURRENCY)
+        coroutines = [_fetch_small_file_async(source.direct_request(rel_path), _snapshot_local_path(target_dir, rel_path), remote_files[rel_path], source.label, task_id, slots)
+                      for rel_path in rel_paths]
+        return await asyncio.gather(*coroutines, return_exceptions=True)
+    fetched, failed = [], []
+    for rel_path, result in zip(rel_paths, run_transfer(fetch_all())):
+        (failed if isinstance(result, BaseException) else fetched).append(rel_path)
+    if failed:
+        add_log(f" -> {len(failed)} small file(s) failed in the batch and will be retried individually.")
+    return fetched, failed
+
+def sync_snapshot(source: ModelSource, target_dir: str, allow_patterns=None, verify_hashes: bool = False, delete_stale: bool = False, use_hf_transfer: bool = False, max_workers: int = SNAPSHOT_MAX_WORKERS, task_id=None) -> dict:
+    """
+    Brings target_dir in line with the source's file listing: only missing or changed files are
+    fetched, and stale local files are removed when delete_stale is set. Small files are
+    pipelined in one batch (fetch_small_files); large ones go through the per-file path
+    (resolve, mirrors, hf_transfer chunking, retries) on max_workers threads.
+    Returns a summary dict with fetched/failed/deleted paths and the remote file count.
+    Raises CircuitOpenError (after saving progress) if files were held back by an open circuit breaker.
+    """
+    def list_remote(contact):
+        contact(source.host())
+        return source.list_files(allow_patterns)
+    remote_files = call_with_retries(list_remote, f"{source.label} file list", task_id)
+    manifest = load_snapshot_manifest(target_dir)
+    owner = snapshot_owner(source.model_info)
+    missing, changed, stale = diff_snapshot(target_dir, remote_files, manifest, verify_hashes, allow_patterns, owner)
+    to_fetch = missing + changed
+    for rel_path in set(remote_files) - set(to_fetch): # Claim the files that are already current, so they can go stale later
+        local_path = _snapshot_local_path(target_dir, rel_path)
+        if rel_path in manifest:
+            manifest[rel_path]["source"] = owner
+        else:
+            st = os.stat(local_path)
+            manifest[rel_path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "source": owner}
+    record_cache_lookup("snapshot_file", True, count=len(remote_files) - len(to_fetch))
+    record_cache_lookup("snapshot_file", False, count=len(to_fetch))
+    add_log(f" -> Snapshot diff for {source.label}: {len(remote_files)} remote files, {len(missing)} missing, {len(changed)} changed, {len(stale)} stale.")
+
+    fetched, failed, deleted = [], [], []
+    circuit_error = None
+    small_files = [rel_path for rel_path in to_fetch if (remote_files[rel_path].get("size") or 0) <= SMALL_FILE_MAX_SIZE]
+    if len(small_files) > 1 and source.direct_request(small_files[0]) is not None:
+        try:
+            check_circuit(source.host(), take_trial=False) # The batch doesn't report to the breaker; leave a trial to the per-file path
+            batch_fetched, _ = fetch_small_files(source, target_dir, small_files, remote_files, task_id)
+        except CircuitOpenError:
+            batch_fetched = [] # The per-file path below reports it
+        for rel_path in batch_fetched:
+            algorithm, digest = _expected_snapshot_digest(remote_files[rel_path])
+            _record_snapshot_file(manifest, _snapshot_local_path(target_dir, rel_path), rel_path, algorithm, digest, owner)
+            fetched.append(rel_path)
+        batch_fetched = set(batch_fetched)
+        to_fetch = [rel_path for rel_path in to_fetch if rel_path not in batch_fetched]
+    if to_fetch:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(to_fetch)))) as pool:
+            futures = {
+                pool.submit(source.fetch, rel_path, _snapshot_local_path(target_dir, rel_path), use_hf_transfer, task_id, remote_files[rel_path]): rel_path
+                for rel_path in to_fetch
+            }
+            for future in as_completed(futures):
+                rel_path = futures[future]
+                try:
+                    future.result()
+                    algorithm, digest = _expected_snapshot_digest(remote_files[rel_path])
+                    _record_snapshot_file(manifest, _snapshot_local_path(target_dir, rel_path), rel_path, algorithm, digest, owner)
+                    fetched.append(rel_path)
+                except CircuitOpenError as e:
+                    failed.append(rel_path)
+                    circuit_error = e
+                except Exception as e:
+                    failed.append(rel_path)
+                    add_log(f" -> ERROR fetching '{rel_path}' from {source.label}: {type(e).__name__} - {e}")
+
+    if delete_stale:
+        for rel_path in stale:
+            try:
+                os.remove(_snapshot_local_path(target_dir, rel_path))
+                deleted.append(rel_path)
+                add_log(f" -> Removed stale snapshot file: {rel_path}")
+            except OSError as e:
+                add_log(f" -> WARNING: Could not remove stale snapshot file '{rel_path}': {e}")
+
+    for rel_path in list(manifest):
+        record_owner = manifest[rel_path].get("source")
+        if rel_path in remote_files or record_owner not in (owner, None):
+            continue
+        # Keep this snapshot's stale files recorded while they exist, so a later delete_stale sync still removes them
+        if record_owner is None or not os.path.isfile(_snapshot_local_path(target_dir, rel_path)):
+            del manifest[rel_path]
+    save_snapshot_manifest(target_dir, manifest)
+    if circuit_error:
+        raise circuit_error
+    return {"remote_count": len(remote_files), "fetched": fetched, "failed": failed, "deleted": deleted, "stale": stale}
+
+def _download_model_internal(model_info, sub_category_info, base_path, use_hf_transfer, is_comfy_ui_structure, task_id=None):
+    """
+    Handles the download of a single model or snapshot directly to the target folder.
+    Returns "success", "skipped" (already present) or "failed".
+    CircuitOpenError and LeaseBusyError propagate so the worker can defer the task instead of failing it.
+    """
+    model_name = model_info.get('name', model_info.get('repo_id'))
+    save_filename = model_info.get('save_filename') 
+    is_snapshot = model_info.get('is_snapshot', False)
+    allow_patterns = model_info.get('allow_patterns')
+    pre_delete = model_info.get('pre_delete_target', False)
+    allow_overwrite = model_info.get('allow_overwrite', False)
+    delete_stale = model_info.get('delete_stale_files', False) # Snapshots only: remove local files no longer in the repo
+
+    try:
+        source = get_model_source(model_info)
+        config_error = source.validate()
+    except ValueError as e:
+        config_error = str(e)
+    if not config_error and is_snapshot and not source.supports_snapshots:
+        config_error = f"Source '{source.kind}' does not support snapshots"
+    if config_error:
+        add_log(f"ERROR: {config_error} for model {model_name}. Skipping.")
+        return "failed"
+    filename = None if is_snapshot else source.default_path()
+    repo_id = source.label # For log messages
+    if not base_path:
+        add_log(f"ERROR: Missing 'base_path' for model {model_name}. Skipping.")
+        return "failed"
+
+    target_dir = get_target_path(base_path, model_info, sub_category_info, is_comfy_ui_structure)
+    if not os.path.isdir(target_dir): # Re-check after get_target_path's makedirs attempt
+         add_log(f"ERROR: Target directory {target_dir} could not be confirmed for {model_name}. Skipping.")
+         return "failed"
+
+    final_target_path = os.path.join(target_dir, save_filename) if save_filename else None
+
+    if not is_snapshot and final_target_path:
+        already_present = os.path.exists(final_target_path) and not allow_overwrite and not pre_delete
+        record_cache_lookup("skip_if_present", already_present)
+        if already_present:
+            add_log(f"INFO: Final target file '{final_target_path}' already exists and overwrite/pre-delete not allowed. Skipping download for '{model_name}'.")
+            return "skipped"
+
+    lease_target = target_dir if is_snapshot else final_target_path
+    if lease_target and acquire_download_lease(lease_target, task_id, reuse_result=not is_snapshot):
+        add_log(f"INFO: '{lease_target}' was just downloaded by another process sharing this folder. Reusing it for '{model_name}'.")
+        return "skipped"
+    add_log(f"Starting download: {model_name}...")
+    try:
+        start_time = time.time()
+        actual_downloaded_path = None 
+
+        if is_snapshot:
+            # allow_overwrite now means "verify every local file by hash" rather than "re-fetch everything"
+            add_log(f" -> Syncing snapshot from {repo_id} into {target_dir}...")
+            sync_result = sync_snapshot(
+                source,
+                target_dir, # Use resolved target_dir
+                allow_patterns=allow_patterns,
+                verify_hashes=allow_overwrite,
+                delete_stale=delete_stale,
+                use_hf_transfer=use_hf_transfer,
+                task_id=task_id,
+            )
+            if sync_result["failed"]:
+                emit_event("error", task_id=task_id, name=model_name, error_type="SnapshotIncomplete", message=f"{len(sync_result['failed'])} files failed", failed_files=sync_result["failed"][:20])
+                add_log(f"ERROR: Snapshot sync for {repo_id} incomplete: {len(sync_result['failed'])} of {len(sync_result['fetched']) + len(sync_result['failed'])} files failed. Re-queue to fetch the remainder.")
+                return "failed"
+            if not sync_result["fetched"] and not sync_result["deleted"]:
+                add_log(f"INFO: Snapshot '{target_dir}' already matches {repo_id} ({sync_result['remote_count']} files). Nothing to download for '{model_name}'.")
+                return "skipped"
+            actual_downloaded_path = target_dir
+            add_log(f" -> Snapshot sync complete for {repo_id}: {len(sync_result['fetched'])} fetched, {len(sync_result['deleted'])} stale removed.")
+            final_target_path = actual_downloaded_path
+
+        elif filename and save_filename and final_target_path:
+            add_log(f" -> Downloading file '{filename}' from {repo_id} into '{target_dir}' (preserving structure from filename)...")
+
+            if os.path.exists(final_target_path):
+                # pre_delete/allow_overwrite: the existing file is only replaced once the new one is complete
+                add_log(f" -> Existing '{final_target_path}' will be replaced atomically once the new download completes.")
+            is_hot = (model_info.get("target_dir_key") or sub_category_info.get("target_dir_key")) in PLACEMENT_SETTINGS["hot_target_keys"]
+            actual_downloaded_path = fetch_with_placement(source, filename, final_target_path, base_path, is_hot, use_hf_transfer, task_id)
+            add_log(f" -> File downloaded and moved into place: {actual_downloaded_path}")
+
+        else:
+             if is_snapshot: 
+                 add_log(f"ERROR: Internal logic error for snapshot {model_name}. Skipping.")
+             elif not filename:
+                  add_log(f"ERROR: Invalid configuration for model {model_name}. Missing 'filename_in_repo' (or url/key/path for other sources). Skipping.")
+             elif not save_filename:
+                  add_log(f"ERROR: Invalid configuration for model {model_name}. Missing 'save_filename'. Skipping.")
+             else:
+                  add_log(f"ERROR: Invalid configuration for model {model_name}. Path issue? Skipping.")
+             return "failed"
+
+        end_time = time.time()
+        success_path = final_target_path if not is_snapshot else actual_downloaded_path 
+        add_log(f"SUCCESS: Downloaded and processed {model_name} in {end_time - start_time:.2f} seconds. Final location: {success_path}")
+        return "success"
+
+    except CircuitOpenError:
+        raise
+    except (HfHubHTTPError, HFValidationError) as e:
+        emit_event("error", task_id=task_id, name=model_name, error_type=type(e).__name__, category="hf_hub", message=str(e))
+        add_log(f"ERROR downloading {model_name} (HF Hub): {type(e).__name__} - {str(e)}")
+    except httpx.HTTPError as e:
+        emit_event("error", task_id=task_id, name=model_name, error_type=type(e).__name__, category="http", message=str(e))
+        add_log(f"ERROR downloading {model_name} (HTTP): {type(e).__name__} - {str(e)}")
+    except FileNotFoundError as e:
+         emit_event("error", task_id=task_id, name=model_name, error_type=type(e).__name__, category="filesystem", message=str(e))
+         add_log(f"ERROR during file operation for {model_name} (File System): {type(e).__name__} - {str(e)}")
+    except OSError as e:
+         emit_event("error", task_id=task_id, name=model_name, error_type=type(e).__name__, category="os", message=str(e))
+         add_log(f"ERROR during file operation (rename/delete) for {model_name} (OS Error/Permissions): {type(e).__name__} - {str(e)}")
+    except Exception as e:
+        emit_event("error", task_id=task_id, name=model_name, error_type=type(e).__name__, category="unexpected", message=str(e))
+        add_log(f"UNEXPECTED ERROR during download/process for {model_name}: {type(e).__name__} - {str(e)}")
+        if 'actual_downloaded_path' in locals() and actual_downloaded_path:
+             add_log(f" -> State before error: actual_downloaded_path='{actual_downloaded_path}'")
+        if 'final_target_path' in locals() and final_target_path:
+             add_log(f" -> State before error: final_target_path='{final_target_path}'")
+    finally:
+        if lease_target:
+            release_download_lease(lease_target)
+    return "failed"
+
+def _task_dedup_key(model_info, sub_category_info, base_path, is_comfy_ui_structure):
+    """Identifies a download by where it lands and what it fetches."""
+    return (
+        os.path.normpath(base_path),
+        bool(is_comfy_ui_structure),
+        model_info.get("target_dir_key") or sub_category_info.get("target_dir_key"),
+        model_info.get("save_filename"),
+        source_identity(model_info),
+    )
+
+def queue_download_task(model_info, sub_category_info, base_path, use_hf_transfer, is_comfy_ui_structure):
+    """
+    Puts a task on the download queue unless the same target is already queued or
+    downloading (e.g. a model shared by two bundles). Returns the new task id, or
+    None if the task was a duplicate (pending_task_id then gives the existing one).
+    """
+    dedup_key = _task_dedup_key(model_info, sub_category_info, base_path, is_comfy_ui_structure)
+    task_id = uuid.uuid4().hex[:12]
+    with pending_lock:
+        duplicate = dedup_key in pending_task_keys
+        if not duplicate:
+            pending_task_keys[dedup_key] = task_id
+    record_cache_lookup("dedup", duplicate)
+    if duplicate:
+        add_log(f"INFO: '{model_info.get('name', model_info.get('repo_id'))}' is already queued or downloading. Not queued again.")
+        return None
+    update_task_state(task_id, state="queued", name=model_info.get("name"), queued_at=time.time())
+    download_queue.put((task_id, model_info, sub_category_info, base_path, use_hf_transfer, is_comfy_ui_structure))
+    emit_event("task_queued", task_id=task_id, name=model_info.get("name"), repo_id=model_info.get("repo_id"),
+               kind="snapshot" if model_info.get("is_snapshot") else "file", queue_depth=download_queue.qsize())
+    return task_id
+
+def pending_task_id(model_info, sub_category_info, base_path, is_comfy_ui_structure) -> str | None:
+    """Id of the queued or running task for the same target, if there is one."""
+    with pending_lock:
+        return pending_task_keys.get(_task_dedup_key(model_info, sub_category_info, base_path, is_comfy_ui_structure))
+
+def defer_task(task, retry_at: float):
+    """Parks a task until retry_at; the worker picks it up again ahead of the normal queue."""
+    with deferred_lock:
+        heapq.heappush(deferred_tasks, (retry_at, next(deferred_sequence), task))
+
+def _take_ready_deferred_task():
+    with deferred_lock:
+        if deferred_tasks and deferred_tasks[0][0] <= time.time():
+            return heapq.heappop(deferred_tasks)[2]
+    return None
+
+def download_worker():
+    """Worker thread function to process the download queue."""
+    print("Download worker thread started.")
+    while not stop_worker.is_set():
+        task = _take_ready_deferred_task()
+        from_queue = task is None
+        if from_queue:
+            try:
+                task = download_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+        task_id, model_info, sub_category_info, base_path, use_hf_transfer, is_comfy_ui_structure = task # Added is_comfy_ui_structure
+        task_start_time = time.time()
+        outcome = "failed"
+        try:
+            emit_event("task_started", task_id=task_id, name=model_info.get("name"), repo_id=model_info.get("repo_id"))
+            update_task_state(task_id, state="running", started_at=task_start_time)
+            outcome = _download_model_internal(model_info, sub_category_info, base_path, use_hf_transfer, is_comfy_ui_structure, task_id) # Pass is_comfy_ui_structure
+            if outcome == "success":
+                forget_inventory_upstream(model_info)
+
+        except LeaseBusyError as e:
+            outcome = "deferred"
+            defer_task(task, e.retry_at)
+            update_task_state(task_id, state="deferred", retry_at=e.retry_at, error=str(e))
+            emit_event("task_deferred", task_id=task_id, name=model_info.get("name"), lease_owner=e.owner, retry_at=e.retry_at)
+        except CircuitOpenError as e:
+            outcome = "deferred"
+            defer_task(task, e.retry_at)
+            update_task_state(task_id, state="deferred", retry_at=e.retry_at, error=str(e))
+            add_log(f"INFO: Deferred '{model_info.get('name', 'unknown task')}': {e}. It will be retried automatically.")
+            emit_event("task_deferred", task_id=task_id, name=model_info.get("name"), host=e.host, retry_at=e.retry_at)
+        except Exception as e:
+            model_name_for_log = model_info.get('name', 'unknown task')
+            add_log(f"CRITICAL WORKER ERROR processing '{model_name_for_log}': {type(e).__name__} - {e}")
+            emit_event("error", task_id=task_id, name=model_name_for_log, error_type=type(e).__name__, category="worker", message=str(e))
+        finally:
+            task_kind = "snapshot" if model_info.get("is_snapshot") else "file"
+            metric_inc("swarmdl_tasks_total", kind=task_kind, outcome=outcome)
+            if outcome != "deferred": # Deferred tasks stay pending and are timed when they finally finish
+                task_duration = time.time() - task_start_time
+                metric_observe("swarmdl_task_duration_seconds", task_duration, kind=task_kind, outcome=outcome)
+                transfer_stats = pop_task_transfer_stats(task_id)
+                emit_event("task_finished", task_id=task_id, name=model_info.get("name"), outcome=outcome, kind=task_kind,
+                           size_bytes=transfer_stats["bytes"], duration_seconds=round(task_duration, 3), backend=",".join(sorted(transfer_stats["backends"])) or None)
+                update_task_state(task_id, state=outcome, finished_at=time.time(), bytes_downloaded=transfer_stats["bytes"], duration_seconds=round(task_duration, 3))
+                if outcome == "success":
+                    record_task_throughput(transfer_stats["bytes"], task_duration)
+                task_key = _task_dedup_key(model_info, sub_category_info, base_path, is_comfy_ui_structure)
+                with pending_lock:
+                    if pending_task_keys.get(task_key) == task_id:
+                        del pending_task_keys[task_key]
+            if from_queue:
+                download_queue.task_done()
+    print("Download worker thread stopped.")
+
+
+# --- Service Endpoints ---
+# Plain HTTP endpoints served next to the Gradio UI when --service-port is given.
+# Handlers take the BaseHTTPRequestHandler and return (status, content_type, body_bytes),
+# or None if they wrote the response themselves. Paths ending in "/" match as prefixes.
+
+service_routes = {} # (method, path) -> handler
+SERVICE_SETTINGS = {
+    "base_path": None, # Set at startup; endpoints that touch the Models tree use it
+    "api_token": None, # Bearer token required by the /api/ endpoints when set
+    "loopback_only": True, # Whether the service binds to loopback only; if not, /api/ POSTs need api_token
+}
+
+def is_loopback_host(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+def handle_metrics(request):
+    return 200, "text/plain; version=0.0.4; charset=utf-8", render_metrics_text().encode("utf-8")
+
+service_routes[("GET", "/metrics")] = handle_metrics
+
+def _find_service_route(method: str, path: str):
+    handler = service_routes.get((method, path))
+    if handler:
+        return handler
+    prefix_matches = [(route_path, h) for (route_method, route_path), h in service_routes.items()
+                      if route_method == method and route_path.endswith("/") and path.startswith(route_path)]
+    if prefix_matches:
+        return max(prefix_matches, key=lambda item: len(item[0]))[1]
+    return None
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    server_version = "SwarmUIModelDownloader"
+
+    def _dispatch(self, method: str):
+        path = self.path.split("?", 1)[0]
+        handler = _find_service_route(method, path)
+        try:
+            result = handler(self) if handler else (404, "text/plain", b"Not found\n")
+        except Exception as e:
+            print(f"Error handling {method} {path}: {type(e).__name__} - {e}")
+            result = (500, "text/plain", f"{type(e).__name__}: {e}\n".encode("utf-8"))
+        if result is None:
+            return
+        status, content_type, body = result
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_HEAD(self):
+        self._dispatch("HEAD")
+
+    def log_message(self, format, *args):
+        pass # Scrapers poll constantly; keep the console for download progress
+
+def start_service_server(host: str, port: int):
+    """Starts the service endpoints on a daemon thread and returns the server."""
+    server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Service endpoints (e.g. /metrics) listening on http://{host}:{server.server_port}")
+    return server
+
+
+# --- Filtering Logic ---
+# No changes needed in filter_models for this request.
+def filter_models(structure, search_term):
+    search_term = search_term.lower().strip()
+    visibility = {} 
+    if not search_term:
+        for cat_name, cat_data in structure.items():
+            cat_key = f"cat_{cat_name}"
+            visibility[cat_key] = True
+            if "sub_categories" in cat_data:
+                for sub_cat_name in cat_data["sub_categories"]:
+                    sub_cat_key = f"subcat_{cat_name}_{sub_cat_name}"
+                    visibility[sub_cat_key] = True
+            elif "bundles" in cat_data:
+                for i, bundle_data in enumerate(cat_data["bundles"]):
+                     bundle_key = f"bundle_{cat_name}_{i}"
+                     visibility[bundle_key] = True
+                     bundle_button_key = f"bundlebutton_{cat_name}_{i}"
+                     visibility[bundle_button_key] = True
+        return visibility
+    for cat_name, cat_data in structure.items():
+        cat_key = f"cat_{cat_name}"
+        visibility[cat_key] = False 
+        if "sub_categories" in cat_data:
+            for sub_cat_name in cat_data["sub_categories"]:
+                sub_cat_key = f"subcat_{cat_name}_{sub_cat_name}"
+                visibility[sub_cat_key] = False
+        elif "bundles" in cat_data:
+             for i, bundle_data in enumerate(cat_data["bundles"]):
+                 bundle_key = f"bundle_{cat_name}_{i}"
+                 visibility[bundle_key] = False
+                 bundle_button_key = f"bundlebutton_{cat_name}_{i}"
+                 visibility[bundle_button_key] = False
+    for cat_name, cat_data in structure.items():
+        cat_key = f"cat_{cat_name}"
+        cat_match = search_term in cat_name.lower()
+        cat_becomes_visible = cat_match 
+        if "sub_categories" in cat_data:
+            for sub_cat_name, sub_cat_data in cat_data["sub_categories"].items():
+                sub_cat_key = f"subcat_{cat_name}_{sub_cat_name}"
+                sub_cat_match = search_term in sub_cat_name.lower()
+                sub_cat_becomes_visible = sub_cat_match 
+                model_match_found = False
+                for model_info in sub_cat_data.get("models", []):
+                    model_name = model_info.get("name", "").lower()
+                    if search_term in model_name:
+                        model_match_found = True
+                        break 
+                if model_match_found or sub_cat_match:
+                    visibility[sub_cat_key] = True 
+                    cat_becomes_visible = True 
+            if cat_becomes_visible:
+                 visibility[cat_key] = True 
+        elif "bundles" in cat_data:
+             bundle_match_found_in_cat = False
+             for i, bundle_data in enumerate(cat_data["bundles"]):
+                 bundle_key = f"bundle_{cat_name}_{i}"
+                 bundle_button_key = f"bundlebutton_{cat_name}_{i}"
+                 bundle_name = bundle_data.get("name", "").lower()
+                 bundle_info = bundle_data.get("info", "").lower() 
+                 if search_term in bundle_name or search_term in bundle_info:
+                     visibility[bundle_key] = True
+                     visibility[bundle_button_key] = True
+                     bundle_match_found_in_cat = True
+             if bundle_match_found_in_cat or cat_match: 
+                 visibility[cat_key] = True
+    return visibility
+
+# --- Bundle Helper ---
+# No changes needed in find_model_by_key for this request.
+def find_model_by_key(category_name, sub_category_name, model_name):
+    try:
+        category_data = models_structure[category_name]
+        sub_category_data = category_data["sub_categories"][sub_category_name]
+        for model_info in sub_category_data["models"]:
+            if model_info["name"] == model_name:
+                return model_info, sub_category_data
+        add_log(f"ERROR: Model '{model_name}' not found in '{category_name}' -> '{sub_category_name}'.")
+        return None, None
+    except KeyError:
+        add_log(f"ERROR: Category '{category_name}' or Sub-category '{sub_category_name}' not found while searching for model '{model_name}'.")
+        return None, None
+    except Exception as e:
+        add_log(f"ERROR: Unexpected error finding model '{model_name}': {e}")
+        return None, None
+
+
+# --- Offline Bundles ---
+# A bundle archive is a plain tar stream: one member per file, named
+# "<target_dir_key>/<path inside that folder>", followed by a JSON manifest with each
+# member's size and sha256. Naming members by target_dir_key rather than by folder lets
+# an archive exported from a SwarmUI layout unpack into a ComfyUI one (Lora -> loras).
+# Snapshot files carry their snapshot's owner (see snapshot_owner) in a PAX header, so the
+# importing side can record them in that folder's snapshot manifest.
+
+BUNDLE_MANIFEST_NAME = "swarmdl-bundle.json"
+BUNDLE_FORMAT = "swarmdl-bundle/1"
+BUNDLE_COPY_CHUNK_SIZE = 8 * 1024 * 1024
+BUNDLE_SNAPSHOT_HEADER = "SWARMDL.snapshot" # PAX header naming the snapshot a member belongs to
+
+def find_bundle(bundle_name: str):
+    for cat_data in models_structure.values():
+        for bundle_data in cat_data.get("bundles", []):
+            if bundle_data.get("name") == bundle_name:
+                return bundle_data
+    return None
+
+def resolve_bundle_files(bundle_definition: dict, base_path: str, is_comfy_ui_structure: bool) -> list:
+    """
+    Returns [(archive_name, local_path, snapshot owner or None)] for the installed files of a
+    bundle; missing models are logged and skipped.
+    """
+    subdirs_to_use = get_current_subdirs(is_comfy_ui_structure)
+    entries = {}
+    for cat_name, sub_cat_name, model_name in bundle_definition.get("models_to_download", []):
+        model_info, sub_cat_info = find_model_by_key(cat_name, sub_cat_name, model_name)
+        if not model_info:
+            continue
+        target_key = model_info.get("target_dir_key") or sub_cat_info.get("target_dir_key")
+        if target_key not in subdirs_to_use:
+            target_key = "diffusion_models" # Same fallback as get_target_path
+        target_dir = get_target_path(base_path, model_info, sub_cat_info, is_comfy_ui_structure)
+        if model_info.get("is_snapshot"):
+            owned = snapshot_owned_files(target_dir, model_info) # The folder may also hold other entries' files
+            rel_paths = [r for r in _local_snapshot_files(target_dir, model_info.get("allow_patterns")) if r in owned]
+        else:
+            rel_paths = [model_info["save_filename"]] if model_info.get("save_filename") else []
+        rel_paths = [r for r in rel_paths if os.path.isfile(os.path.join(target_dir, *r.split("/")))]
+        if not rel_paths:
+            add_log(f"WARNING: '{model_name}' is not installed under {target_dir}; not exported.")
+        owner = snapshot_owner(model_info) if model_info.get("is_snapshot") else None
+        for rel_path in rel_paths:
+            entries[f"{target_key}/{rel_path}"] = (os.path.join(target_dir, *rel_path.split("/")), owner)
+    return [(archive_name, local_path, owner) for archive_name, (local_path, owner) in sorted(entries.items())]
+
+class _HashingReader:
+    """File wrapper that hashes everything read through it."""
+    def __init__(self, f, hasher):
+        self._f = f
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self.hasher.update(data)
+        return data
+
+def export_bundle(bundle_name: str, output_stream, base_path: str, is_comfy_ui_structure: bool) -> dict:
+    """
+    Streams a bundle's installed files as a tar archive to output_stream (any writable
+    binary file object, e.g. a pipe or socket). Each file is read once: hashed on the way into the
+    archive, with the digests written in the trailing manifest.
+    """
+    bundle_definition = find_bundle(bundle_name)
+    if not bundle_definition:
+        raise ValueError(f"Bundle '{bundle_name}' not found")
+    files = resolve_bundle_files(bundle_definition, base_path, is_comfy_ui_structure)
+    manifest = {"format": BUNDLE_FORMAT, "bundle": bundle_name, "created": time.time(), "files": {}}
+    total_bytes = 0
+    with tarfile.open(fileobj=output_stream, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for archive_name, local_path, owner in files:
+            with open(local_path, "rb") as f:
+                st = os.fstat(f.fileno())
+                member = tarfile.TarInfo(archive_name)
+                member.size, member.mtime, member.mode = st.st_size, int(st.st_mtime), 0o644
+                if owner:
+                    member.pax_headers = {BUNDLE_SNAPSHOT_HEADER: owner}
+                reader = _HashingReader(f, hashlib.sha256())
+                tar.addfile(member, reader)
+            manifest["files"][archive_name] = {"size": st.st_size, "sha256": reader.hasher.hexdigest()}
+            total_bytes += st.st_size
+            add_log(f" -> Exported {archive_name} ({format_bytes(st.st_size)})")
+        manifest_bytes = json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8")
+        manifest_member = tarfile.TarInfo(BUNDLE_MANIFEST_NAME)
+        manifest_member.size, manifest_member.mtime = len(manifest_bytes), int(time.time())
+        tar.addfile(manifest_member, io.BytesIO(manifest_bytes))
+    add_log(f"SUCCESS: Exported bundle '{bundle_name}': {len(files)} files, {format_bytes(total_bytes)}.")
+    return {"files": len(files), "bytes": total_bytes}
+
+def _bundle_member_destination(archive_name: str, base_path: str, is_comfy_ui_structure: bool) -> str:
+    """Maps "<target_dir_key>/<rel path>" onto this machine's layout, refusing anything that escapes it."""
+    target_key, _, rel_path = archive_name.partition("/")
+    parts = rel_path.split("/")
+    if target_key not in get_current_subdirs(is_comfy_ui_structure) or not rel_path or any(p in ("", ".", "..") for p in parts):
+        raise ValueError(f"Unexpected archive member '{archive_name}'")
+    return os.path.join(_bundle_member_target_dir(archive_name, base_path, is_comfy_ui_structure), *parts)
+
+def _bundle_member_target_dir(archive_name: str, base_path: str, is_comfy_ui_structure: bool) -> str:
+    """The folder an archive member's target_dir_key maps to (a snapshot member's snapshot folder)."""
+    return get_target_path(base_path, {"target_dir_key": archive_name.partition("/")[0]}, {}, is_comfy_ui_structure)
+
+def _copy_member_zero_copy(src_fd: int, offset: int, size: int, dst_fd: int, hasher) -> bool:
+    """Copies an archive member in-kernel with copy_file_range, hashing the source range. False if unsupported here."""
+    if not hasattr(os, "copy_file_range"):
+        return False
+    position = 0
+    try:
+        while position < size:
+            copied = os.copy_file_range(src_fd, dst_fd, min(size - position, BUNDLE_COPY_CHUNK_SIZE), offset + position)
+            if copied == 0:
+                raise IncompleteTransferError("Archive ended inside a member")
+            position += copied
+    except OSError as e:
+        if position == 0 and e.errno in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF):
+            return False
+        raise
+    for chunk_start in range(0, size, BUNDLE_COPY_CHUNK_SIZE):
+        hasher.update(os.pread(src_fd, min(BUNDLE_COPY_CHUNK_SIZE, size - chunk_start), offset + chunk_start))
+    return True
+
+def _wait_for_download_lease(target_path: str):
+    """Takes target_path's lease for a headless command, waiting while another process holds it."""
+    while True:
+        try:
+            acquire_download_lease(target_path, reuse_result=False)
+            return
+        except LeaseBusyError as e:
+            time.sleep(max(0.1, e.retry_at - time.time()))
+
+def import_bundle(archive_path: str, base_path: str, is_comfy_ui_structure: bool) -> dict:
+    """
+    Unpacks a bundle archive ("-" for stdin) into base_path's layout. Each member is
+    streamed into a partial file next to its target while being hashed; nothing is moved
+    into place until the trailing manifest confirms its sha256. With a regular archive
+    file, members are copied with copy_file_range where the filesystem supports it.
+    Targets are leased like downloads (a snapshot's folder, a single file's path), and
+    snapshot files are recorded in the folder's snapshot manifest under their snapshot.
+    """
+    from_stdin = archive_path == "-"
+    raw = sys.stdin.buffer if from_stdin else open(archive_path, "rb")
+    staged = {} # archive name -> (partial path, final path, sha256, size, snapshot owner or None)
+    leased = set()
+    manifest = None
+    try:
+        with tarfile.open(fileobj=raw, mode="r|" if from_stdin else "r:") as tar:
+            for member in tar:
+                if member.name == BUNDLE_MANIFEST_NAME:
+                    manifest = json.load(tar.extractfile(member))
+                    continue
+                if not member.isfile():
+                    continue
+                final_path = _bundle_member_destination(member.name, base_path, is_comfy_ui_structure)
+                owner = member.pax_headers.get(BUNDLE_SNAPSHOT_HEADER)
+                lease_target = _bundle_member_target_dir(member.name, base_path, is_comfy_ui_structure) if owner else final_path
+                if lease_target not in leased:
+                    _wait_for_download_lease(lease_target)
+                    leased.add(lease_target)
+                os.makedirs(os.path.dirname(final_path), exist_ok=True) # Snapshot members can sit in subfolders
+                partial_path = partial_path_for(final_path)
+                hasher = hashlib.sha256()
+                with open(partial_path, "wb") as out:
+                    if from_stdin or not _copy_member_zero_copy(raw.fileno(), member.offset_data, member.size, out.fileno(), hasher):
+                        source = tar.extractfile(member)
+                        while True:
+                            chunk = source.read(BUNDLE_COPY_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            hasher.update(chunk)
+                            out.write(chunk)
+                    out.flush()
+                    os.fsync(out.fileno())
+                staged[member.name] = (partial_path, final_path, hasher.hexdigest(), os.path.getsize(partial_path), owner)
+        if not manifest or manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError("Archive has no bundle manifest; is it a swarmdl bundle export?")
+
+        installed, rejected = [], []
+        snapshot_files = collections.defaultdict(list) # snapshot folder -> [(final path, rel path, sha256, owner)]
+        for archive_name, (partial_path, final_path, digest, size, owner) in staged.items():
+            expected = manifest["files"].get(archive_name)
+            if not expected or expected.get("sha256") != digest or expected.get("size") != size:
+                os.remove(partial_path)
+                rejected.append(archive_name)
+                add_log(f"ERROR: {archive_name} failed verification (expected {expected}, got sha256 {digest}, {size} bytes). Not installed.")
+                continue
+            os.replace(partial_path, final_path)
+            _fsync_directory(os.path.dirname(final_path))
+            register_content(digest, final_path)
+            installed.append(archive_name)
+            if owner:
+                target_dir = _bundle_member_target_dir(archive_name, base_path, is_comfy_ui_structure)
+                snapshot_files[target_dir].append((final_path, archive_name.partition("/")[2], digest, owner))
+        for target_dir, records in snapshot_files.items():
+            snapshot_manifest = load_snapshot_manifest(target_dir)
+            for final_path, rel_path, digest, owner in records:
+                _record_snapshot_file(snapshot_manifest, final_path, rel_path, "sha256", digest, owner)
+            save_snapshot_manifest(target_dir, snapshot_manifest)
+        missing = sorted(set(manifest["files"]) - set(staged))
+        for archive_name in missing:
+            add_log(f"ERROR: {archive_name} is listed in the manifest but missing from the archive.")
+        add_log(f"Imported bundle '{manifest.get('bundle')}': {len(installed)} installed, {len(rejected)} rejected, {len(missing)} missing.")
+        return {"bundle": manifest.get("bundle"), "installed": installed, "rejected": rejected, "missing": missing}
+    except BaseException:
+        for partial_path, *_ in staged.values():
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        raise
+    finally:
+        for lease_target in leased:
+            release_download_lease(lease_target)
+        if not from_stdin:
+            raw.close()
+
+
+# --- Inventory ---
+# A persistent index of the files under the base path, so catalog entries can be marked
+# installed / partial / outdated without stat-ing every model on each page load. A rescan
+# only re-lists directories whose mtime changed since the last scan; every download lands
+# through a rename, which bumps its directory's mtime. "Outdated" needs the upstream size
+# and sha256, which check_inventory_updates records per entry and a new download clears.
+
+INVENTORY_INDEX_NAME = "inventory_index.json"
+INVENTORY_SKIP_DIRS = (".cache", STATE_DIR_NAME)
+INVENTORY_CHECK_WORKERS = 8
+INVENTORY_STATUS_LABELS = {
+    "installed": "**Installed**",
+    "partial": "**Partial download**",
+    "outdated": "**Update available**",
+    "missing": "",
+}
+
+inventory_index = {"dirs": {}, "remote": {}} # See scan_inventory / check_inventory_updates for the layout
+inventory_lock = threading.Lock()
+inventory_scan_lock = threading.Lock() # Serializes scans; status lookups only need inventory_lock
+inventory_index_path = None
+
+def load_inventory_index(base_path: str):
+    """Makes base_path's inventory index the active one (a no-op if it already is)."""
+    global inventory_index_path
+    index_path = os.path.join(os.path.abspath(base_path), STATE_DIR_NAME, INVENTORY_INDEX_NAME)
+    with inventory_lock:
+        if inventory_index_path == index_path:
+            return
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                loaded = json.load(f)
+        except (OSError, ValueError):
+            loaded = {}
+        if not isinstance(loaded, dict):
+            loaded = {}
+        inventory_index["dirs"] = loaded.get("dirs") or {}
+        inventory_index["remote"] = loaded.get("remote") or {}
+        inventory_index_path = index_path
+
+def _save_inventory_index():
+    """Writes the index via a temp file. Caller holds inventory_lock."""
+    if not inventory_index_path:
+        return
+    try:
+        os.makedirs(os.path.dirname(inventory_index_path), exist_ok=True)
+        temp_path = inventory_index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(inventory_index, f, separators=(",", ":"))
+        os.replace(temp_path, inventory_index_path)
+    except OSError as e:
+        add_log(f"WARNING: Could not save inventory index {inventory_index_path}: {e}")
+
+def _list_inventory_dir(abs_dir: str, dir_mtime_ns: int, cached: dict | None) -> dict:
+    """Lists one directory, keeping cached digests for files whose size and mtime are unchanged."""
+    previous_files = (cached or {}).get("files", {})
+    files, subdirs = {}, []
+    try:
+        with os.scandir(abs_dir) as entries:
+            for item in entries:
+                try:
+                    if item.is_dir(follow_symlinks=False):
+                        if item.name not in INVENTORY_SKIP_DIRS:
+                            subdirs.append(item.name)
+                    elif item.is_file():
+                        st = item.stat()
+                        record = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                        previous = previous_files.get(item.name)
+                        if previous and previous.get("sha256") and previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns:
+                            record["sha256"] = previous["sha256"]
+                        files[item.name] = record
+                except OSError: # Vanished mid-scan or unreadable
+                    continue
+    except OSError as e:
+        add_log(f"WARNING: Could not list {abs_dir} for the inventory: {e}")
+    return {"mtime_ns": dir_mtime_ns, "subdirs": sorted(subdirs), "files": files}
+
+def scan_inventory(base_path: str, hash_files: bool = False) -> dict:
+    """
+    Brings the inventory index up to date with the tree under base_path and saves it.
+    The index maps each directory (relative to base_path, "" for the root) to
+    {"mtime_ns", "subdirs", "files": {name: {"size", "mtime_ns", "sha256"?}}}.
+    Digests come from the content index; with hash_files, files without one are hashed
+    (slow for large models, but cached until the file's size or mtime changes).
+    Returns {"directories", "rescanned", "files", "hashed", "seconds"}.
+    """
+    base_path = os.path.abspath(base_path)
+    started = time.perf_counter()
+    load_inventory_index(base_path)
+    with content_index_lock:
+        known_digests = {path: digest for digest, path in content_index.items()}
+    stats = {"directories": 0, "rescanned": 0, "files": 0, "hashed": 0}
+    with inventory_scan_lock:
+        with inventory_lock:
+            old_dirs = inventory_index["dirs"]
+        new_dirs = {}
+        pending_dirs = [""] if os.path.isdir(base_path) else []
+        while pending_dirs:
+            rel_dir = pending_dirs.pop()
+            abs_dir = os.path.join(base_path, *rel_dir.split("/")) if rel_dir else base_path
+            try:
+                dir_mtime_ns = os.stat(abs_dir).st_mtime_ns
+            except OSError:
+                continue
+            cached = old_dirs.get(rel_dir)
+            if cached and cached.get("mtime_ns") == dir_mtime_ns:
+                entry = copy.deepcopy(cached)
+            else:
+                entry = _list_inventory_dir(abs_dir, dir_mtime_ns, cached)
+                stats["rescanned"] += 1
+            for name, record in entry["files"].items():
+                if record.get("sha256") or name.endswith(PARTIAL_SUFFIX):
+                    continue
+                file_path = os.path.join(abs_dir, name)
+                digest = known_digests.get(file_path)
+                if digest is None and hash_files:
+                    try:
+                        digest = compute_file_digest(file_path, "sha256")
+                        stats["hashed"] += 1
+                    except OSError:
+                        pass
+                if digest:
+                    record["sha256"] = digest
+            new_dirs[rel_dir] = entry
+            stats["directories"] += 1
+            stats["files"] += len(entry["files"])
+            pending_dirs.extend(f"{rel_dir}/{name}" if rel_dir else name for name in entry["subdirs"])
+        with inventory_lock:
+            inventory_index["dirs"] = new_dirs
+            _save_inventory_index()
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    return stats
+
+def iter_catalog_entries():
+    """Yields (category_name, sub_category_name, model_info, sub_category_info) for every catalog model."""
+    for cat_name, cat_data in models_structure.items():
+        for sub_cat_name, sub_cat_data in cat_data.get("sub_categories", {}).items():
+            for model_info in sub_cat_data.get("models", []):
+                yield cat_name, sub_cat_name, model_info, sub_cat_data
+
+def _catalog_target_dir(base_path: str, model_info: dict, sub_category_info: dict, is_comfy_ui_structure: bool) -> str:
+    """get_target_path without its side effects (no makedirs, no warnings)."""
+    subdirs_to_use = get_current_subdirs(is_comfy_ui_structure)
+    target_key = model_info.get("target_dir_key") or sub_category_info.get("target_dir_key")
+    return resolve_target_directory(base_path, subdirs_to_use.get(target_key, "diffusion_models"))
+
+def _inventory_remote_key(model_info: dict) -> str:
+    return json.dumps(list(source_identity(model_info)) + [model_info.get("allow_patterns")], default=str)
+
+def _inventory_rel_path(base_path: str, path: str) -> str:
+    rel_path = os.path.relpath(path, base_path).replace(os.sep, "/")
+    return "" if rel_path == "." else rel_path
+
+def _inventory_file_record(dirs: dict, rel_path: str):
+    rel_dir, _, name = rel_path.rpartition("/")
+    return dirs.get(rel_dir, {}).get("files", {}).get(name)
+
+def _inventory_tree_files(dirs: dict, rel_root: str) -> dict:
+    """{path relative to rel_root: record} for every indexed file at or below rel_root."""
+    tree_files = {}
+    for rel_dir, entry in dirs.items():
+        if rel_root and rel_dir != rel_root and not rel_dir.startswith(rel_root + "/"):
+            continue
+        inner_dir = rel_dir[len(rel_root):].lstrip("/")
+        for name, record in entry.get("files", {}).items():
+            tree_files[f"{inner_dir}/{name}" if inner_dir else name] = record
+    return tree_files
+
+def inventory_entry_status(model_info: dict, sub_category_info: dict, base_path: str, is_comfy_ui_structure: bool, digest_locations: dict | None = None) -> dict:
+    """
+    Status of one catalog entry from the index (plus, for a snapshot, its small manifest):
+    {"status": missing|partial|installed|outdated, "path", "size", "detail"}.
+    A single file is matched by its target path, then by sha256 when the catalog or the
+    last update check knows it. A snapshot counts the files in its target folder, compared
+    against the last update check's listing when there is one, or else those its snapshot
+    manifest records for it (target folders can be shared with other entries).
+    """
+    base_path = os.path.abspath(base_path)
+    target_dir = _catalog_target_dir(base_path, model_info, sub_category_info, is_comfy_ui_structure)
+    with inventory_lock:
+        dirs = inventory_index["dirs"]
+        remote = inventory_index["remote"].get(_inventory_remote_key(model_info)) or {}
+        if model_info.get("is_snapshot"):
+            local_files = _inventory_tree_files(dirs, _inventory_rel_path(base_path, target_dir))
+        else:
+            rel_path = _inventory_rel_path(base_path, os.path.join(target_dir, model_info.get("save_filename") or ""))
+            record = _inventory_file_record(dirs, rel_path)
+            partial_record = _inventory_file_record(dirs, _inventory_rel_path(base_path, partial_path_for(os.path.join(base_path, rel_path))))
+
+    if model_info.get("is_snapshot"):
+        partial_count = sum(1 for rel in local_files if rel.endswith(PARTIAL_SUFFIX))
+        complete = {rel: record for rel, record in local_files.items() if not rel.endswith(PARTIAL_SUFFIX)}
+        complete = {rel: complete[rel] for rel in filter_repo_objects(list(complete), allow_patterns=model_info.get("allow_patterns"))}
+        result = {"path": target_dir, "size": sum(record["size"] for record in complete.values()), "detail": f"{len(complete)} files"}
+        remote_files = remote.get("files")
+        if remote_files is not None:
+            present = [rel for rel in remote_files if rel in complete]
+            mismatched = [rel for rel in present if complete[rel]["size"] != remote_files[rel]]
+            result["detail"] = f"{len(present)} of {len(remote_files)} files"
+            if not present:
+                result["status"] = "partial" if partial_count else "missing"
+            elif len(present) < len(remote_files) or partial_count:
+                result["status"] = "partial"
+            else:
+                result["status"] = "outdated" if mismatched else "installed"
+        else:
+            owned = snapshot_owned_files(target_dir, model_info)
+            complete = {rel: record for rel, record in complete.items() if rel in owned}
+            result.update(size=sum(record["size"] for record in complete.values()), detail=f"{len(complete)} files")
+            result["status"] = "partial" if partial_count else "installed" if complete else "missing"
+        return result
+
+    expected_sha256 = model_info.get("sha256") or remote.get("sha256")
+    result = {"path": os.path.join(base_path, *rel_path.split("/")), "size": record["size"] if record else None, "detail": ""}
+    if record is None:
+        result["status"] = "partial" if partial_record else "missing"
+        found_at = (digest_locations or {}).get(expected_sha256) if expected_sha256 else None
+        if found_at:
+            result["detail"] = f"same file exists at {found_at}"
+    elif expected_sha256 and record.get("sha256") and record["sha256"] != expected_sha256:
+        result["status"] = "outdated"
+        result["detail"] = "sha256 differs from upstream"
+    elif remote.get("size") is not None and record["size"] != remote["size"]:
+        result["status"] = "outdated" # Downloads land atomically, so a complete file of the wrong size is an older version
+        result["detail"] = f"{format_bytes(record['size'])} locally, {format_bytes(remote['size'])} upstream"
+    else:
+        result["status"] = "installed"
+    return result
+
+def _inventory_digest_locations() -> dict:
+    """sha256 -> path relative to the base path, for every indexed file with a known digest."""
+    with inventory_lock:
+        return {record["sha256"]: f"{rel_dir}/{name}" if rel_dir else name
+                for rel_dir, entry in inventory_index["dirs"].items()
+                for name, record in entry.get("files", {}).items() if record.get("sha256")}
+
+def inventory_report(base_path: str, is_comfy_ui_structure: bool, rescan: bool = True, hash_files: bool = False) -> dict:
+    """
+    Rescans (incrementally) and returns {"scan": stats, "entries": {"Category/Sub-category/Model": status}}.
+    Bundle-only categories have no entries of their own.
+    """
+    scan_stats = scan_inventory(base_path, hash_files) if rescan else None
+    digest_locations = _inventory_digest_locations()
+    entries = {}
+    for cat_name, sub_cat_name, model_info, sub_cat_data in iter_catalog_entries():
+        entries[f"{cat_name}/{sub_cat_name}/{model_info.get('name')}"] = inventory_entry_status(model_info, sub_cat_data, base_path, is_comfy_ui_structure, digest_locations)
+    return {"scan": scan_stats, "entries": entries}
+
+def _check_entry_upstream(model_info: dict) -> dict:
+    """Upstream {"size", "sha256"} for a single-file entry, or {"files": {path: size}} for a snapshot."""
+    source = get_model_source(model_info)
+    if model_info.get("is_snapshot"):
+        remote_files = source.list_files(model_info.get("allow_patterns"))
+        return {"files": {rel: info.get("size") for rel, info in remote_files.items()}}
+    resolved = source.resolve(source.default_path())
+    etag = resolved.get("etag") or ""
+    return {"size": resolved.get("size"), "sha256": etag if SHA256_PATTERN.fullmatch(etag) else model_info.get("sha256")}
+
+def check_inventory_updates(base_path: str, is_comfy_ui_structure: bool) -> dict:
+    """
+    Asks upstream (one HEAD or listing per entry, concurrently) for the current size and
+    sha256 of every installed catalog entry and records it in the index, so later scans
+    can flag outdated files offline. Returns {"checked", "failed"}.
+    """
+    installed = [(model_info, sub_cat_data) for _, _, model_info, sub_cat_data in iter_catalog_entries()
+                 if inventory_entry_status(model_info, sub_cat_data, base_path, is_comfy_ui_structure)["status"] in ("installed", "outdated", "partial")]
+    checked, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=INVENTORY_CHECK_WORKERS) as executor:
+        futures = {executor.submit(_check_entry_upstream, model_info): model_info for model_info, _ in installed}
+        for future in as_completed(futures):
+            model_info = futures[future]
+            try:
+                upstream = future.result()
+            except Exception as e:
+                failed += 1
+                add_log(f"WARNING: Update check failed for {model_info.get('name')}: {type(e).__name__} - {e}")
+                continue
+            upstream["checked_at"] = time.time()
+            with inventory_lock:
+                inventory_index["remote"][_inventory_remote_key(model_info)] = upstream
+            checked += 1
+    with inventory_lock:
+        _save_inventory_index()
+    return {"checked": checked, "failed": failed}
+
+def forget_inventory_upstream(model_info: dict):
+    """Drops an entry's recorded upstream state after it was (re)downloaded, so it isn't flagged against a stale check."""
+    with inventory_lock:
+        if inventory_index["remote"].pop(_inventory_remote_key(model_info), None) is not None:
+            _save_inventory_index()
+
+def handle_inventory(request):
+    """GET /inventory[?comfy=1&rescan=0]: the installed status of every catalog entry as JSON."""
+    query = parse_qs(urlsplit(request.path).query)
+    is_comfy = query.get("comfy", ["0"])[0] in ("1", "true")
+    report = inventory_report(SERVICE_SETTINGS["base_path"], is_comfy, rescan=query.get("rescan", ["1"])[0] not in ("0", "false"))
+    return 200, "application/json", json.dumps(report).encode("utf-8")
+
+service_routes[("GET", "/inventory")] = handle_inventory
+
+
+# --- Disk Usage and Eviction ---
+# An eviction unit is a file directly inside a top-level model folder (e.g. one GGUF in
+# diffusion_models), a sub-folder of one (a snapshot), or a whole nested target folder
+# such as LLM/unsloth--Meta-Llama-3.1-8B-Instruct. A unit's last access is the newest of
+# its files' atime and the time this app last downloaded (or warmed) them, since many
+# volumes are mounted relatime/noatime. Pinned units are never evicted.
+
+USAGE_STATE_NAME = "usage.json"
+EVICTION_SETTINGS = {
+    "enabled": False, # Evict automatically when a download doesn't fit (see make_room_for_download)
+    "base_path": None, # Models tree whose units may be evicted; set at startup
+    "min_free_bytes": 0, # Kept free on top of what the download needs
+    "min_idle_seconds": 24 * 3600, # Never evict a unit used more recently than this
+}
+
+usage_state = {"last_access": {}, "pins": []} # last_access: absolute file path -> unix time
+usage_lock = threading.Lock()
+eviction_lock = threading.Lock()
+usage_state_path = None
+
+def load_usage_state(base_path: str):
+    """Loads base_path's access times and pins and makes them the active ones."""
+    global usage_state_path
+    state_path = os.path.join(os.path.abspath(base_path), STATE_DIR_NAME, USAGE_STATE_NAME)
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+    except (OSError, ValueError):
+        loaded = {}
+    if not isinstance(loaded, dict):
+        loaded = {}
+    with usage_lock:
+        usage_state["last_access"] = {path: ts for path, ts in (loaded.get("last_access") or {}).items() if os.path.exists(path)}
+        usage_state["pins"] = list(loaded.get("pins") or [])
+        usage_state_path = state_path
+
+def _save_usage_state():
+    """Writes the usage state via a temp file. Caller holds usage_lock."""
+    if not usage_state_path:
+        return
+    try:
+        os.makedirs(os.path.dirname(usage_state_path), exist_ok=True)
+        temp_path = usage_state_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(usage_state, f, indent=1, sort_keys=True)
+        os.replace(temp_path, usage_state_path)
+    except OSError as e:
+        add_log(f"WARNING: Could not save usage state {usage_state_path}: {e}")
+
+def record_model_access(path: str):
+    """Marks a model file as used now (called when it is downloaded or warmed)."""
+    with usage_lock:
+        usage_state["last_access"][os.path.abspath(path)] = time.time()
+        _save_usage_state()
+
+def set_model_pinned(path: str, pinned: bool = True):
+    """Pins (or unpins) a file or folder so eviction never removes it or anything inside it."""
+    path = os.path.abspath(path)
+    with usage_lock:
+        pins = [p for p in usage_state["pins"] if p != path]
+        if pinned:
+            pins.append(path)
+        usage_state["pins"] = sorted(pins)
+        _save_usage_state()
+
+def _is_pinned(unit_path: str, pins: list) -> bool:
+    return any(unit_path == pin or unit_path.startswith(pin + os.sep) or pin.startswith(unit_path + os.sep) for pin in pins)
+
+def _target_dir_keys(base_path: str) -> dict:
+    """Absolute folder -> target_dir_key for both folder layouts (Lora and loras)."""
+    target_dirs = {}
+    for is_comfy in (False, True):
+        for key, relative_dir in get_current_subdirs(is_comfy).items():
+            target_dirs.setdefault(os.path.normpath(resolve_target_directory(base_path, relative_dir)), key)
+    return target_dirs
+
+def _unit_stats(unit_path: str, last_access: dict) -> dict:
+    """Size, file count and last access of one eviction unit."""
+    if os.path.isfile(unit_path):
+        file_paths = [unit_path]
+    else:
+        file_paths = [os.path.join(root, name) for root, dirs, files in os.walk(unit_path) for name in files]
+    size, newest = 0, 0.0
+    for file_path in file_paths:
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            continue
+        size += st.st_size
+        newest = max(newest, st.st_atime, last_access.get(file_path, 0.0), last_access.get(os.path.realpath(file_path), 0.0))
+    return {"size": size, "files": len(file_paths), "last_access": newest}
+
+def list_eviction_units(base_path: str) -> list:
+    """Every eviction unit under base_path as {"path", "target_dir_key", "size", "files", "last_access", "pinned"}, least recently used first."""
+    base_path = os.path.abspath(base_path)
+    target_dirs = _target_dir_keys(base_path)
+    with usage_lock:
+        last_access = dict(usage_state["last_access"])
+        pins = list(usage_state["pins"])
+    units = []
+    for target_dir, key in target_dirs.items():
+        if not os.path.isdir(target_dir):
+            continue
+        if os.path.dirname(os.path.relpath(target_dir, base_path)): # Nested target folder: one unit
+            unit_paths = [target_dir]
+        else:
+            try:
+                unit_paths = [os.path.join(target_dir, name) for name in sorted(os.listdir(target_dir)) if not name.startswith(".")]
+            except OSError:
+                continue
+            unit_paths = [path for path in unit_paths if os.path.normpath(path) not in target_dirs and not (os.path.islink(path) and os.path.isdir(path))]
+        for unit_path in unit_paths:
+            unit = {"path": unit_path, "target_dir_key": key}
+            unit.update(_unit_stats(unit_path, last_access))
+            unit["pinned"] = _is_pinned(unit_path, pins)
+            if unit["files"]:
+                units.append(unit)
+    return sorted(units, key=lambda unit: unit["last_access"])
+
+def disk_usage_report(base_path: str) -> dict:
+    """Volume totals plus bytes, unit count and oldest access per target_dir_key, and the units themselves (LRU first)."""
+    units = list_eviction_units(base_path)
+    by_key = {}
+    for unit in units:
+        summary = by_key.setdefault(unit["target_dir_key"], {"bytes": 0, "units": 0, "pinned_bytes": 0, "oldest_access": None})
+        summary["bytes"] += unit["size"]
+        summary["units"] += 1
+        if unit["pinned"]:
+            summary["pinned_bytes"] += unit["size"]
+        if summary["oldest_access"] is None or unit["last_access"] < summary["oldest_access"]:
+            summary["oldest_access"] = unit["last_access"]
+    volume = shutil.disk_usage(base_path) if os.path.isdir(base_path) else None
+    placement_volumes = []
+    for placement_volume in PLACEMENT_SETTINGS["volumes"]:
+        try:
+            placement_usage = shutil.disk_usage(placement_volume["path"])
+        except OSError:
+            continue
+        placement_volumes.append({"path": placement_volume["path"], "fast": placement_volume["fast"], "total": placement_usage.total, "free": placement_usage.free})
+    return {
+        "volume": {"total": volume.total, "used": volume.used, "free": volume.free} if volume else None,
+        "placement_volumes": placement_volumes,
+        "by_target_dir_key": dict(sorted(by_key.items(), key=lambda item: -item[1]["bytes"])),
+        "units": units,
+    }
+
+def _remove_unit(unit_path: str):
+    removed_paths = [unit_path]
+    if os.path.islink(unit_path): # A model placed on another volume: remove the file, then its link
+        removed_paths.append(os.path.realpath(unit_path))
+        if os.path.isfile(removed_paths[1]):
+            os.remove(removed_paths[1])
+        os.remove(unit_path)
+    elif os.path.isdir(unit_path):
+        shutil.rmtree(unit_path)
+    else:
+        os.remove(unit_path)
+    prefix = unit_path + os.sep
+    with usage_lock:
+        for path in [p for p in usage_state["last_access"] if p in removed_paths or p.startswith(prefix)]:
+            del usage_state["last_access"][path]
+        _save_usage_state()
+    _fsync_directory(os.path.dirname(unit_path))
+
+def evict_models(base_path: str, bytes_to_free: int, protect_paths=(), same_device_as: str | None = None, min_idle_seconds: float | None = None, dry_run: bool = False) -> list:
+    """
+    Removes least-recently-used, unpinned units until at least bytes_to_free bytes are
+    freed. Units idle for less than min_idle_seconds, listed in protect_paths, or (with
+    same_device_as) on another filesystem are skipped. Returns the evicted units.
+    """
+    min_idle_seconds = EVICTION_SETTINGS["min_idle_seconds"] if min_idle_seconds is None else min_idle_seconds
+    protected = [os.path.abspath(path) for path in protect_paths]
+    device = os.stat(same_device_as).st_dev if same_device_as else None
+    now = time.time()
+    evicted, freed = [], 0
+    with eviction_lock:
+        for unit in list_eviction_units(base_path):
+            if freed >= bytes_to_free:
+                break
+            if unit["pinned"] or now - unit["last_access"] < min_idle_seconds or _is_pinned(unit["path"], protected):
+                continue
+            try:
+                if device is not None and os.stat(unit["path"]).st_dev != device:
+                    continue
+                if not dry_run:
+                    _remove_unit(unit["path"])
+            except OSError as e:
+                add_log(f"WARNING: Could not evict {unit['path']}: {e}")
+                continue
+            freed += unit["size"]
+            evicted.append(unit)
+            if not dry_run:
+                metric_inc("swarmdl_evicted_bytes_total", unit["size"], target_dir_key=unit["target_dir_key"])
+                emit_event("model_evicted", path=unit["path"], size_bytes=unit["size"], last_access=unit["last_access"])
+                add_log(f"Evicted {unit['path']} ({format_bytes(unit['size'])}, last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(unit['last_access']))}).")
+    return evicted
+
+def make_room_for_download(final_path: str, expected_size, partial_path: str | None = None):
+    """
+    Automatic policy, run once per download: if the file's volume is short of
+    expected_size (minus what the partial already holds) plus min_free_bytes, evicts
+    least-recently-used models from the same volume until it fits.
+    """
+    if not EVICTION_SETTINGS["enabled"] or not EVICTION_SETTINGS["base_path"] or not expected_size:
+        return
+    target_dir = os.path.dirname(final_path)
+    partial_path = partial_path or partial_path_for(final_path)
+    already_written = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    shortfall = expected_size - already_written + EVICTION_SETTINGS["min_free_bytes"] - shutil.disk_usage(target_dir).free
+    if shortfall <= 0:
+        return
+    add_log(f"Need {format_bytes(shortfall)} more free space for {os.path.basename(final_path)}; evicting least-recently-used models...")
+    evicted = evict_models(EVICTION_SETTINGS["base_path"], shortfall, protect_paths=[final_path], same_device_as=target_dir)
+    if sum(unit["size"] for unit in evicted) < shortfall:
+        add_log(f"WARNING: Could only free {format_bytes(sum(unit['size'] for unit in evicted))} of {format_bytes(shortfall)} for {os.path.basename(final_path)}; the download may run out of space.")
+
+
+# --- Multi-Volume Placement ---
+# With --volume, a single-file download may land on another disk. The file is stored at
+# the same relative path under the chosen volume and symlinked into the base path's
+# folders, so SwarmUI/ComfyUI still see one tree. Files for "hot" target_dir_keys (main
+# diffusion models by default) prefer fast volumes; everything else prefers the slower,
+# larger ones. A model that is already a symlink keeps its volume when it is re-downloaded.
+# Snapshots always stay under the base path.
+
+PLACEMENT_SETTINGS = {
+    "volumes": [], # [{"path", "fast"}]; list the base path too if it should take part. Nothing fits -> base path
+    "hot_target_keys": {"diffusion_models", "Stable-Diffusion"},
+    "min_free_bytes": 5 * 1024 ** 3, # Never fill a volume past this
+}
+LINK_TEMP_SUFFIX = ".link" + PARTIAL_SUFFIX # Temp symlinks end in PARTIAL_SUFFIX so orphan cleanup removes them
+
+placement_lock = threading.Lock()
+placement_reservations = {} # volume path -> bytes promised to downloads still in progress
+
+def _is_rotational(path: str) -> bool | None:
+    """Whether the block device holding path is a spinning disk (Linux sysfs), or None if unknown."""
+    try:
+        device = os.stat(path).st_dev
+        sysfs_dir = os.path.realpath(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+        for candidate in (sysfs_dir, os.path.dirname(sysfs_dir)): # Partitions keep queue/ on their parent disk
+            rotational_path = os.path.join(candidate, "queue", "rotational")
+            if os.path.exists(rotational_path):
+                with open(rotational_path, "r") as f:
+                    return f.read().strip() == "1"
+    except (OSError, AttributeError, ValueError):
+        pass
+    return None
+
+def parse_volume_spec(spec: str) -> dict:
+    """'PATH', 'PATH:fast' or 'PATH:slow' -> {"path", "fast"}. Without a suffix, non-rotational disks count as fast."""
+    path, _, speed = spec.rpartition(":")
+    if speed.lower() not in ("fast", "slow") or not path:
+        path, speed = spec, ""
+    path = os.path.abspath(path)
+    fast = speed.lower() == "fast" if speed else _is_rotational(path) is False
+    return {"path": path, "fast": fast}
+
+def choose_volume(size, hot: bool) -> str | None:
+    """
+    The configured volume with the most free space (after min_free_bytes and pending
+    reservations) that fits size, preferring fast volumes for hot files and slow ones
+    otherwise. None means "use the base path".
+    """
+    with placement_lock:
+        candidates = []
+        for volume in PLACEMENT_SETTINGS["volumes"]:
+            try:
+                free = shutil.disk_usage(volume["path"]).free - placement_reservations.get(volume["path"], 0) - PLACEMENT_SETTINGS["min_free_bytes"]
+            except OSError: # Not mounted right now
+                continue
+            if size is None or free >= size:
+                candidates.append((volume, free))
+        preferred = [candidate for candidate in candidates if candidate[0]["fast"] == hot] or candidates
+        return max(preferred, key=lambda candidate: candidate[1])[0]["path"] if preferred else None
+
+@contextlib.contextmanager
+def reserve_volume_space(volume: str | None, size):
+    """Counts size against volume while a download runs, so parallel downloads don't all pick the same nearly-full disk."""
+    if not volume or not size:
+        yield
+        return
+    with placement_lock:
+        placement_reservations[volume] = placement_reservations.get(volume, 0) + size
+    try:
+        yield
+    finally:
+        with placement_lock:
+            placement_reservations[volume] -= size
+            if placement_reservations[volume] <= 0:
+                del placement_reservations[volume]
+
+def link_into_tree(placed_path: str, final_path: str):
+    """Atomically points final_path at placed_path with a symlink (replacing whatever final_path was)."""
+    directory, name = os.path.split(final_path)
+    os.makedirs(directory, exist_ok=True)
+    temp_link = os.path.join(directory, f".{name}{LINK_TEMP_SUFFIX}")
+    if os.path.lexists(temp_link):
+        os.remove(temp_link)
+    os.symlink(placed_path, temp_link)
+    os.replace(temp_link, final_path)
+    _fsync_directory(directory)
+
+def fetch_with_placement(source: ModelSource, filename: str, final_path: str, base_path: str, hot: bool, use_hf_transfer: bool, task_id=None) -> str:
+    """
+    source.fetch into the volume chosen by the placement policy, then symlinks the result
+    into final_path. Without configured volumes this is just source.fetch(final_path).
+    Returns the path the bytes were written to.
+    """
+    if not PLACEMENT_SETTINGS["volumes"]:
+        return source.fetch(filename, final_path, use_hf_transfer, task_id)
+    volume, size = None, None
+    if os.path.islink(final_path):
+        placed_path = os.path.realpath(final_path) # Keep a re-downloaded model where it already lives
+    else:
+        def resolve_size(contact):
+            contact(source.host())
+            return source.resolve(filename).get("size")
+        size = call_with_retries(resolve_size, f"{filename} size", task_id)
+        volume = choose_volume(size, hot)
+        relative_dir = os.path.relpath(os.path.dirname(final_path), base_path)
+        placed_path = final_path if volume is None else os.path.join(resolve_target_directory(volume, relative_dir), os.path.basename(final_path))
+    with reserve_volume_space(volume, size):
+        source.fetch(filename, placed_path, use_hf_transfer, task_id)
+    if os.path.normpath(placed_path) != os.path.normpath(final_path):
+        link_into_tree(placed_path, final_path)
+        add_log(f" -> Stored on {volume or os.path.dirname(placed_path)} and linked into {os.path.dirname(final_path)}")
+    return placed_path
+
+
+# --- Page Cache Warming ---
+# The first generation after a download otherwise pays a cold read of the whole model
+# (20+ GB for a large diffusion model). Warming reads a file once, sequentially, with
+# POSIX_FADV_WILLNEED readahead one chunk ahead, so it lands in the page cache before
+# SwarmUI/ComfyUI loads it. Files are warmed on a background thread, throttled to
+# WARM_SETTINGS["rate_bytes_per_second"]; cancel_page_cache_warming() stops the current
+# file and drops the queue.
+
+WARM_SETTINGS = {
+    "after_download": False, # Queue every finalized download of at least min_size for warming
+    "rate_bytes_per_second": 0, # 0 = unthrottled
+    "min_size": 256 * 1024 * 1024, # Smaller files are cheap to read cold
+}
+WARM_CHUNK_SIZE = 16 * 1024 * 1024
+
+warm_queue = queue.Queue() # (generation, path)
+warm_cancel = threading.Event()
+warm_lock = threading.Lock()
+warm_state = {"generation": 0, "thread": None, "current": None}
+
+def warm_page_cache(path: str, rate_bytes_per_second: float = 0, cancel_event: threading.Event | None = None) -> dict:
+    """Reads path once to pull it into the page cache. Returns {"path", "bytes", "size", "seconds", "cancelled"}."""
+    started = time.time()
+    warmed, cancelled = 0, False
+    buffer = bytearray(WARM_CHUNK_SIZE)
+    with open(path, "rb", buffering=0) as f:
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+        can_advise = hasattr(os, "posix_fadvise")
+        if can_advise:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while warmed < size:
+            if cancel_event is not None and cancel_event.is_set():
+                cancelled = True
+                break
+            if can_advise:
+                # The kernel reads the next chunk in while this one is copied out
+                os.posix_fadvise(fd, warmed + WARM_CHUNK_SIZE, WARM_CHUNK_SIZE, os.POSIX_FADV_WILLNEED)
+            count = f.readinto(buffer)
+            if not count:
+                break
+            warmed += count
+            if rate_bytes_per_second:
+                ahead = warmed / rate_bytes_per_second - (time.time() - started)
+                if ahead > 0:
+                    if cancel_event is not None:
+                        cancel_event.wait(ahead)
+                    else:
+                        time.sleep(ahead)
+    metric_inc("swarmdl_warmed_bytes_total", warmed)
+    if not cancelled:
+        record_model_access(path)
+    return {"path": path, "bytes": warmed, "size": size, "seconds": round(time.time() - started, 3), "cancelled": cancelled}
+
+def _page_cache_warm_worker():
+    while True:
+        generation, path = warm_queue.get()
+        with warm_lock:
+            if generation != warm_state["generation"]:
+                continue # Queued before a cancel
+            warm_cancel.clear()
+            warm_state["current"] = path
+        try:
+            result = warm_page_cache(path, WARM_SETTINGS["rate_bytes_per_second"], warm_cancel)
+            verb = "Stopped warming" if result["cancelled"] else "Warmed"
+            add_log(f"{verb} {os.path.basename(path)}: {format_bytes(result['bytes'])} in {result['seconds']:.1f}s")
+        except OSError as e:
+            add_log(f"WARNING: Could not warm {path}: {e}")
+        finally:
+            with warm_lock:
+                warm_state["current"] = None
+
+def queue_page_cache_warm(paths: list):
+    """Queues files for background warming, starting the warm thread on first use."""
+    with warm_lock:
+        if warm_state["thread"] is None:
+            warm_state["thread"] = threading.Thread(target=_page_cache_warm_worker, daemon=True)
+            warm_state["thread"].start()
+        for path in paths:
+            warm_queue.put((warm_state["generation"], path))
+
+def cancel_page_cache_warming() -> int:
+    """Stops the file being warmed and drops queued ones. Returns how many queued files were dropped."""
+    with warm_lock:
+        warm_state["generation"] += 1
+        warm_cancel.set()
+    dropped = 0
+    while True:
+        try:
+            warm_queue.get_nowait()
+            dropped += 1
+        except queue.Empty:
+            return dropped
+
+def resolve_warm_targets(names: list, base_path: str, is_comfy_ui_structure: bool) -> list:
+    """
+    Installed files for each name: a file or folder path (absolute or relative to
+    base_path), a bundle name, or a catalog model name. Unknown names are logged and skipped.
+    """
+    paths = []
+    for name in names:
+        candidate = name if os.path.isabs(name) else os.path.join(base_path, name)
+        if os.path.isfile(candidate):
+            paths.append(candidate)
+            continue
+        if os.path.isdir(candidate):
+            for root, _, files in os.walk(candidate):
+                paths.extend(os.path.join(root, f) for f in sorted(files) if not f.endswith(PARTIAL_SUFFIX))
+            continue
+        bundle_definition = find_bundle(name)
+        if not bundle_definition:
+            model_keys = [(cat, sub, model_info["name"]) for cat, sub, model_info, _ in iter_catalog_entries() if model_info.get("name") == name]
+            bundle_definition = {"models_to_download": model_keys} if model_keys else None
+        if not bundle_definition:
+            add_log(f"WARNING: Nothing to warm for '{name}': not a path, bundle or catalog model.")
+            continue
+        paths.extend(local_path for _, local_path, _ in resolve_bundle_files(bundle_definition, base_path, is_comfy_ui_structure))
+    return list(dict.fromkeys(paths))
+
+
+# --- Quant Selection ---
+# Sub-categories often list one model as several GGUF quants (F16 ... Q2_K). Variants of
+# one family share a repo and a filename that differs only in the quant tag.
+# select_quant_variant picks the best-quality variant whose size fits every given budget:
+# free disk space, download time at the measured throughput, and VRAM. Sizes come from the
+# source (one HEAD per variant) and are cached in the inventory index.
+
+GGUF_QUANT_RANKING = ("F32", "F16", "BF16", "Q8_0", "Q6_K", "Q5_K_M", "Q5_K_S", "Q5_1", "Q5_0",
+                      "Q4_K_M", "Q4_K_S", "Q4_1", "Q4_0", "Q3_K_L", "Q3_K_M", "Q3_K_S", "Q2_K") # Best first, as in GGUF_QUALITY_INFO
+GGUF_QUANT_PATTERN = re.compile(r"(?<=[-_.])(" + "|".join(GGUF_QUANT_RANKING) + r")(?=\.gguf$)", re.IGNORECASE)
+VRAM_HEADROOM_BYTES = 2 * 1024 ** 3 # Activations, text encoders' share etc. on top of the weights
+THROUGHPUT_MIN_SAMPLE_BYTES = 64 * 1024 * 1024 # Smaller tasks are dominated by latency, not bandwidth
+THROUGHPUT_EWMA_WEIGHT = 0.3
+throughput_estimate = {"bytes_per_second": None} # Moving average over finished tasks, see record_task_throughput
+
+def record_task_throughput(num_bytes: int, seconds: float):
+    """Folds a finished task's average speed into the estimate used for time budgets."""
+    if num_bytes < THROUGHPUT_MIN_SAMPLE_BYTES or seconds <= 0:
+        return
+    sample = num_bytes / seconds
+    previous = throughput_estimate["bytes_per_second"]
+    throughput_estimate["bytes_per_second"] = sample if previous is None else previous + THROUGHPUT_EWMA_WEIGHT * (sample - previous)
+
+def gguf_quant_of(model_info: dict) -> str | None:
+    """The quant tag of a single-file GGUF entry (e.g. 'Q5_K_M'), or None."""
+    if model_info.get("is_snapshot"):
+        return None
+    match = GGUF_QUANT_PATTERN.search(model_info.get("filename_in_repo") or model_info.get("save_filename") or "")
+    return match.group(1).upper() if match else None
+
+def _gguf_family_key(model_info: dict):
+    if not gguf_quant_of(model_info):
+        return None
+    filename = model_info.get("filename_in_repo") or model_info.get("save_filename")
+    return (model_info.get("source", "hf"), model_info.get("repo_id"), GGUF_QUANT_PATTERN.sub("{quant}", filename))
+
+def quant_families(sub_category_info: dict) -> list:
+    """Families of two or more quant variants in a sub-category, each as a list of entries best quality first."""
+    families = {}
+    for model_info in sub_category_info.get("models", []):
+        family_key = _gguf_family_key(model_info)
+        if family_key:
+            families.setdefault(family_key, []).append(model_info)
+    return [sorted(variants, key=lambda m: GGUF_QUANT_RANKING.index(gguf_quant_of(m))) for variants in families.values() if len(variants) > 1]
+
+def _variant_sizes(variants: list) -> dict:
+    """Entry name -> size in bytes (None if it couldn't be resolved), using sizes cached in the inventory index."""
+    sizes, to_resolve = {}, []
+    with inventory_lock:
+        for model_info in variants:
+            cached = inventory_index["remote"].get(_inventory_remote_key(model_info)) or {}
+            if cached.get("size"):
+                sizes[model_info["name"]] = cached["size"]
+            else:
+                to_resolve.append(model_info)
+    if to_resolve:
+        with ThreadPoolExecutor(max_workers=INVENTORY_CHECK_WORKERS) as executor:
+            futures = {executor.submit(_check_entry_upstream, model_info): model_info for model_info in to_resolve}
+            for future in as_completed(futures):
+                model_info = futures[future]
+                try:
+                    upstream = dict(future.result(), checked_at=time.time())
+                except Exception as e:
+                    add_log(f"WARNING: Could not get the size of {model_info.get('name')}: {type(e).__name__} - {e}")
+                    sizes[model_info["name"]] = None
+                    continue
+                sizes[model_info["name"]] = upstream.get("size")
+                with inventory_lock:
+                    inventory_index["remote"][_inventory_remote_key(model_info)] = upstream
+        with inventory_lock:
+            _save_inventory_index()
+    return sizes
+
+def select_quant_variant(variants: list, sub_category_info: dict, base_path: str, is_comfy_ui_structure: bool, disk_budget_bytes=None,
+                         time_budget_seconds=None, vram_bytes=None, throughput_bytes_per_second=None) -> dict:
+    """
+    Picks the best-quality variant that fits all given budgets. disk_budget_bytes defaults
+    to the free space where the file would be saved; the time budget uses the measured
+    throughput unless one is given (and is ignored if neither exists). Returns
+    {"selected": model_info | None, "limit_bytes", "throughput_bytes_per_second", "candidates": [...]}.
+    """
+    load_inventory_index(base_path)
+    if disk_budget_bytes is None:
+        target_dir = _catalog_target_dir(base_path, variants[0], sub_category_info, is_comfy_ui_structure)
+        existing_dir = target_dir
+        while not os.path.isdir(existing_dir) and os.path.dirname(existing_dir) != existing_dir:
+            existing_dir = os.path.dirname(existing_dir)
+        disk_budget_bytes = shutil.disk_usage(existing_dir).free
+        if PLACEMENT_SETTINGS["volumes"]:
+            disk_budget_bytes = max([disk_budget_bytes] + [shutil.disk_usage(v["path"]).free - PLACEMENT_SETTINGS["min_free_bytes"]
+                                                           for v in PLACEMENT_SETTINGS["volumes"] if os.path.isdir(v["path"])])
+    throughput = throughput_bytes_per_second or throughput_estimate["bytes_per_second"]
+    limits = {"disk": disk_budget_bytes}
+    if time_budget_seconds and throughput:
+        limits["time"] = time_budget_seconds * throughput
+    if vram_bytes:
+        limits["vram"] = vram_bytes - VRAM_HEADROOM_BYTES
+    sizes = _variant_sizes(variants)
+    candidates, selected = [], None
+    for model_info in variants:
+        size = sizes.get(model_info["name"])
+        exceeded = [budget for budget, limit in limits.items() if size is not None and size > limit]
+        fits = size is not None and not exceeded
+        candidates.append({"name": model_info["name"], "quant": gguf_quant_of(model_info), "size": size, "fits": fits,
+                           "reason": "size unknown" if size is None else f"exceeds {', '.join(exceeded)} budget" if exceeded else None})
+        if fits and selected is None:
+            selected = model_info
+    return {"selected": selected, "limit_bytes": min(limits.values()), "limits": limits, "throughput_bytes_per_second": throughput, "candidates": candidates}
+
+
+# --- Batch Enqueue API ---
+# JSON endpoints on the service port, for orchestrators that provision pods without the UI:
+#   POST /api/tasks   {"models": [[category, sub_category, model name], ...], "bundles": [bundle name, ...],
+#                      "use_hf_transfer": bool, "comfy_ui_structure": bool}
+#                     -> 202 {"tasks": [{"model", "task_id", "status": "queued" | "duplicate"}], "errors": [...]}
+#   GET /api/tasks/<task_id>   -> the task's state (queued, running, deferred, success, skipped, failed)
+#   GET /api/tasks[?ids=a,b]   -> {"tasks": [...]} for the given (or all remembered) tasks
+#   GET /api/events[?since=seq]   -> server-sent events: a "tasks" snapshot, then every log line and
+#                     event as it happens, with bytes_progress coalesced per file (see Live Event Stream)
+# With --api-token set, every /api/ request must send "Authorization: Bearer <token>" (or, for
+# /api/events, since EventSource can't set headers, ?token=<token>). Without one, the POST
+# endpoints only work when --service-host is a loopback address: anyone who can reach the
+# port could otherwise queue downloads until the disk is full.
+
+API_MAX_BODY_SIZE = 1024 * 1024
+
+def _json_response(status: int, payload) -> tuple:
+    return status, "application/json", json.dumps(payload).encode("utf-8")
+
+def _api_authorized(request) -> bool:
+    token = SERVICE_SETTINGS["api_token"]
+    if not token:
+        return request.command != "POST" or SERVICE_SETTINGS["loopback_only"]
+    return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+
+def _api_denied() -> tuple:
+    if not SERVICE_SETTINGS["api_token"]:
+        return _json_response(403, {"error": "POST /api/ endpoints need --api-token when the service binds to a non-loopback address"})
+    return _json_response(401, {"error": "Missing or invalid bearer token"})
+
+def _read_json_body(request) -> tuple:
+    """(parsed body, None), or (None, error response) for a bad Content-Length, an oversized body or invalid JSON."""
+    try:
+        length = int(request.headers.get("Content-Length") or 0)
+    except ValueError:
+        return None, _json_response(400, {"error": "Invalid Content-Length"})
+    if length > API_MAX_BODY_SIZE:
+        return None, _json_response(413, {"error": f"Request body larger than {API_MAX_BODY_SIZE} bytes"})
+    try:
+        return json.loads(request.rfile.read(length) or b"{}"), None
+    except ValueError as e:
+        return None, _json_response(400, {"error": f"Invalid JSON: {e}"})
+
+def _parse_model_key(key):
+    """[category, sub_category, model] or {"category", "sub_category", "model"} -> tuple, or None if malformed."""
+    if isinstance(key, dict):
+        key = [key.get("category"), key.get("sub_category"), key.get("model")]
+    if isinstance(key, list) and len(key) == 3 and all(isinstance(part, str) for part in key):
+        return tuple(key)
+    return None
+
+def enqueue_catalog_items(model_keys: list, bundle_names: list, base_path: str, use_hf_transfer: bool, is_comfy_ui_structure: bool) -> dict:
+    """
+    Queues catalog models by (category, sub_category, model name) plus every model of the
+    named bundles. Targets already queued or downloading report the existing task id.
+    """
+    tasks, errors = [], []
+    requested = list(model_keys)
+    for bundle_name in bundle_names:
+        bundle_definition = find_bundle(bundle_name)
+        if not bundle_definition:
+            errors.append({"bundle": bundle_name, "error": "Unknown bundle"})
+            continue
+        requested.extend(tuple(key) for key in bundle_definition.get("models_to_download", []))
+    for key in requested:
+        model_info, sub_category_info = find_model_by_key(*key)
+        if not model_info:
+            errors.append({"model": list(key), "error": "Unknown model"})
+            continue
+        sub_category_state = dict(sub_category_info, name=sub_category_info.get("name", key[1]))
+        task_id = queue_download_task(model_info, sub_category_state, base_path, use_hf_transfer, is_comfy_ui_structure)
+        if task_id:
+            tasks.append({"model": list(key), "task_id": task_id, "status": "queued"})
+        else:
+            tasks.append({"model": list(key), "task_id": pending_task_id(model_info, sub_category_state, base_path, is_comfy_ui_structure), "status": "duplicate"})
+    return {"tasks": tasks, "errors": errors}
+
+def handle_enqueue_tasks(request):
+    if not _api_authorized(request):
+        return _api_denied()
+    body, error = _read_json_body(request)
+    if error:
+        return error
+    if not isinstance(body, dict) or not isinstance(body.get("models", []), list) or not isinstance(body.get("bundles", []), list):
+        return _json_response(400, {"error": "Expected {\"models\": [[category, sub_category, model], ...], \"bundles\": [name, ...]}"})
+    model_keys = [_parse_model_key(key) for key in body.get("models", [])]
+    if None in model_keys:
+        return _json_response(400, {"error": "Each model must be [category, sub_category, model name]"})
+    if not model_keys and not body.get("bundles"):
+        return _json_response(400, {"error": "Nothing to enqueue"})
+    result = enqueue_catalog_items(model_keys, [str(name) for name in body.get("bundles", [])], SERVICE_SETTINGS["base_path"],
+                                   bool(body.get("use_hf_transfer", HF_TRANSFER_AVAILABLE)), bool(body.get("comfy_ui_structure", False)))
+    return _json_response(202 if result["tasks"] else 400, result)
+
+def handle_list_tasks(request):
+    if not _api_authorized(request):
+        return _api_denied()
+    requested_ids = [task_id for value in parse_qs(urlsplit(request.path).query).get("ids", []) for task_id in value.split(",") if task_id]
+    if requested_ids:
+        states = [get_task_state(task_id) or {"task_id": task_id, "state": "unknown"} for task_id in requested_ids]
+    else:
+        with task_states_lock:
+            states = [dict(state) for state in task_states.values()]
+    return _json_response(200, {"tasks": states, "queue_depth": download_queue.qsize()})
+
+def handle_get_task(request):
+    if not _api_authorized(request):
+        return _api_denied()
+    task_id = urlsplit(request.path).path.rsplit("/", 1)[-1]
+    state = get_task_state(task_id)
+    return _json_response(200, state) if state else _json_response(404, {"error": f"Unknown task '{task_id}'"})
+
+def handle_select_quant(request):
+    """
+    POST {"model": [category, sub_category, any variant], "disk_gb", "time_minutes", "vram_gb",
+    "dry_run"} -> the selection, and the task id once the chosen variant is queued.
+    """
+    if not _api_authorized(request):
+        return _api_denied()
+    body, error = _read_json_body(request)
+    if error:
+        return error
+    key = _parse_model_key(body.get("model")) if isinstance(body, dict) else None
+    if not key:
+        return _json_response(400, {"error": "Expected {\"model\": [category, sub_category, model name], ...}"})
+    model_info, sub_category_info = find_model_by_key(*key)
+    if not model_info:
+        return _json_response(404, {"error": "Unknown model", "model": list(key)})
+    family = next((variants for variants in quant_families(sub_category_info) if model_info in variants), None)
+    if not family:
+        return _json_response(400, {"error": "Model is not part of a GGUF quant family", "model": list(key)})
+    try:
+        budgets = {name: float(body[field]) * scale for name, field, scale in (("disk_budget_bytes", "disk_gb", 1024 ** 3), ("time_budget_seconds", "time_minutes", 60),
+                                                                               ("vram_bytes", "vram_gb", 1024 ** 3)) if body.get(field) is not None}
+    except (TypeError, ValueError):
+        return _json_response(400, {"error": "Budgets must be numbers"})
+    sub_category_state = dict(sub_category_info, name=sub_category_info.get("name", key[1]))
+    is_comfy_ui_structure = bool(body.get("comfy_ui_structure", False))
+    result = select_quant_variant(family, sub_category_state, SERVICE_SETTINGS["base_path"], is_comfy_ui_structure, **budgets)
+    selected = result.pop("selected")
+    response = dict(result, selected=selected["name"] if selected else None, task_id=None)
+    if selected and not body.get("dry_run"):
+        response["task_id"] = (queue_download_task(selected, sub_category_state, SERVICE_SETTINGS["base_path"], bool(body.get("use_hf_transfer", HF_TRANSFER_AVAILABLE)), is_comfy_ui_structure)
+                               or pending_task_id(selected, sub_category_state, SERVICE_SETTINGS["base_path"], is_comfy_ui_structure))
+    return _json_response(200 if selected else 409, response)
+
+def _sse_message(event: str, payload: dict, event_id=None) -> bytes:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8")
+
+def handle_event_stream(request):
+    """
+    GET /api/events: streams until the client disconnects or the app shuts down. Buffered
+    events carry their sequence number as the SSE id, so a reconnecting EventSource resumes
+    from Last-Event-ID; a "gap" event reports how many it missed if the buffer moved on.
+    """
+    query = parse_qs(urlsplit(request.path).query)
+    token = SERVICE_SETTINGS["api_token"]
+    if not (_api_authorized(request) or (token and hmac.compare_digest(query.get("token", [""])[0], token))):
+        return _json_response(401, {"error": "Missing or invalid bearer token"})
+    resume_from = request.headers.get("Last-Event-ID") or query.get("since", [None])[0]
+    try:
+        cursor = int(resume_from) if resume_from is not None else 0
+    except ValueError:
+        return _json_response(400, {"error": "since / Last-Event-ID must be an event sequence number"})
+    request.send_response(200)
+    request.send_header("Content-Type", "text/event-stream")
+    request.send_header("Cache-Control", "no-cache")
+    request.send_header("X-Accel-Buffering", "no")
+    request.end_headers()
+    with task_states_lock:
+        snapshot = [dict(state) for state in task_states.values()]
+    chunks = [_sse_message("tasks", {"tasks": snapshot, "queue_depth": download_queue.qsize()})]
+    progress_cursor = 0
+    last_write = 0.0
+    try:
+        while True:
+            if chunks:
+                request.wfile.write(b"".join(chunks))
+                request.wfile.flush()
+                last_write = time.monotonic()
+            elif time.monotonic() - last_write >= LIVE_KEEPALIVE_SECONDS:
+                request.wfile.write(b": keepalive\n\n")
+                request.wfile.flush()
+                last_write = time.monotonic()
+            if stop_worker.is_set():
+                break
+            batch = read_live_events(cursor, progress_cursor, timeout=LIVE_PROGRESS_INTERVAL)
+            chunks = [_sse_message("gap", {"missed": batch["missed"]})] if batch["missed"] and resume_from is not None else []
+            chunks += [_sse_message(record["event"], record, record["seq"]) for record in batch["events"]]
+            chunks += [_sse_message(record["event"], record) for record in batch["progress"]]
+            cursor, progress_cursor = batch["cursor"], batch["progress_cursor"]
+    except (BrokenPipeError, ConnectionResetError, OSError):
+        pass # Observer went away
+    return None
+
+service_routes[("POST", "/api/tasks")] = handle_enqueue_tasks
+service_routes[("POST", "/api/select-quant")] = handle_select_quant
+service_routes[("GET", "/api/tasks")] = handle_list_tasks
+service_routes[("GET", "/api/tasks/")] = handle_get_task
+service_routes[("GET", "/api/events")] = handle_event_stream
+
+
+# --- Daemon Mode ---
+# `--daemon --manifest FILE` runs headless at container boot: the manifest's bundles are
+# queued at once and the boot script starts its services without waiting for them. Only
+# what needs a model waits, on that model's bundle:
+#   GET /ready            -> 200 once every manifest bundle is in place, else 503 (body: per-bundle status)
+#   GET /ready/<bundle>   -> 200 / 503 for one bundle
+# and as files in the ready directory (--ready-dir, default <base>/.swarm_downloader/ready):
+# "<bundle>.ready" once all of a bundle's models are in place, "<bundle>.failed" while one
+# of them has failed (it is re-queued every DAEMON_SETTINGS["retry_failed_seconds"]), and
+# "_all.ready" when everything is. Manifest:
+#   {"bundles": ["catalog bundle name", {"name": "my-set", "models_to_download": [[category, sub_category, model], ...]}],
+#    "use_hf_transfer": true, "comfy_ui_structure": false}
+
+DAEMON_SETTINGS = {
+    "retry_failed_seconds": 300.0, # 0 = leave failed models failed
+}
+READY_DIR_NAME = "ready"
+ALL_READY_FILE_NAME = "_all.ready"
+READINESS_POLL_SECONDS = 5.0 # Upper bound; finished tasks wake the tracker through the live event stream
+
+readiness_units = collections.OrderedDict() # bundle name -> {"models": {key: {"task_id", "state", "finished_at"}}, "state"}
+readiness_lock = threading.Lock()
+readiness_settings = {"ready_dir": None, "base_path": None, "use_hf_transfer": False, "comfy_ui_structure": False}
+
+def load_daemon_manifest(manifest_path: str) -> dict:
+    """Reads and checks a manifest. Returns {"bundles": [(name, [model key, ...])], "use_hf_transfer", "comfy_ui_structure"}; raises ValueError."""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("bundles"), list) or not manifest["bundles"]:
+        raise ValueError(f"{manifest_path}: expected {{\"bundles\": [bundle name or {{\"name\", \"models_to_download\"}}, ...]}}")
+    bundles = []
+    for entry in manifest["bundles"]:
+        bundle_definition = find_bundle(entry) if isinstance(entry, str) else entry
+        if not isinstance(bundle_definition, dict) or not bundle_definition.get("name"):
+            raise ValueError(f"{manifest_path}: unknown bundle {entry!r}")
+        model_keys = [_parse_model_key(list(key) if isinstance(key, tuple) else key) for key in bundle_definition.get("models_to_download", [])]
+        if not model_keys or None in model_keys:
+            raise ValueError(f"{manifest_path}: bundle '{bundle_definition['name']}' needs models_to_download as [[category, sub_category, model], ...]")
+        bundles.append((bundle_definition["name"], model_keys))
+    return {"bundles": bundles, "use_hf_transfer": bool(manifest.get("use_hf_transfer", HF_TRANSFER_AVAILABLE)),
+            "comfy_ui_structure": bool(manifest.get("comfy_ui_structure", False))}
+
+def _ready_file_path(bundle_name: str, suffix: str) -> str:
+    return os.path.join(readiness_settings["ready_dir"], re.sub(r"[^A-Za-z0-9._-]+", "_", bundle_name) + suffix)
+
+def _write_ready_file(path: str, payload: dict):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=1)
+    os.replace(temp_path, path)
+
+def _remove_ready_file(path: str):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+def _queue_readiness_model(key: tuple) -> str | None:
+    model_info, sub_category_info = find_model_by_key(*key)
+    if not model_info:
+        return None
+    sub_category_state = dict(sub_category_info, name=sub_category_info.get("name", key[1]))
+    args = (model_info, sub_category_state, readiness_settings["base_path"])
+    return (queue_download_task(*args, readiness_settings["use_hf_transfer"], readiness_settings["comfy_ui_structure"])
+            or pending_task_id(*args, readiness_settings["comfy_ui_structure"]))
+
+def start_readiness_tracking(manifest: dict, base_path: str, ready_dir: str | None = None):
+    """Queues every manifest bundle and starts the thread that keeps /ready and the ready files current."""
+    readiness_settings.update({
+        "ready_dir": ready_dir or os.path.join(base_path, STATE_DIR_NAME, READY_DIR_NAME),
+        "base_path": base_path,
+        "use_hf_transfer": manifest["use_hf_transfer"],
+        "comfy_ui_structure": manifest["comfy_ui_structure"],
+    })
+    os.makedirs(readiness_settings["ready_dir"], exist_ok=True)
+    _remove_ready_file(os.path.join(readiness_settings["ready_dir"], ALL_READY_FILE_NAME)) # A previous boot's files say nothing about this one
+    with readiness_lock:
+        for bundle_name, model_keys in manifest["bundles"]:
+            _remove_ready_file(_ready_file_path(bundle_name, ".ready"))
+            _remove_ready_file(_ready_file_path(bundle_name, ".failed"))
+            unit = readiness_units.setdefault(bundle_name, {"models": {}, "state": "pending"})
+            for key in model_keys:
+                if key not in unit["models"]:
+                    unit["models"][key] = {"task_id": _queue_readiness_model(key), "state": "queued", "finished_at": None}
+    add_log(f"Daemon: tracking readiness of {len(manifest['bundles'])} bundle(s) in {readiness_settings['ready_dir']}.")
+    threading.Thread(target=_readiness_loop, daemon=True).start()
+
+def refresh_readiness():
+    """Folds finished tasks into each bundle's state, re-queues failed models that are due and updates the ready files."""
+    now = time.time()
+    transitions = []
+    with readiness_lock:
+        for bundle_name, unit in readiness_units.items():
+            for key, model in unit["models"].items():
+                if model["task_id"] is None:
+                    model["task_id"] = _queue_readiness_model(key)
+                    continue
+                task_state = (get_task_state(model["task_id"]) or {}).get("state")
+                if task_state and task_state != model["state"]:
+                    model["state"] = task_state
+                    model["finished_at"] = now if task_state in FINISHED_TASK_STATES else None
+                retry_after = DAEMON_SETTINGS["retry_failed_seconds"]
+                if model["state"] == "failed" and retry_after and now - model["finished_at"] >= retry_after:
+                    add_log(f"Daemon: re-queueing failed model '{key[2]}' of bundle '{bundle_name}'.")
+                    model.update(task_id=_queue_readiness_model(key), state="queued", finished_at=None)
+            states = [model["state"] for model in unit["models"].values()]
+            state = "ready" if all(s in ("success", "skipped") for s in states) else "failed" if "failed" in states else "pending"
+            if state != unit["state"]:
+                unit["state"] = state
+                transitions.append((bundle_name, state, len(states)))
+        all_ready = bool(readiness_units) and all(unit["state"] == "ready" for unit in readiness_units.values())
+    for bundle_name, state, model_count in transitions:
+        payload = {"bundle": bundle_name, "state": state, "models": model_count, "at": round(now, 3)}
+        if state == "ready":
+            _write_ready_file(_ready_file_path(bundle_name, ".ready"), payload)
+            _remove_ready_file(_ready_file_path(bundle_name, ".failed"))
+        elif state == "failed":
+            _write_ready_file(_ready_file_path(bundle_name, ".failed"), payload)
+        else:
+            _remove_ready_file(_ready_file_path(bundle_name, ".failed"))
+        emit_event("bundle_state", bundle=bundle_name, state=state)
+        add_log(f"Daemon: bundle '{bundle_name}' is {state}.")
+    all_ready_path = os.path.join(readiness_settings["ready_dir"], ALL_READY_FILE_NAME)
+    if all_ready and not os.path.exists(all_ready_path):
+        _write_ready_file(all_ready_path, {"bundles": list(readiness_units), "at": round(now, 3)})
+        add_log("Daemon: all manifest bundles are ready.")
+
+def _readiness_loop():
+    cursor = 0
+    while not stop_worker.is_set():
+        refresh_readiness()
+        cursor = read_live_events(cursor, math.inf, timeout=READINESS_POLL_SECONDS)["cursor"]
+
+def readiness_report() -> dict:
+    with readiness_lock:
+        bundles = {bundle_name: {"state": unit["state"], "models": len(unit["models"]),
+                                 "done": sum(model["state"] in ("success", "skipped") for model in unit["models"].values()),
+                                 "failed": [list(key) for key, model in unit["models"].items() if model["state"] == "failed"]}
+                   for bundle_name, unit in readiness_units.items()}
+    return {"ready": all(bundle["state"] == "ready" for bundle in bundles.values()), "bundles": bundles}
+
+def handle_ready(request):
+    """GET /ready and /ready/<bundle>: readiness probes, so unauthenticated like /metrics."""
+    report = readiness_report()
+    path = urlsplit(request.path).path
+    if path.startswith("/ready/"):
+        bundle_name = unquote(path[len("/ready/"):])
+        bundle = report["bundles"].get(bundle_name)
+        if bundle is None:
+            return _json_response(404, {"error": f"Bundle '{bundle_name}' is not in the manifest"})
+        return _json_response(200 if bundle["state"] == "ready" else 503, dict(bundle, bundle=bundle_name))
+    return _json_response(200 if report["ready"] else 503, report)
+
+service_routes[("GET", "/ready")] = handle_ready
+service_routes[("GET", "/ready/")] = handle_ready
+
+def wait_for_stop_signal():
+    """Blocks a --daemon run until Ctrl+C or SIGTERM (container stop)."""
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_worker.set())
+    try:
+        while not stop_worker.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        print("\nCtrl+C received. Shutting down...")
+
+def stop_background_services(worker_thread, service_server):
+    """Stops the download worker and everything started alongside it, on the way out."""
+    stop_worker.set()
+    if service_server is not None:
+        service_server.shutdown()
+    print("Waiting for download worker to finish current task (up to 5s)...")
+    worker_thread.join(timeout=5.0) 
+    if worker_thread.is_alive():
+        print("Worker thread did not finish cleanly after 5 seconds.")
+    else:
+        print("Download worker stopped.")
+    stop_transfer_core()
+    stop_event_log()
+
+
+# --- Gradio UI Builder ---
+
+def create_ui(default_base_path):
+    """Creates the Gradio interface."""
+    tracked_components = {}
+    inventory_components = {} # (category, sub-category, model name) -> status Markdown
+
+    with gr.Blocks(theme=gr.themes.Soft(), title=APP_TITLE) as app:
+        gr.Markdown(f"## {APP_TITLE} V40 > Source : https://www.patreon.com/posts/114517862")
+        gr.Markdown(f"### ComfyUI Installer for SwarmUI's Back-End > https://www.patreon.com/posts/105023709")
+        gr.Markdown(f"### 5 May 2025 Main How To Install & Use Tutorial : https://youtu.be/fTzlQ0tjxj0")
+        gr.Markdown(f"### 19 May 2025 Wan 2.1 I2V & T2V With CausVid LoRA Tutorial : https://youtu.be/fTzlQ0tjxj0")
+        gr.Markdown("### Select models or bundles to download. Downloads will be added to a queue. Use the search bar to filter.")
+
+        log_output = gr.Textbox(label="Download Status / Log - Watch CMD / Terminal To See Download Status & Speed", lines=10, max_lines=20, interactive=False, value="Welcome! Logs will appear here.")
+        queue_status_label = gr.Markdown(f"Queue Size: {download_queue.qsize()}")
+        log_cursor_state = gr.State(-1) # Per-session: last log_state["seq"] rendered here
+
+        with gr.Row():
+             inventory_summary = gr.Markdown("Installed status: not scanned yet.")
+             refresh_inventory_button = gr.Button("Refresh Installed Status", scale=0)
+             check_updates_button = gr.Button("Check For Updates", scale=0)
+
+        with gr.Row():
+             search_box = gr.Textbox(placeholder="Search models or bundles...", label="Search", scale=2, interactive=True)
+             use_hf_transfer_checkbox = gr.Checkbox(label="Enable hf_transfer (Faster Downloads)", value=HF_TRANSFER_AVAILABLE, scale=1)
+        
+        with gr.Row():
+             base_path_input = gr.Textbox(label="Base Download Path (SwarmUI/Models)", value=default_base_path, scale=3)
+             comfy_ui_structure_checkbox = gr.Checkbox(label="ComfyUI Folder Structure (e.g. 'loras' folder)", value=False, scale=1)
 
 
         # Initial directory check with default ComfyUI structure (False)
@@ -1134,8 +5581,8 @@ def create_ui(default_base_path):
                 add_log(f"ERROR: Invalid sub_category_info type ({type(sub_category_info)}) for model {model_info.get('name')}. Skipping queue.")
                 return f"Queue Size: {download_queue.qsize()}"
 
-            download_queue.put((model_info, sub_category_info, current_base_path, hf_transfer_enabled, is_comfy_checked))
-            add_log(f"Queued: {model_info.get('name', model_info.get('repo_id'))}")
+            if queue_download_task(model_info, sub_category_info, current_base_path, hf_transfer_enabled, is_comfy_checked):
+                add_log(f"Queued: {model_info.get('name', model_info.get('repo_id'))}")
             return f"Queue Size: {download_queue.qsize()}"
 
         def enqueue_bulk_download(models_list, sub_category_info, current_base_path, hf_transfer_enabled, is_comfy_checked):
@@ -1149,8 +5596,8 @@ def create_ui(default_base_path):
             count = 0
             sub_cat_name = sub_category_info.get("name", "Group") 
             for model_info in models_list:
-                 download_queue.put((model_info, sub_category_info, current_base_path, hf_transfer_enabled, is_comfy_checked))
-                 count += 1
+                 if queue_download_task(model_info, sub_category_info, current_base_path, hf_transfer_enabled, is_comfy_checked):
+                     count += 1
             add_log(f"Queued {count} models from '{sub_cat_name}'.")
             return f"Queue Size: {download_queue.qsize()}"
 
@@ -1178,6 +5625,109 @@ def create_ui(default_base_path):
             add_log(f"Bundle '{bundle_name}' processed. Queued: {queued_count}, Errors: {errors}.")
             return f"Queue Size: {download_queue.qsize()}"
 
+        def enqueue_best_quant(families, family_index, sub_category_info, current_base_path, hf_transfer_enabled, is_comfy_checked, disk_gb, minutes, vram_gb):
+            if not current_base_path:
+                add_log("ERROR: Cannot select a quant, base path input is empty.")
+                return "Base path is empty.", f"Queue Size: {download_queue.qsize()}"
+            variants = families[family_index or 0]
+            result = select_quant_variant(variants, sub_category_info, current_base_path, is_comfy_checked,
+                                          disk_budget_bytes=disk_gb * 1024 ** 3 if disk_gb else None,
+                                          time_budget_seconds=minutes * 60 if minutes else None,
+                                          vram_bytes=vram_gb * 1024 ** 3 if vram_gb else None)
+            lines = []
+            if minutes and not result["throughput_bytes_per_second"]:
+                lines.append("*No download speed measured yet, so the time budget was ignored.*")
+            for candidate in result["candidates"]:
+                size_text = format_bytes(candidate["size"]) if candidate["size"] is not None else "?"
+                lines.append(f"- {candidate['quant']}: {size_text}" + (f" ({candidate['reason']})" if candidate["reason"] else ""))
+            selected = result["selected"]
+            if not selected:
+                lines.insert(0, f"**No variant fits** (limit {format_bytes(result['limit_bytes'])}).")
+                return "\n".join(lines), f"Queue Size: {download_queue.qsize()}"
+            lines.insert(0, f"**Selected {selected['name']}** (limit {format_bytes(result['limit_bytes'])}).")
+            if queue_download_task(selected, sub_category_info, current_base_path, hf_transfer_enabled, is_comfy_checked):
+                add_log(f"Queued best-fit quant: {selected['name']}")
+            return "\n".join(lines), f"Queue Size: {download_queue.qsize()}"
+
+        with gr.Accordion("Disk Usage", open=False):
+            gr.Markdown("Space used per model folder, and least-recently-used models that can be removed. Pinned models (`--pin`) are never removed.")
+            with gr.Row():
+                analyze_disk_button = gr.Button("Analyze Disk Usage", scale=0)
+                evict_gb_input = gr.Number(label="GB to free", value=10, minimum=0, scale=0)
+                evict_button = gr.Button("Remove Least-Recently-Used Models", variant="stop", scale=0)
+            disk_usage_output = gr.Markdown("")
+
+        def render_disk_usage(current_base_path):
+            if not current_base_path or not os.path.isdir(current_base_path):
+                return "Base path does not exist."
+            report = disk_usage_report(current_base_path)
+            volume = report["volume"]
+            lines = [f"**Volume:** {format_bytes(volume['free'])} free of {format_bytes(volume['total'])}"]
+            lines += [f"**Placement volume {v['path']}** ({'fast' if v['fast'] else 'slow'}): {format_bytes(v['free'])} free of {format_bytes(v['total'])}" for v in report["placement_volumes"]]
+            lines += ["",
+                     "| Folder (target_dir_key) | Size | Models | Pinned | Oldest use |", "|---|---|---|---|---|"]
+            for key, summary in report["by_target_dir_key"].items():
+                oldest = time.strftime("%Y-%m-%d", time.localtime(summary["oldest_access"])) if summary["oldest_access"] else "-"
+                lines.append(f"| {key} | {format_bytes(summary['bytes'])} | {summary['units']} | {format_bytes(summary['pinned_bytes'])} | {oldest} |")
+            candidates = [unit for unit in report["units"] if not unit["pinned"]][:15]
+            if candidates:
+                lines += ["", "**Least recently used:**"]
+                lines += [f"- {os.path.relpath(unit['path'], current_base_path)} ({format_bytes(unit['size'])}, last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(unit['last_access']))})" for unit in candidates]
+            return "\n".join(lines)
+
+        def evict_from_ui(current_base_path, gb_to_free):
+            if not current_base_path or not gb_to_free:
+                return render_disk_usage(current_base_path)
+            load_usage_state(current_base_path)
+            evicted = evict_models(current_base_path, int(gb_to_free * 1024 ** 3))
+            add_log(f"Removed {len(evicted)} least-recently-used model(s), freeing {format_bytes(sum(unit['size'] for unit in evicted))}.")
+            return render_disk_usage(current_base_path)
+
+        analyze_disk_button.click(fn=render_disk_usage, inputs=[base_path_input], outputs=[disk_usage_output])
+        evict_button.click(fn=evict_from_ui, inputs=[base_path_input, evict_gb_input], outputs=[disk_usage_output])
+
+        with gr.Accordion("Validate Installed Models", open=False):
+            gr.Markdown("Checks the header of every .safetensors and .gguf file against its size, which catches truncated downloads and saved error pages without reading the whole file.")
+            validate_button = gr.Button("Validate Installed Models", scale=0)
+            validation_output = gr.Markdown("")
+
+        def validate_from_ui(current_base_path):
+            if not current_base_path or not os.path.isdir(current_base_path):
+                return "Base path does not exist."
+            started = time.time()
+            results = validate_installed_models(current_base_path)
+            failed = [result for result in results if not result["ok"]]
+            add_log(f"Validated {len(results)} model files: {len(failed)} invalid.")
+            lines = [f"Checked {len(results)} files in {time.time() - started:.2f}s: **{len(failed)} invalid**."]
+            lines += [f"- `{os.path.relpath(result['path'], current_base_path)}`: {result['error']}" for result in failed]
+            return "\n".join(lines)
+
+        validate_button.click(fn=validate_from_ui, inputs=[base_path_input], outputs=[validation_output])
+
+        with gr.Accordion("Page Cache Warming", open=False):
+            gr.Markdown("Read models into RAM ahead of the first generation. One per line: a model name, bundle name, or path relative to the base path.")
+            warm_names_input = gr.Textbox(label="Models to warm", lines=3)
+            with gr.Row():
+                warm_button = gr.Button("Warm Page Cache", scale=0)
+                stop_warm_button = gr.Button("Stop Warming", variant="stop", scale=0)
+            warm_output = gr.Markdown("")
+
+        def warm_from_ui(names_text, current_base_path, is_comfy_checked):
+            names = [line.strip() for line in (names_text or "").splitlines() if line.strip()]
+            if not names or not current_base_path:
+                return "Nothing to warm."
+            paths = resolve_warm_targets(names, current_base_path, is_comfy_checked)
+            queue_page_cache_warm(paths)
+            total = sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+            return f"Queued {len(paths)} files ({format_bytes(total)}) for warming; progress is in the log."
+
+        def stop_warm_from_ui():
+            dropped = cancel_page_cache_warming()
+            return f"Warming stopped ({dropped} queued files dropped)."
+
+        warm_button.click(fn=warm_from_ui, inputs=[warm_names_input, base_path_input, comfy_ui_structure_checkbox], outputs=[warm_output])
+        stop_warm_button.click(fn=stop_warm_from_ui, inputs=None, outputs=[warm_output])
+
         for cat_name, cat_data in models_structure.items():
             cat_key = f"cat_{cat_name}"
             with gr.Accordion(cat_name, open=False, visible=True) as cat_accordion: 
@@ -1221,6 +5771,7 @@ def create_ui(default_base_path):
                                     display_text = f"- {model_display_name}"
                                     with gr.Row():
                                         gr.Markdown(display_text)
+                                        inventory_components[(cat_name, sub_cat_name, model_display_name)] = gr.Markdown("")
                                         download_button = gr.Button("Download")
                                         sub_cat_state_data = sub_cat_data.copy()
                                         if 'name' not in sub_cat_state_data:
@@ -1236,6 +5787,34 @@ def create_ui(default_base_path):
                                             ],
                                             outputs=[queue_status_label]
                                         )
+                                sub_cat_families = quant_families(sub_cat_data)
+                                if sub_cat_families:
+                                    with gr.Row():
+                                        family_choices = [(" / ".join(m["name"] for m in variants[:2]) + " ...", i) for i, variants in enumerate(sub_cat_families)]
+                                        family_dropdown = gr.Dropdown(label="GGUF family", choices=family_choices, value=0, visible=len(sub_cat_families) > 1)
+                                        quant_disk_input = gr.Number(label="Disk budget GB (empty = free space)", value=None, minimum=0)
+                                        quant_minutes_input = gr.Number(label="Time budget minutes", value=None, minimum=0)
+                                        quant_vram_input = gr.Number(label="GPU VRAM GB", value=None, minimum=0)
+                                        best_quant_button = gr.Button("Download Best Quant That Fits")
+                                    best_quant_output = gr.Markdown("")
+                                    sub_cat_state_data_quant = sub_cat_data.copy()
+                                    if 'name' not in sub_cat_state_data_quant:
+                                        sub_cat_state_data_quant['name'] = sub_cat_name
+                                    best_quant_button.click(
+                                        fn=enqueue_best_quant,
+                                        inputs=[
+                                            gr.State(sub_cat_families),
+                                            family_dropdown,
+                                            gr.State(sub_cat_state_data_quant),
+                                            base_path_input,
+                                            use_hf_transfer_checkbox,
+                                            comfy_ui_structure_checkbox,
+                                            quant_disk_input,
+                                            quant_minutes_input,
+                                            quant_vram_input
+                                        ],
+                                        outputs=[best_quant_output, queue_status_label]
+                                    )
                                 if models_in_subcat:
                                      with gr.Row():
                                          gr.Markdown("---")
@@ -1272,39 +5851,675 @@ def create_ui(default_base_path):
             outputs=list(tracked_components.values()) 
         )
 
+        def render_inventory(current_base_path, is_comfy_checked, rescan=True):
+            if not current_base_path:
+                return {inventory_summary: gr.update(value="Installed status: base path is empty.")}
+            report = inventory_report(current_base_path, is_comfy_checked, rescan=rescan)
+            updates = {}
+            counts = collections.Counter()
+            for key, status_component in inventory_components.items():
+                entry = report["entries"].get("/".join(key))
+                if not entry:
+                    continue
+                counts[entry["status"]] += 1
+                label = INVENTORY_STATUS_LABELS[entry["status"]]
+                if entry["detail"] and entry["status"] != "installed":
+                    label = f"{label} ({entry['detail']})" if label else f"*{entry['detail']}*"
+                updates[status_component] = gr.update(value=label)
+            scan_note = f" Scan: {report['scan']['rescanned']} of {report['scan']['directories']} folders re-read in {report['scan']['seconds']}s." if report["scan"] else ""
+            updates[inventory_summary] = gr.update(value=f"Installed: {counts['installed']}, partial: {counts['partial']}, update available: {counts['outdated']}.{scan_note}")
+            return updates
+
+        def check_inventory_for_updates(current_base_path, is_comfy_checked):
+            if current_base_path:
+                scan_inventory(current_base_path)
+                check_result = check_inventory_updates(current_base_path, is_comfy_checked)
+                add_log(f"Update check: {check_result['checked']} entries checked, {check_result['failed']} failed.")
+            return render_inventory(current_base_path, is_comfy_checked, rescan=False)
+
+        inventory_outputs = list(inventory_components.values()) + [inventory_summary]
+        refresh_inventory_button.click(fn=render_inventory, inputs=[base_path_input, comfy_ui_structure_checkbox], outputs=inventory_outputs)
+        check_updates_button.click(fn=check_inventory_for_updates, inputs=[base_path_input, comfy_ui_structure_checkbox], outputs=inventory_outputs)
+        app.load(fn=render_inventory, inputs=[base_path_input, comfy_ui_structure_checkbox], outputs=inventory_outputs)
+
         try:
             timer = gr.Timer(1, active=True) 
-            def update_log_display():
-                log_update = gr.update() 
-                queue_update = gr.update() 
-                new_log_available = False
-                try:
-                    latest_log = status_updates.get_nowait()
-                    log_update = latest_log 
-                    new_log_available = True
-                except queue.Empty:
-                    pass 
+            def update_log_display(log_cursor):
+                log_text, log_cursor = render_log_since(log_cursor)
+                log_update = gr.update() if log_text is None else log_text
                 q_size = download_queue.qsize()
                 queue_update = f"Queue Size: {q_size}"
-                return log_update, queue_update
-            timer.tick(update_log_display, None, [log_output, queue_status_label])
+                return log_update, queue_update, log_cursor
+            timer.tick(update_log_display, [log_cursor_state], [log_output, queue_status_label, log_cursor_state])
             add_log("Using gr.Timer for UI updates.")
         except AttributeError:
             add_log("gr.Timer not found, falling back to deprecated app.load(every=1) for UI updates.")
-            def update_log_display_legacy():
-                 log_update = gr.update()
-                 queue_update = gr.update()
-                 try:
-                     latest_log = status_updates.get_nowait()
-                     log_update = latest_log
-                 except queue.Empty:
-                     pass
+            def update_log_display_legacy(log_cursor):
+                 log_text, log_cursor = render_log_since(log_cursor)
+                 log_update = gr.update() if log_text is None else log_text
                  q_size = download_queue.qsize()
                  queue_update = f"Queue Size: {q_size}"
-                 return {log_output: log_update, queue_status_label: queue_update}
-            app.load(update_log_display_legacy, None, [log_output, queue_status_label], every=1)
+                 return {log_output: log_update, queue_status_label: queue_update, log_cursor_state: log_cursor}
+            app.load(update_log_display_legacy, [log_cursor_state], [log_output, queue_status_label, log_cursor_state], every=1)
     return app
 
+# --- Benchmark Harness ---
+# `--benchmark` starts a fake Hub (FakeHubHandler) serving synthetic repos and runs each
+# scenario in a fresh child process pointed at it through HF_ENDPOINT, so every run gets
+# clean metrics and its own peak RSS. Children push the scenario's entries through
+# queue_download_task and the real download_worker, then report one JSON line.
+# The other source kinds get the same treatment: the fake Hub also serves plain files at
+# /files/<repo_id>/<path> (http), presigned S3 buckets that check the SigV4 signature like
+# MinIO (s3), and the parent writes a share folder for "file" entries.
+
+FAKE_HUB_COMMIT = "b" * 40
+FAKE_HUB_BLOCK_SIZE = 1024 * 1024 # Synthetic content repeats a seeded random block of this size
+FAKE_HUB_LFS_THRESHOLD = 10 * 1024 * 1024
+FAKE_S3_ACCESS_KEY = "swarmdl-bench"
+FAKE_S3_SECRET_KEY = "swarmdl-bench-secret"
+FAKE_S3_PAGE_SIZE = 250 # Below S3's 1000 so a benchmark listing takes more than one page
+BENCHMARK_SHARE_ENV = "SWARMDL_BENCHMARK_SHARE" # Folder the parent wrote a scenario's "share" files to
+BENCHMARK_RESULT_PREFIX = "BENCHMARK_RESULT "
+MIB = 1024 * 1024
+
+def benchmark_scenarios(scale: float = 1.0) -> dict:
+    """
+    Scenario name -> {"repos": {repo_id: [(path, size)]}, "entries": [model_info], "faults": bool}.
+    A file may be (path, size, options) with FakeHubFile keyword options.
+    "buckets" ({bucket: [(key, size)]}) are served over S3 and "share" ([(path, size)]) is written
+    to a local folder; with "source_kind", every served file must arrive intact.
+    With "bundle", the downloaded entries are also exported and re-imported (see _benchmark_bundle_roundtrip).
+    With "delta", the last entry replaces a file an earlier one downloaded and must be delta-synced.
+    With "mirror_seed", a --serve-mirror peer process holds those entries and the child runs with
+    --mirror; the "hub_partials" entries are missing on the peer and resume a partial left by the Hub.
+    scale shrinks or grows file sizes so CI can run the same scenarios quickly.
+    """
+    def size(num_bytes):
+        return max(1, int(num_bytes * scale))
+    def file_entry(repo_id, path, target_dir_key):
+        return {"name": f"{repo_id}/{path}", "repo_id": repo_id, "filename_in_repo": path, "save_filename": path.rsplit("/", 1)[-1], "target_dir_key": target_dir_key}
+    def snapshot_entry(repo_id, target_dir_key):
+        return {"name": repo_id, "repo_id": repo_id, "is_snapshot": True, "target_dir_key": target_dir_key}
+
+    small_files = [(f"config/part_{i:04d}.json", size(24 * 1024)) for i in range(400)]
+    # Synthetic content is not a real safetensors/GGUF file, so the names avoid extensions that get header validation
+    mixed_repos = {
+        "bench/mixed-unet": [("unet.bin", size(1024 * MIB))],
+        "bench/mixed-te": [("t5xxl.bin", size(512 * MIB)), ("clip_l.bin", size(240 * MIB))],
+        "bench/mixed-vae": [("vae.bin", size(160 * MIB))],
+        "bench/mixed-snapshot": [(f"tokenizer/file_{i:03d}.json", size(64 * 1024)) for i in range(100)] + [("model.bin", size(96 * MIB))],
+    }
+    mixed_entries = [
+        file_entry("bench/mixed-unet", "unet.bin", "diffusion_models"),
+        file_entry("bench/mixed-te", "t5xxl.bin", "clip"),
+        file_entry("bench/mixed-te", "clip_l.bin", "clip"),
+        file_entry("bench/mixed-vae", "vae.bin", "vae"),
+        snapshot_entry("bench/mixed-snapshot", "LLM"),
+    ]
+    # Snapshot files in nested folders, as in Joy Caption's text_model/; exported as a bundle and imported again afterwards
+    bundle_repos = {
+        "bench/bundle-snapshot": [("text_model/adapter.bin", size(48 * MIB)), ("text_model/config.json", size(4 * 1024)),
+                                  ("tokenizer/nested/vocab.json", size(256 * 1024)), ("model.bin", size(32 * MIB))],
+        "bench/bundle-file": [("lora.bin", size(16 * MIB))],
+    }
+    bundle_entries = [snapshot_entry("bench/bundle-snapshot", "LLM"), file_entry("bench/bundle-file", "lora.bin", "Lora")]
+    # Two versions of one file that differ in a few blocks; the second replaces the first through its published chunk index
+    delta_size = max(8 * MIB, size(256 * MIB))
+    delta_blocks = -(-delta_size // FAKE_HUB_BLOCK_SIZE)
+    delta_repos = {
+        "bench/delta-v1": [("model.bin", delta_size, {"seed": "bench/delta/model.bin"})],
+        "bench/delta-v2": [("model.bin", delta_size, {"seed": "bench/delta/model.bin", "changed_blocks": (delta_blocks // 4, delta_blocks // 2)})],
+    }
+    delta_entries = [
+        file_entry("bench/delta-v1", "model.bin", "diffusion_models"),
+        dict(file_entry("bench/delta-v2", "model.bin", "diffusion_models"), allow_overwrite=True,
+             chunk_index_url=f"{os.environ.get('HF_ENDPOINT', '')}/chunks/bench/delta-v2/model.bin"),
+    ]
+    # One file a LAN peer already has, one it doesn't; the second has a half-finished Hub download to resume
+    mirror_size = max(FAKE_HUB_LFS_THRESHOLD, size(256 * MIB))
+    mirror_repos = {"bench/mirror-hit": [("model.bin", mirror_size)], "bench/mirror-miss": [("vae.bin", mirror_size)]}
+    mirror_entries = [file_entry("bench/mirror-hit", "model.bin", "diffusion_models"), file_entry("bench/mirror-miss", "vae.bin", "vae")]
+    # The non-Hub sources: a large file each, plus a folder of small files for the kinds that support snapshots
+    source_files = [("models/unet.bin", size(512 * MIB))]
+    source_snapshot = [(f"text_encoder/file_{i:03d}.json", size(64 * 1024)) for i in range(300)] + [("text_encoder/model.bin", size(32 * MIB))]
+    http_repos = {"bench/http": source_files + [("models/config.json", size(64 * 1024))]}
+    http_entries = [{"name": f"bench/http/{path}", "source": "http", "url": f"{os.environ.get('HF_ENDPOINT', '')}/files/bench/http/{path}",
+                     "save_filename": path.rsplit("/", 1)[-1], "target_dir_key": "diffusion_models"} for path, _ in http_repos["bench/http"]]
+    s3_entries = [
+        {"name": "s3 unet", "source": "s3", "bucket": "bench-models", "key": "models/unet.bin", "save_filename": "unet.bin", "target_dir_key": "diffusion_models"},
+        {"name": "s3 text_encoder", "source": "s3", "bucket": "bench-models", "prefix": "text_encoder", "is_snapshot": True, "target_dir_key": "LLM"},
+    ]
+    share_path = os.environ.get(BENCHMARK_SHARE_ENV, "")
+    file_entries = [
+        {"name": "file unet", "source": "file", "path": os.path.join(share_path, "models", "unet.bin"), "save_filename": "unet.bin", "target_dir_key": "diffusion_models"},
+        {"name": "file text_encoder", "source": "file", "path": os.path.join(share_path, "text_encoder"), "is_snapshot": True, "target_dir_key": "LLM"},
+    ]
+    return {
+        "huge_file": {"repos": {"bench/huge": [("model.bin", size(4096 * MIB))]},
+                      "entries": [file_entry("bench/huge", "model.bin", "diffusion_models")], "faults": False},
+        "many_small_files": {"repos": {"bench/small": small_files}, "entries": [snapshot_entry("bench/small", "LLM")], "faults": False},
+        "mixed_bundle": {"repos": mixed_repos, "entries": mixed_entries, "faults": False},
+        "failures": {"repos": mixed_repos, "entries": mixed_entries, "faults": True},
+        "bundle_roundtrip": {"repos": bundle_repos, "entries": bundle_entries, "faults": False, "bundle": True},
+        "delta_update": {"repos": delta_repos, "entries": delta_entries, "faults": True, "delta": True},
+        "lan_mirror": {"repos": mirror_repos, "entries": mirror_entries, "faults": False,
+                       "mirror_seed": mirror_entries[:1], "hub_partials": mirror_entries[1:]},
+        "http_source": {"repos": http_repos, "entries": http_entries, "faults": True, "source_kind": "http"},
+        "s3_source": {"repos": {}, "buckets": {"bench-models": source_files + source_snapshot}, "entries": s3_entries, "faults": False, "source_kind": "s3"},
+        "file_source": {"repos": {}, "share": source_files + source_snapshot, "entries": file_entries, "faults": False, "source_kind": "file"},
+    }
+
+class FakeHubFile:
+    """
+    Deterministic synthetic file content, addressable by byte range. Files with the same
+    seed share their content except in changed_blocks (indexes of FAKE_HUB_BLOCK_SIZE
+    blocks), which makes two versions of one file.
+    """
+    def __init__(self, repo_id: str, path: str, size: int, seed: str | None = None, changed_blocks=()):
+        seed = seed or f"{repo_id}/{path}"
+        self.size = size
+        self.block = random.Random(seed).randbytes(min(size, FAKE_HUB_BLOCK_SIZE))
+        self.changed_blocks = frozenset(changed_blocks)
+        self.changed_block = random.Random(f"{seed}#changed").randbytes(len(self.block)) if self.changed_blocks else None
+        self.chunk_index = None # Computed on the first /chunks/ request
+        self.is_lfs = size >= FAKE_HUB_LFS_THRESHOLD
+        sha256, sha1 = hashlib.sha256(), hashlib.sha1(f"blob {size}\0".encode())
+        for piece in self.iter_range(0, size):
+            sha256.update(piece)
+            if not self.is_lfs:
+                sha1.update(piece)
+        self.sha256 = sha256.hexdigest()
+        self.git_sha1 = sha1.hexdigest() # For LFS files the real Hub reports the pointer file's blob id; the engine doesn't use it
+        
+    def iter_range(self, start: int, end: int, chunk_size: int = FAKE_HUB_BLOCK_SIZE):
+        """Yields the bytes in [start, end)."""
+        position = start
+        while position < end:
+            block_offset = position % len(self.block)
+            block = self.changed_block if position // len(self.block) in self.changed_blocks else self.block
+            piece = block[block_offset:block_offset + min(chunk_size, end - position)]
+            yield piece
+            position += len(piece)
+
+class FakeHubHandler(BaseHTTPRequestHandler):
+    """
+    Serves the subset of the Hub API the engine uses: the recursive tree listing and
+    /resolve/ with HEAD metadata headers and Range support. Latency, a per-connection
+    bandwidth cap and error injection come from the server's `options` dict.
+    /chunks/<repo_id>/<path> serves a file's chunk index, for chunk_index_url (see Delta Sync).
+    /files/<repo_id>/<path> serves the same files as a plain web server would, and
+    /<bucket>/<key> the server's S3 buckets (presigned requests only, plus ListObjectsV2).
+    """
+    protocol_version = "HTTP/1.1"
+    server_version = "SwarmDLFakeHub"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_empty(self, status: int, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _inject_error(self) -> bool:
+        options = self.server.options
+        if options["error_rate"] and self.server.rng.random() < options["error_rate"]:
+            self._send_empty(503, {"Retry-After": "0"})
+            return True
+        return False
+
+    def do_HEAD(self):
+        self._serve(head_only=True)
+
+    def do_GET(self):
+        self._serve(head_only=False)
+
+    def _serve(self, head_only: bool):
+        if self.server.options["latency"]:
+            time.sleep(self.server.options["latency"])
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/api/models/") and "/tree/" in path:
+            repo_id = path[len("/api/models/"):].split("/tree/", 1)[0]
+            return self._serve_tree(repo_id)
+        if path.startswith("/chunks/") or path.startswith("/files/"):
+            route, *parts = path[1:].split("/", 3) # route, namespace, repo name, file path
+            fake_file = self.server.repos.get("/".join(parts[:2]), {}).get(parts[2]) if len(parts) == 3 else None
+            if fake_file and route == "chunks":
+                return self._serve_chunk_index(fake_file)
+            if fake_file:
+                return self._serve_file(fake_file, head_only, hub_headers=False)
+        bucket, _, key = path[1:].partition("/")
+        if bucket in self.server.buckets:
+            return self._serve_s3(bucket, unquote(key), head_only)
+        if "/resolve/" in path:
+            repo_id, _, rest = path[1:].partition("/resolve/")
+            file_path = rest.partition("/")[2]
+            fake_file = self.server.repos.get(repo_id, {}).get(file_path)
+            if fake_file:
+                return self._serve_file(fake_file, head_only)
+        self._send_empty(404, {"X-Error-Code": "EntryNotFound"})
+
+    def _serve_tree(self, repo_id: str):
+        files = self.server.repos.get(repo_id)
+        if files is None:
+            return self._send_empty(404, {"X-Error-Code": "RepoNotFound"})
+        listing = []
+        for file_path, fake_file in files.items():
+            item = {"type": "file", "path": file_path, "size": fake_file.size, "oid": fake_file.git_sha1}
+            if fake_file.is_lfs:
+                item["lfs"] = {"oid": fake_file.sha256, "size": fake_file.size, "pointerSize": 134}
+            listing.append(item)
+        body = json.dumps(listing).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve_s3(self, bucket: str, key: str, head_only: bool):
+        signature_error = self._s3_signature_error()
+        if signature_error:
+            return self._send_s3_error(403, signature_error, head_only)
+        objects = self.server.buckets[bucket]
+        if not key:
+            return self._serve_s3_listing(objects)
+        if key not in objects:
+            return self._send_s3_error(404, "NoSuchKey", head_only)
+        return self._serve_file(objects[key], head_only, hub_headers=False)
+
+    def _s3_signature_error(self) -> str | None:
+        """Checks a presigned request the way S3 does; returns the S3 error code, or None if it is valid."""
+        params = dict(parse_qsl(self.path.partition("?")[2], keep_blank_values=True))
+        signature = params.pop("X-Amz-Signature", None)
+        access_key, _, scope = params.get("X-Amz-Credential", "").partition("/")
+        if not signature or params.get("X-Amz-Algorithm") != "AWS4-HMAC-SHA256":
+            return "AccessDenied"
+        if access_key != FAKE_S3_ACCESS_KEY:
+            return "InvalidAccessKeyId"
+        amz_date = params.get("X-Amz-Date", "")
+        try:
+            expires_at = calendar.timegm(time.strptime(amz_date, "%Y%m%dT%H%M%SZ")) + int(params.get("X-Amz-Expires", "0"))
+        except ValueError:
+            return "AuthorizationQueryParametersError"
+        if time.time() > expires_at:
+            return "AccessDenied" # Request has expired
+        region = scope.split("/")[1] if scope.count("/") == 3 else ""
+        canonical_query = "&".join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(params.items()))
+        expected = s3_sigv4_signature(FAKE_S3_SECRET_KEY, region, amz_date, self.command, self.path.partition("?")[0], canonical_query, self.headers.get("Host", ""))
+        return None if hmac.compare_digest(expected, signature) else "SignatureDoesNotMatch"
+
+    def _send_s3_error(self, status: int, code: str, head_only: bool):
+        if head_only:
+            return self._send_empty(status)
+        self._send_body(status, f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>{code}</Code></Error>".encode("utf-8"), "application/xml")
+
+    def _serve_s3_listing(self, objects: dict):
+        """ListObjectsV2, FAKE_S3_PAGE_SIZE keys per page; the continuation token is the next key's position."""
+        query = dict(parse_qsl(self.path.partition("?")[2]))
+        keys = sorted(key for key in objects if key.startswith(query.get("prefix", "")))
+        start = int(query.get("continuation-token") or 0)
+        page = keys[start:start + FAKE_S3_PAGE_SIZE]
+        root = ElementTree.Element("ListBucketResult", xmlns=S3_XML_NAMESPACE.strip("{}"))
+        ElementTree.SubElement(root, "IsTruncated").text = "true" if start + len(page) < len(keys) else "false"
+        if start + len(page) < len(keys):
+            ElementTree.SubElement(root, "NextContinuationToken").text = str(start + len(page))
+        for key in page:
+            contents = ElementTree.SubElement(root, "Contents")
+            ElementTree.SubElement(contents, "Key").text = key
+            ElementTree.SubElement(contents, "Size").text = str(objects[key].size)
+        self._send_body(200, ElementTree.tostring(root, encoding="utf-8", xml_declaration=True), "application/xml")
+
+    def _send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve_chunk_index(self, fake_file: FakeHubFile):
+        with self.server.chunk_index_lock:
+            if fake_file.chunk_index is None:
+                with tempfile.NamedTemporaryFile(prefix="swarmdl-fakehub-") as f:
+                    for piece in fake_file.iter_range(0, fake_file.size):
+                        f.write(piece)
+                    f.flush()
+                    fake_file.chunk_index = compute_chunk_index(f.name)
+        body = json.dumps(fake_file.chunk_index).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve_file(self, fake_file: FakeHubFile, head_only: bool, hub_headers: bool = True):
+        if self._inject_error():
+            return
+        etag = fake_file.sha256 if fake_file.is_lfs else fake_file.git_sha1
+        start, end, status = 0, fake_file.size - 1, 200
+        if self.headers.get("Range"):
+            byte_range = _parse_range_header(self.headers["Range"], fake_file.size)
+            if byte_range is None:
+                return self._send_empty(416, {"Content-Range": f"bytes */{fake_file.size}"})
+            (start, end), status = byte_range, 206
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{etag}"')
+        if hub_headers:
+            self.send_header("X-Repo-Commit", FAKE_HUB_COMMIT)
+        if hub_headers and fake_file.is_lfs:
+            self.send_header("X-Linked-Etag", f'"{etag}"')
+            self.send_header("X-Linked-Size", str(fake_file.size))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{fake_file.size}")
+        self.end_headers()
+        if head_only:
+            return
+        options = self.server.options
+        truncate_at = None
+        if options["error_rate"] and self.server.rng.random() < options["error_rate"]:
+            truncate_at = start + (end - start + 1) // 2 # Drop the connection halfway through
+        sent_since_check, window_start = 0, time.monotonic()
+        try:
+            for piece in fake_file.iter_range(start, end + 1, 256 * 1024):
+                if truncate_at is not None and start + sent_since_check >= truncate_at:
+                    self.close_connection = True
+                    return
+                self.wfile.write(piece)
+                sent_since_check += len(piece)
+                if options["bandwidth"]:
+                    ahead = sent_since_check / options["bandwidth"] - (time.monotonic() - window_start)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+def start_fake_hub(repos: dict, latency: float = 0.0, bandwidth: float = 0.0, error_rate: float = 0.0, seed: int = 0, buckets: dict | None = None):
+    """
+    Starts a fake Hub on a free localhost port serving {repo_id: [(path, size[, options])]},
+    and S3 buckets {bucket: [(key, size)]} (also at the server's URL, path-style).
+    bandwidth is bytes/second per connection (0 = unlimited). Returns the server; its URL is server.url.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeHubHandler)
+    server.daemon_threads = True
+    server.repos = {repo_id: {spec[0]: FakeHubFile(repo_id, *spec[:2], **(spec[2] if len(spec) > 2 else {})) for spec in files}
+                    for repo_id, files in repos.items()}
+    server.buckets = {bucket: {key: FakeHubFile(bucket, key, size) for key, size in objects} for bucket, objects in (buckets or {}).items()}
+    server.chunk_index_lock = threading.Lock()
+    server.options = {"latency": latency, "bandwidth": bandwidth, "error_rate": error_rate}
+    server.rng = random.Random(seed)
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _benchmark_peak_rss_kb():
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KiB on Linux
+
+def _benchmark_bundle_roundtrip(scenario_name: str, entries: list, base_path: str) -> dict:
+    """Exports the downloaded entries as a bundle, imports it into an empty base path and compares every file."""
+    bundle_name = f"Benchmark {scenario_name}"
+    models_structure["Benchmark"] = {
+        "sub_categories": {scenario_name: {"name": scenario_name, "models": entries}},
+        "bundles": [{"name": bundle_name, "models_to_download": [("Benchmark", scenario_name, entry["name"]) for entry in entries]}],
+    }
+    archive_path = os.path.join(base_path, "roundtrip.tar")
+    import_base = os.path.join(base_path, "roundtrip-import")
+    with open(archive_path, "wb") as archive:
+        export_bundle(bundle_name, archive, base_path, False)
+    imported = import_bundle(archive_path, import_base, False)
+    exported = resolve_bundle_files(find_bundle(bundle_name), base_path, False)
+    differing = [archive_name for archive_name, local_path, _ in exported
+                 if not filecmp.cmp(local_path, _bundle_member_destination(archive_name, import_base, False), shallow=False)
+                 ] if not (imported["rejected"] or imported["missing"]) and len(imported["installed"]) == len(exported) else None
+    # The imported snapshot must own exactly its files, so a later sync or export sees them as its own
+    unowned = [entry["name"] for entry in entries if entry.get("is_snapshot") and
+               snapshot_owned_files(get_target_path(import_base, entry, {}, False), entry)
+               != {archive_name.partition("/")[2] for archive_name, _, owner in exported if owner == snapshot_owner(entry)}]
+    return {"files": len(exported), "installed": len(imported["installed"]), "rejected": len(imported["rejected"]),
+            "missing": len(imported["missing"]), "unowned_snapshots": unowned, "ok": differing == [] and not unowned}
+
+def _benchmark_finished_tasks() -> int:
+    """Tasks the worker has finished so far; a deferred run is not counted, the task runs again later."""
+    with metrics_lock:
+        return int(sum(v for (name, labels), v in _metric_values.items()
+                       if name == "swarmdl_tasks_total" and dict(labels).get("outcome") != "deferred"))
+
+def _benchmark_served_files(scenario: dict) -> list:
+    """Every FakeHubFile a scenario serves, from the Hub, its S3 buckets or its share folder."""
+    specs = [(repo_id, spec) for repo_id, files in scenario["repos"].items() for spec in files]
+    specs += [(bucket, spec) for bucket, objects in scenario.get("buckets", {}).items() for spec in objects]
+    specs += [("share", spec) for spec in scenario.get("share", [])]
+    return [FakeHubFile(namespace, spec[0], spec[1], **(spec[2] if len(spec) > 2 else {})) for namespace, spec in specs]
+
+def _benchmark_installed_digests(base_path: str) -> collections.Counter:
+    """sha256 -> count of the model files under base_path (state folders and partials skipped)."""
+    digests = collections.Counter()
+    for root, dirs, files in os.walk(base_path):
+        dirs[:] = [d for d in dirs if d not in (".cache", STATE_DIR_NAME)]
+        for name in files:
+            if not name.endswith(PARTIAL_SUFFIX):
+                digests[compute_file_digest(os.path.join(root, name), "sha256")] += 1
+    return digests
+
+def _write_benchmark_share(share: list, work_dir: str | None = None) -> str:
+    """Writes a scenario's "share" files into a new folder and returns it, as an NFS mount would present them."""
+    share_dir = tempfile.mkdtemp(prefix="swarmdl-bench-share-", dir=work_dir)
+    for path, size in share:
+        fake_file = FakeHubFile("share", path, size)
+        file_path = os.path.join(share_dir, *path.split("/"))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            for piece in fake_file.iter_range(0, size):
+                f.write(piece)
+    return share_dir
+
+def _benchmark_fake_file(scenario: dict, model_info: dict) -> FakeHubFile:
+    """The FakeHubFile the parent serves for a single-file entry, rebuilt from the scenario."""
+    spec = next(spec for spec in scenario["repos"][model_info["repo_id"]] if spec[0] == model_info["filename_in_repo"])
+    return FakeHubFile(model_info["repo_id"], spec[0], spec[1], **(spec[2] if len(spec) > 2 else {}))
+
+def _benchmark_plant_partial(scenario_name: str, fake_file: FakeHubFile, model_info: dict, base_path: str) -> int:
+    """Writes the first half of an entry's file as its Hub partial, as an interrupted download leaves it. Returns its size."""
+    final_path = os.path.join(get_target_path(base_path, model_info, {"name": scenario_name}, False), model_info["save_filename"])
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    planted = fake_file.size // 2
+    with open(partial_path_for(final_path), "wb") as f:
+        for piece in fake_file.iter_range(0, planted):
+            f.write(piece)
+    return planted
+
+def run_benchmark_scenario(scenario_name: str, base_path: str, backend: str, scale: float = 1.0) -> dict:
+    """
+    Child-process side: queues the scenario's entries, drains the queue with the real worker and measures it.
+    backend is "http" (hf_transfer off), "hf_transfer", or "parallel" (hf_transfer on but treated as not installed).
+    """
+    global HF_TRANSFER_AVAILABLE
+    if backend == "hf_transfer" and not HF_TRANSFER_AVAILABLE:
+        return {"scenario": scenario_name, "backend": backend, "error": "hf_transfer is not installed"}
+    if backend == "parallel":
+        HF_TRANSFER_AVAILABLE = False
+    use_hf_transfer = backend != "http"
+    scenario = benchmark_scenarios(scale)[scenario_name]
+    if scenario["faults"]:
+        RETRY_SETTINGS.update({"base_delay": 0.2, "max_delay": 2.0, "max_retries": 8})
+    if scenario.get("delta"):
+        DELTA_SETTINGS["min_size"] = 0 # Scaled-down files fall below the real threshold
+    planted_partials = {}
+    if scenario.get("mirror_seed"):
+        # Mirrors are only asked for files whose sha256 is known up front
+        for model_info in scenario["entries"]:
+            fake_file = _benchmark_fake_file(scenario, model_info)
+            model_info["sha256"] = fake_file.sha256
+            if model_info in scenario["hub_partials"]:
+                planted_partials[model_info["repo_id"]] = (fake_file.size, _benchmark_plant_partial(scenario_name, fake_file, model_info, base_path))
+    rss_before_kb = _benchmark_peak_rss_kb()
+    cpu_before, wall_before = time.process_time(), time.perf_counter()
+    worker_thread = threading.Thread(target=download_worker, daemon=True)
+    worker_thread.start()
+    for model_info in scenario["entries"]:
+        queue_download_task(model_info, {"name": scenario_name}, base_path, use_hf_transfer, False)
+    while _benchmark_finished_tasks() < len(scenario["entries"]):
+        time.sleep(0.05)
+    wall = time.perf_counter() - wall_before
+    cpu = time.process_time() - cpu_before
+    stop_worker.set()
+    worker_thread.join(timeout=5.0)
+    with metrics_lock:
+        values = dict(_metric_values)
+    downloaded = sum(v for (name, labels), v in values.items() if name == "swarmdl_bytes_downloaded_total")
+    outcomes, backends_used = collections.Counter(), collections.Counter()
+    for (name, labels), v in values.items():
+        if name == "swarmdl_tasks_total":
+            outcomes[dict(labels).get("outcome")] += int(v)
+        elif name == "swarmdl_files_downloaded_total":
+            backends_used[dict(labels).get("backend")] += int(v)
+    result = {
+        "scenario": scenario_name,
+        "backend": backend,
+        "files_by_backend": dict(backends_used), # Files below HF_TRANSFER_MIN_SIZE take the http/batch paths whatever the backend
+        "scale": scale,
+        "files": sum(len(files) for files in scenario["repos"].values()) + sum(len(objects) for objects in scenario.get("buckets", {}).values()) + len(scenario.get("share", [])),
+        "bytes_downloaded": int(downloaded),
+        "seconds": round(wall, 3),
+        "throughput_mb_per_second": round(downloaded / wall / MIB, 2) if wall else None,
+        "cpu_seconds": round(cpu, 3),
+        "cpu_utilization": round(cpu / wall, 3) if wall else None,
+        "peak_rss_kb": _benchmark_peak_rss_kb(),
+        "rss_before_run_kb": rss_before_kb,
+        "retries": int(sum(v for (name, labels), v in values.items() if name == "swarmdl_retries_total")),
+        "outcomes": dict(outcomes),
+    }
+    if scenario.get("bundle"):
+        try:
+            result["bundle_roundtrip"] = _benchmark_bundle_roundtrip(scenario_name, scenario["entries"], base_path)
+        except Exception as e:
+            result["bundle_roundtrip"] = {"ok": False}
+            result["error"] = f"Bundle round-trip failed: {type(e).__name__} - {e}"
+        else:
+            if not result["bundle_roundtrip"]["ok"]:
+                result["error"] = "Bundle round-trip did not reproduce the exported files"
+    if scenario.get("delta"):
+        result["delta_reused_bytes"] = int(sum(v for (name, labels), v in values.items() if name == "swarmdl_delta_reused_bytes_total"))
+        if not backends_used.get("delta") or outcomes.get("success") != len(scenario["entries"]):
+            result["error"] = "The replaced file was not delta-synced"
+    if scenario.get("source_kind"):
+        # Each served file lands exactly once, byte for byte
+        expected = collections.Counter(fake_file.sha256 for fake_file in _benchmark_served_files(scenario))
+        result["content_ok"] = _benchmark_installed_digests(base_path) == expected
+        if not result["content_ok"] or outcomes.get("success") != len(scenario["entries"]):
+            result["error"] = f"Not every {scenario['source_kind']} file arrived intact"
+    if scenario.get("mirror_seed"):
+        result["mirror_hits"] = backends_used.get("mirror", 0)
+        if result["mirror_hits"] != len(scenario["mirror_seed"]) or outcomes.get("success") != len(scenario["entries"]):
+            result["error"] = "The peer's file did not come from the mirror"
+        # hf_transfer restarts a partial; the other backends must only fetch what the Hub partial is missing
+        for repo_id, (file_size, planted) in planted_partials.items():
+            hub_bytes = sum(v for (name, labels), v in values.items() if name == "swarmdl_bytes_downloaded_total" and dict(labels).get("repo") == repo_id)
+            restarts = use_hf_transfer and HF_TRANSFER_AVAILABLE and file_size >= HF_TRANSFER_MIN_SIZE
+            if not restarts and hub_bytes != file_size - planted:
+                result["error"] = f"The Hub partial of {repo_id} was not resumed after the mirror miss ({int(hub_bytes)} bytes fetched)"
+    return result
+
+def run_benchmark_suite(scenario_names: list, backends: list, scale: float, latency: float, bandwidth: float, error_rate: float, work_dir: str | None = None) -> list:
+    """
+    Parent side: serves each scenario from a fake Hub and runs it once per backend in a
+    child process with a scratch model directory. Returns the children's result dicts.
+    """
+    scenarios = benchmark_scenarios(scale)
+    results = []
+    for scenario_name in scenario_names:
+        scenario = scenarios[scenario_name]
+        scenario_error_rate = error_rate or (0.15 if scenario["faults"] else 0.0)
+        hub = start_fake_hub(scenario["repos"], latency, bandwidth, scenario_error_rate, buckets=scenario.get("buckets"))
+        mirror_peer = share_dir = None
+        try:
+            if scenario.get("mirror_seed"):
+                mirror_peer = _start_benchmark_mirror_peer(hub, scenario["mirror_seed"], work_dir)
+            if scenario.get("share"):
+                share_dir = _write_benchmark_share(scenario["share"], work_dir)
+            for backend in backends:
+                scratch_dir = tempfile.mkdtemp(prefix=f"swarmdl-bench-{scenario_name}-", dir=work_dir)
+                env = dict(os.environ, HF_ENDPOINT=hub.url, HF_HUB_DISABLE_TELEMETRY="1", HF_HUB_DISABLE_IMPLICIT_TOKEN="1",
+                           AWS_ENDPOINT_URL_S3=hub.url, AWS_ACCESS_KEY_ID=FAKE_S3_ACCESS_KEY, AWS_SECRET_ACCESS_KEY=FAKE_S3_SECRET_KEY)
+                env.pop("AWS_SESSION_TOKEN", None)
+                if share_dir:
+                    env[BENCHMARK_SHARE_ENV] = share_dir
+                command = [sys.executable, os.path.abspath(__file__), "--benchmark-run", scenario_name, "--benchmark-scale", str(scale),
+                           "--model-path", scratch_dir, "--benchmark-backend", backend]
+                if mirror_peer:
+                    command += ["--mirror", mirror_peer["url"]]
+                try:
+                    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+                finally:
+                    shutil.rmtree(scratch_dir, ignore_errors=True)
+                result_lines = [line for line in completed.stdout.splitlines() if line.startswith(BENCHMARK_RESULT_PREFIX)]
+                if completed.returncode != 0 or not result_lines:
+                    result = {"scenario": scenario_name, "backend": backend, "error": (completed.stderr or completed.stdout)[-2000:]}
+                else:
+                    result = json.loads(result_lines[-1][len(BENCHMARK_RESULT_PREFIX):])
+                result.update({"latency_seconds": latency, "bandwidth_bytes_per_second": bandwidth, "error_rate": scenario_error_rate})
+                results.append(result)
+                print(f"Benchmark {scenario_name} [{backend}]: {result.get('throughput_mb_per_second')} MB/s in {result.get('seconds')}s", file=sys.stderr)
+        finally:
+            if mirror_peer:
+                _stop_benchmark_mirror_peer(mirror_peer)
+            if share_dir:
+                shutil.rmtree(share_dir, ignore_errors=True)
+            hub.shutdown()
+    return results
+
+def _start_benchmark_mirror_peer(hub, seed_entries: list, work_dir: str | None = None) -> dict:
+    """
+    Starts a --daemon --serve-mirror process on a model folder that already holds seed_entries
+    (written from the fake Hub's content, with a content index), as another pod on the LAN would.
+    Returns {"process", "url", "path"} once it is listening.
+    """
+    peer_dir = tempfile.mkdtemp(prefix="swarmdl-bench-peer-", dir=work_dir)
+    content = {}
+    for model_info in seed_entries:
+        fake_file = hub.repos[model_info["repo_id"]][model_info["filename_in_repo"]]
+        file_path = os.path.join(peer_dir, "store", model_info["repo_id"], model_info["filename_in_repo"])
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            for piece in fake_file.iter_range(0, fake_file.size):
+                f.write(piece)
+        content[fake_file.sha256] = file_path
+    os.makedirs(os.path.join(peer_dir, STATE_DIR_NAME), exist_ok=True)
+    with open(os.path.join(peer_dir, STATE_DIR_NAME, CONTENT_INDEX_NAME), "w", encoding="utf-8") as f:
+        json.dump(content, f)
+    command = [sys.executable, "-u", os.path.abspath(__file__), "--daemon", "--serve-mirror",
+               "--service-host", "127.0.0.1", "--service-port", "0", "--model-path", peer_dir]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    peer = {"process": process, "url": None, "path": peer_dir}
+    for line in process.stdout:
+        match = re.search(r"listening on (http://\S+)", line)
+        if match:
+            peer["url"] = match.group(1)
+            break
+    if not peer["url"]:
+        _stop_benchmark_mirror_peer(peer)
+        raise RuntimeError("The mirror peer exited before it was listening")
+    # Keep reading so the peer never blocks on a full pipe
+    threading.Thread(target=collections.deque, args=(process.stdout, 0), daemon=True).start()
+    return peer
+
+def _stop_benchmark_mirror_peer(peer: dict):
+    peer["process"].terminate()
+    try:
+        peer["process"].wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        peer["process"].kill()
+        peer["process"].wait()
+    shutil.rmtree(peer["path"], ignore_errors=True)
+
+
 # --- Main Execution ---
 
 def get_available_drives():
@@ -1370,7 +6585,71 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="SwarmUI Model Downloader - Direct Download Version with Search and Bundles")
     parser.add_argument("--share", action="store_true", help="Enable Gradio sharing link")
     parser.add_argument("--model-path", type=str, default=None, help="Override default SwarmUI Models path")
+    parser.add_argument("--service-port", type=int, default=None, help="Serve /metrics (Prometheus) and other service endpoints on this port")
+    parser.add_argument("--service-host", type=str, default="0.0.0.0", help="Bind address for the service endpoints")
+    parser.add_argument("--api-token", type=str, default=os.environ.get("SWARMDL_API_TOKEN"), help="Require this bearer token on the /api/ endpoints (default: $SWARMDL_API_TOKEN). Without it, /api/ POSTs only work on a loopback --service-host")
+    parser.add_argument("--event-log", type=str, default=None, help="Write a JSON-lines event log (task_queued, task_started, bytes_progress, task_finished, error) to this file")
+    parser.add_argument("--event-log-max-mb", type=float, default=50, help="Rotate the event log when it reaches this size")
+    parser.add_argument("--event-log-backups", type=int, default=5, help="Number of rotated event log files to keep")
+    parser.add_argument("--mirror", action="append", default=[], metavar="URL", help="Peer mirror (its service port URL) to try before the Hub; may be repeated")
+    parser.add_argument("--serve-mirror", action="store_true", help="Serve downloaded files to peers at /mirror/sha256/<digest> on the service port")
+    parser.add_argument("--max-connections", type=int, default=TRANSFER_SETTINGS["max_connections"], help="Concurrent HTTP requests across all hosts")
+    parser.add_argument("--max-connections-per-host", type=int, default=TRANSFER_SETTINGS["max_connections_per_host"], help="Concurrent HTTP requests to any single host")
+    parser.add_argument("--parallel-streams", type=int, default=TRANSFER_SETTINGS["parallel_streams"], help="Range requests per large file when hf_transfer is enabled but not installed")
+    parser.add_argument("--write-mode", choices=WRITE_MODES, default=WRITE_SETTINGS["mode"], help="buffered: normal page-cache writes; dontneed: drop written data from the page cache; direct: O_DIRECT")
+    parser.add_argument("--write-buffer-mb", type=int, default=WRITE_SETTINGS["buffer_size"] // (1024 * 1024), help="Size of each coalesced disk write")
+    parser.add_argument("--no-preallocate", action="store_true", help="Don't fallocate downloads to their expected size")
+    parser.add_argument("--benchmark-write-modes", type=str, default=None, metavar="DIR", help="Compare write modes by writing a test file in DIR, print JSON results and exit")
+    parser.add_argument("--benchmark-size-mb", type=int, default=1024, help="Test file size for --benchmark-write-modes")
+    parser.add_argument("--benchmark", action="store_true", help="Run the download benchmark suite against a local fake Hub, print JSON lines and exit")
+    parser.add_argument("--benchmark-scenarios", type=str, default="huge_file,many_small_files,mixed_bundle,failures,bundle_roundtrip,delta_update,lan_mirror,http_source,s3_source,file_source", help="Comma-separated scenarios for --benchmark")
+    parser.add_argument("--benchmark-backends", type=str, default="http,parallel,hf_transfer", help="Comma-separated backends for --benchmark (http, parallel, hf_transfer)")
+    parser.add_argument("--benchmark-scale", type=float, default=1.0, help="Multiply all benchmark file sizes by this factor")
+    parser.add_argument("--benchmark-latency-ms", type=float, default=0.0, help="Fake Hub latency added to every request")
+    parser.add_argument("--benchmark-bandwidth-mbps", type=float, default=0.0, help="Fake Hub per-connection bandwidth cap in megabits/s (0 = unlimited)")
+    parser.add_argument("--benchmark-error-rate", type=float, default=0.0, help="Fake Hub probability of a 503 or truncated body per request (the failures scenario defaults to 0.15)")
+    parser.add_argument("--benchmark-output", type=str, default=None, help="Also write --benchmark results to this JSON-lines file")
+    parser.add_argument("--benchmark-run", type=str, default=None, help=argparse.SUPPRESS) # Child process of --benchmark
+    parser.add_argument("--benchmark-backend", type=str, default="http", help=argparse.SUPPRESS)
+    parser.add_argument("--max-retries", type=int, default=RETRY_SETTINGS["max_retries"], help="Retries per file for transient network/server errors")
+    parser.add_argument("--retry-base-delay", type=float, default=RETRY_SETTINGS["base_delay"], help="Initial retry backoff in seconds (doubles per attempt, jittered)")
+    parser.add_argument("--retry-max-delay", type=float, default=RETRY_SETTINGS["max_delay"], help="Upper bound for a single retry backoff in seconds")
+    parser.add_argument("--breaker-threshold", type=int, default=RETRY_SETTINGS["breaker_threshold"], help="Consecutive failures before requests to a host are paused")
+    parser.add_argument("--breaker-cooldown", type=float, default=RETRY_SETTINGS["breaker_cooldown"], help="Seconds to pause a failing host before trying it again")
+    parser.add_argument("--export-bundle", type=str, default=None, metavar="NAME", help="Write the named bundle's installed files as a tar archive to --output, then exit")
+    parser.add_argument("--output", type=str, default=None, help="Archive path for --export-bundle (a named pipe works for streaming to another process)")
+    parser.add_argument("--import-bundle", type=str, default=None, metavar="ARCHIVE", help="Verify and unpack a bundle archive ('-' for stdin) into the model path, then exit")
+    parser.add_argument("--comfy-ui-structure", action="store_true", help="Use the ComfyUI folder layout for --export-bundle/--import-bundle/--scan-inventory")
+    parser.add_argument("--scan-inventory", action="store_true", help="Update the installed-model inventory, print each catalog entry's status as JSON and exit")
+    parser.add_argument("--inventory-hash", action="store_true", help="With --scan-inventory, sha256 files whose digest isn't known yet (slow the first time)")
+    parser.add_argument("--check-updates", action="store_true", help="With --scan-inventory, ask upstream for the current version of installed entries first")
+    parser.add_argument("--validate-models", action="store_true", help="Check the header of every installed .safetensors/.gguf file against its size, print JSON lines and exit (non-zero if any fail)")
+    parser.add_argument("--volume", action="append", default=[], metavar="PATH[:fast|:slow]", help="Extra disk for single-file downloads, symlinked into the model path; may be repeated (unmarked non-rotational disks count as fast)")
+    parser.add_argument("--hot-dirs", type=str, default=",".join(sorted(PLACEMENT_SETTINGS["hot_target_keys"])), help="Comma-separated target_dir_keys whose files prefer fast volumes")
+    parser.add_argument("--volume-min-free-gb", type=float, default=PLACEMENT_SETTINGS["min_free_bytes"] / 1024 ** 3, help="Never fill a volume past this much free space")
+    parser.add_argument("--disk-usage", action="store_true", help="Print a disk usage report per target_dir_key (least-recently-used models first) as JSON and exit")
+    parser.add_argument("--evict-gb", type=float, default=None, help="Remove least-recently-used, unpinned models until this many GB are freed, then exit")
+    parser.add_argument("--dry-run", action="store_true", help="With --evict-gb, only list what would be removed")
+    parser.add_argument("--pin", action="append", default=[], metavar="PATH", help="Never evict this model file or folder; may be repeated")
+    parser.add_argument("--unpin", action="append", default=[], metavar="PATH", help="Remove a pin; may be repeated")
+    parser.add_argument("--auto-evict", action="store_true", help="Evict least-recently-used models automatically when a download doesn't fit")
+    parser.add_argument("--min-free-gb", type=float, default=0.0, help="With --auto-evict, keep this much space free on top of each download")
+    parser.add_argument("--prewarm", action="append", default=[], metavar="NAME", help="Read an installed model, bundle or path into the page cache, then exit (for boot scripts); may be repeated")
+    parser.add_argument("--warm-after-download", action="store_true", help="Read each finished download of at least --warm-min-mb into the page cache in the background")
+    parser.add_argument("--warm-rate-mb", type=float, default=0.0, help="Limit page cache warming to this many MB/s (0 = unlimited)")
+    parser.add_argument("--warm-min-mb", type=int, default=WARM_SETTINGS["min_size"] // (1024 * 1024), help="With --warm-after-download, skip smaller files")
+    parser.add_argument("--no-delta-sync", action="store_true", help="Always download replacements in full instead of reusing unchanged chunks of the old file")
+    parser.add_argument("--delta-min-mb", type=int, default=DELTA_SETTINGS["min_size"] // (1024 * 1024), help="Only delta-sync replacements of files at least this large")
+    parser.add_argument("--chunk-index", action="append", default=[], metavar="PATH", help="Write PATH's chunk index to PATH.chunks.json (to publish as a catalog chunk_index_url), then exit; may be repeated")
+    parser.add_argument("--daemon", action="store_true", help="Run without the UI until stopped (container boot); use with --manifest and usually --service-port")
+    parser.add_argument("--manifest", type=str, default=None, help="JSON manifest of required bundles: queue them at startup and report readiness at /ready and in --ready-dir")
+    parser.add_argument("--ready-dir", type=str, default=None, help="Where <bundle>.ready / <bundle>.failed / _all.ready files go (default: <model path>/.swarm_downloader/ready)")
+    parser.add_argument("--retry-failed-minutes", type=float, default=DAEMON_SETTINGS["retry_failed_seconds"] / 60, help="Re-queue a manifest model this long after it failed (0 = never)")
+    add_node_installer_arguments(parser) # Handled before the heavy imports (see Early Commands); listed here for --help
+    parser.add_argument("--evict-min-idle-hours", type=float, default=EVICTION_SETTINGS["min_idle_seconds"] / 3600, help="Never evict models used within this many hours")
     args = parser.parse_args()
+    if args.export_bundle and not args.output:
+        parser.error("--export-bundle needs --output") # stdout already carries startup messages
 
     if args.model_path:
         current_base_path = os.path.abspath(args.model_path)
@@ -1379,12 +6658,177 @@ if __name__ == "__main__":
         current_base_path = os.path.abspath(DEFAULT_BASE_PATH) 
         print(f"Using determined base path: {current_base_path}")
 
+    WRITE_SETTINGS.update({
+        "mode": args.write_mode,
+        "buffer_size": max(1, args.write_buffer_mb) * 1024 * 1024,
+        "preallocate": not args.no_preallocate,
+    })
+    if args.benchmark_write_modes:
+        for result in benchmark_write_modes(args.benchmark_write_modes, args.benchmark_size_mb * 1024 * 1024):
+            print(json.dumps(result))
+        sys.exit(0)
+    TRANSFER_SETTINGS["max_connections"] = max(1, args.max_connections)
+    TRANSFER_SETTINGS["max_connections_per_host"] = max(1, min(args.max_connections_per_host, args.max_connections))
+    TRANSFER_SETTINGS["parallel_streams"] = max(1, args.parallel_streams)
+    RETRY_SETTINGS.update({
+        "max_retries": max(0, args.max_retries),
+        "base_delay": args.retry_base_delay,
+        "max_delay": args.retry_max_delay,
+        "breaker_threshold": max(1, args.breaker_threshold),
+        "breaker_cooldown": args.breaker_cooldown,
+    })
+
+    if args.benchmark:
+        unknown = [name for name in args.benchmark_scenarios.split(",") if name not in benchmark_scenarios()]
+        if unknown:
+            parser.error(f"Unknown benchmark scenario(s): {', '.join(unknown)}")
+        unknown = [name for name in args.benchmark_backends.split(",") if name not in ("http", "parallel", "hf_transfer")]
+        if unknown:
+            parser.error(f"Unknown benchmark backend(s): {', '.join(unknown)}")
+        benchmark_results = run_benchmark_suite(
+            args.benchmark_scenarios.split(","), args.benchmark_backends.split(","), args.benchmark_scale,
+            args.benchmark_latency_ms / 1000.0, args.benchmark_bandwidth_mbps * 1_000_000 / 8, args.benchmark_error_rate)
+        for result in benchmark_results:
+            print(json.dumps(result))
+        if args.benchmark_output:
+            with open(args.benchmark_output, "a", encoding="utf-8") as f:
+                for result in benchmark_results:
+                    f.write(json.dumps(dict(result, timestamp=time.time())) + "\n")
+        sys.exit(1 if any("error" in result for result in benchmark_results) else 0)
+    if args.benchmark_run:
+        MIRROR_SETTINGS["mirrors"] = args.mirror
+        benchmark_result = run_benchmark_scenario(args.benchmark_run, current_base_path, args.benchmark_backend, args.benchmark_scale)
+        print(BENCHMARK_RESULT_PREFIX + json.dumps(benchmark_result))
+        sys.exit(0)
+
+    if args.export_bundle or args.import_bundle:
+        # Headless commands: no UI, no worker; the exit code tells scripts whether it worked
+        try:
+            if args.export_bundle:
+                with open(args.output, "wb") as bundle_output:
+                    export_bundle(args.export_bundle, bundle_output, current_base_path, args.comfy_ui_structure)
+                sys.exit(0)
+            import_result = import_bundle(args.import_bundle, current_base_path, args.comfy_ui_structure)
+            sys.exit(1 if import_result["rejected"] or import_result["missing"] else 0)
+        except (OSError, ValueError, tarfile.TarError) as e:
+            print(f"ERROR: {type(e).__name__} - {e}", file=sys.stderr)
+            sys.exit(1)
+
+    PLACEMENT_SETTINGS.update({
+        "volumes": [parse_volume_spec(spec) for spec in args.volume],
+        "hot_target_keys": {key.strip() for key in args.hot_dirs.split(",") if key.strip()},
+        "min_free_bytes": int(args.volume_min_free_gb * 1024 ** 3),
+    })
+    for placement_volume in PLACEMENT_SETTINGS["volumes"]:
+        print(f"Placement volume: {placement_volume['path']} ({'fast' if placement_volume['fast'] else 'slow'})")
+    load_usage_state(current_base_path)
+    EVICTION_SETTINGS.update({
+        "enabled": args.auto_evict,
+        "base_path": current_base_path,
+        "min_free_bytes": int(args.min_free_gb * 1024 ** 3),
+        "min_idle_seconds": args.evict_min_idle_hours * 3600,
+    })
+    for pin_path in args.pin:
+        set_model_pinned(pin_path, True)
+    for pin_path in args.unpin:
+        set_model_pinned(pin_path, False)
+    WARM_SETTINGS.update({
+        "after_download": args.warm_after_download,
+        "rate_bytes_per_second": args.warm_rate_mb * 1024 * 1024,
+        "min_size": args.warm_min_mb * 1024 * 1024,
+    })
+    DELTA_SETTINGS.update({
+        "enabled": not args.no_delta_sync,
+        "min_size": args.delta_min_mb * 1024 * 1024,
+    })
+    if args.chunk_index:
+        for index_source in args.chunk_index:
+            try:
+                print(json.dumps({"path": index_source, "index": write_chunk_index_file(index_source)}))
+            except OSError as e:
+                print(json.dumps({"path": index_source, "error": str(e)}))
+        sys.exit(0)
+    if args.prewarm:
+        try:
+            for warm_path in resolve_warm_targets(args.prewarm, current_base_path, args.comfy_ui_structure):
+                try:
+                    print(json.dumps(warm_page_cache(warm_path, WARM_SETTINGS["rate_bytes_per_second"])))
+                except OSError as e:
+                    print(json.dumps({"path": warm_path, "error": str(e)}))
+        except KeyboardInterrupt:
+            sys.exit(130)
+        sys.exit(0)
+    if args.validate_models:
+        validation_results = validate_installed_models(current_base_path)
+        for result in validation_results:
+            print(json.dumps(result))
+        sys.exit(0 if all(result["ok"] for result in validation_results) else 1)
+    if args.disk_usage or args.evict_gb is not None:
+        if args.evict_gb is not None:
+            evicted = evict_models(current_base_path, int(args.evict_gb * 1024 ** 3), dry_run=args.dry_run)
+            print(json.dumps({"dry_run": args.dry_run, "freed_bytes": sum(unit["size"] for unit in evicted), "evicted": evicted}, indent=1))
+        else:
+            print(json.dumps(disk_usage_report(current_base_path), indent=1))
+        sys.exit(0)
+
+    if args.scan_inventory:
+        load_content_index(current_base_path)
+        if args.check_updates:
+            scan_inventory(current_base_path)
+            check_inventory_updates(current_base_path, args.comfy_ui_structure)
+        print(json.dumps(inventory_report(current_base_path, args.comfy_ui_structure, hash_files=args.inventory_hash), indent=1))
+        sys.exit(0)
+
+    daemon_manifest = None
+    if args.manifest:
+        try:
+            daemon_manifest = load_daemon_manifest(args.manifest)
+        except (OSError, ValueError) as e:
+            parser.error(f"--manifest: {e}")
+    DAEMON_SETTINGS["retry_failed_seconds"] = args.retry_failed_minutes * 60
+
+    MIRROR_SETTINGS["mirrors"] = args.mirror
+    if args.serve_mirror:
+        if args.service_port is None:
+            parser.error("--serve-mirror needs --service-port")
+        enable_mirror_serving()
+
+    if args.event_log:
+        start_event_log(args.event_log, int(args.event_log_max_mb * 1024 * 1024), args.event_log_backups)
+
     # Ensure Base Dirs Exist Early (default ComfyUI mode to False for this initial call)
     ensure_directories_exist(current_base_path, False) 
+    # Temp files from a crashed/killed previous run are never valid models; drop the abandoned ones before the worker starts
+    # (recent ones are resumed when re-queued, leased ones belong to another pod sharing this folder)
+    orphan_count = cleanup_orphaned_partials(current_base_path)
+    orphan_count += sum(cleanup_orphaned_partials(placement_volume["path"], current_base_path) for placement_volume in PLACEMENT_SETTINGS["volumes"]
+                        if os.path.normpath(placement_volume["path"]) != os.path.normpath(current_base_path))
+    if orphan_count:
+        print(f"Cleaned up {orphan_count} orphaned partial download(s).")
+    indexed_count = load_content_index(current_base_path)
+    if args.serve_mirror:
+        print(f"Mirror serving {indexed_count} indexed file(s) from {current_base_path}.")
 
     worker_thread = threading.Thread(target=download_worker, daemon=True)
     worker_thread.start()
 
+    service_server = None
+    SERVICE_SETTINGS["base_path"] = current_base_path
+    SERVICE_SETTINGS["api_token"] = args.api_token
+    SERVICE_SETTINGS["loopback_only"] = is_loopback_host(args.service_host)
+    if args.service_port is not None:
+        service_server = start_service_server(args.service_host, args.service_port)
+        if not args.api_token and not SERVICE_SETTINGS["loopback_only"]:
+            print(f"WARNING: No --api-token while listening on {args.service_host}; POST /api/ endpoints are refused until one is set.")
+    if daemon_manifest:
+        start_readiness_tracking(daemon_manifest, current_base_path, args.ready_dir)
+    if args.daemon:
+        try:
+            wait_for_stop_signal()
+        finally:
+            stop_background_services(worker_thread, service_server)
+        sys.exit(0)
+
     gradio_app = create_ui(current_base_path)
     allowed_paths_list = get_available_drives()
     try:
@@ -1424,14 +6868,5 @@ if __name__ == "__main__":
          print(f"ERROR launching Gradio: {e}")
          print("Please ensure Gradio is installed correctly (`pip install gradio`) and that the specified port is available.")
     finally:
-        stop_worker.set()
-        print("Waiting for download worker to finish current task (up to 5s)...")
-        worker_thread.join(timeout=5.0) 
-        if worker_thread.is_alive():
-            print("Worker thread did not finish cleanly after 5 seconds.")
-        else:
-            print("Download worker stopped.")
-        if status_updates is not None:
-             status_updates.put(None) 
-             status_updates = None
+        stop_background_services(worker_thread, service_server)
     print("Gradio app closed.")
\ No newline at end of file
@@ -464,6 +464,74 @@ setup_environment() {
     log "Environment setup complete"
 }
 
+# Model downloader settings: with a manifest present, models download in the background
+# and nothing below waits for them. Anything that needs a bundle waits on its ready file
+# (see wait_for_models) or polls http://localhost:$DOWNLOADER_PORT/ready/<bundle>.
+DOWNLOADER_SCRIPT="${DOWNLOADER_SCRIPT:-/workspace/Downloader_Gradio_App.py}"
+DOWNLOADER_URL="${DOWNLOADER_URL:-https://raw.githubusercontent.com/remphan1618/Red/main/Downloader_Gradio_App.py}"
+MODEL_MANIFEST="${MODEL_MANIFEST:-/workspace/model_manifest.json}"
+MODEL_PATH="${MODEL_PATH:-/VisoMaster/models}"
+DOWNLOADER_PORT="${DOWNLOADER_PORT:-7861}"
+DOWNLOADER_HOST="${DOWNLOADER_HOST:-127.0.0.1}" # Set 0.0.0.0 (with SWARMDL_API_TOKEN) to reach it from outside the container
+MODELS_READY_DIR="${MODELS_READY_DIR:-$MODEL_PATH/.swarm_downloader/ready}"
+
+# Start the model downloader as a background daemon (never blocks service startup)
+start_model_downloader() {
+    local service_name="ModelDownloader"
+    if [ ! -f "$MODEL_MANIFEST" ]; then
+        log "No model manifest at $MODEL_MANIFEST; not starting $service_name"
+        return 0
+    fi
+    log "Starting $service_name for $MODEL_MANIFEST..."
+    
+    if [ ! -f "$DOWNLOADER_SCRIPT" ]; then
+        curl -fsSL "$DOWNLOADER_URL" -o "$DOWNLOADER_SCRIPT" || {
+            handle_error "Failed to fetch $DOWNLOADER_SCRIPT" "$service_name"
+            return 1
+        }
+    fi
+    python3 -c "import gradio, httpx, huggingface_hub" 2>/dev/null || pip install gradio httpx huggingface_hub hf_transfer || handle_error "Failed to install downloader dependencies" "$service_name"
+    
+    mkdir -p "$MODEL_PATH"
+    nohup python3 "$DOWNLOADER_SCRIPT" --daemon --manifest "$MODEL_MANIFEST" --model-path "$MODEL_PATH" \
+        --ready-dir "$MODELS_READY_DIR" --service-host "$DOWNLOADER_HOST" --service-port "$DOWNLOADER_PORT" \
+        > /logs/model_downloader.log 2> /logs/model_downloader_err.log &
+    
+    # Verify service started (the downloads themselves carry on in the background)
+    sleep 3
+    if pgrep -f "$DOWNLOADER_SCRIPT --daemon" > /dev/null; then
+        log "$service_name started successfully; bundle readiness in $MODELS_READY_DIR"
+        echo "STARTED: $(date)" > "$LOG_DIR/${service_name}_STATUS.txt"
+        return 0
+    else
+        handle_error "$service_name failed to start" "$service_name"
+        return 1
+    fi
+}
+
+# Block until a manifest bundle is downloaded, e.g. before a workflow that needs it:
+#   wait_for_models "FLUX Models Bundle" [timeout_seconds]
+# Returns 1 if the bundle failed (the daemon keeps retrying) or the timeout passed.
+wait_for_models() {
+    local ready_name
+    ready_name=$(echo "$1" | sed 's/[^A-Za-z0-9._-]\+/_/g')
+    local timeout="${2:-0}"
+    local waited=0
+    until [ -f "$MODELS_READY_DIR/$ready_name.ready" ]; do
+        if [ -f "$MODELS_READY_DIR/$ready_name.failed" ]; then
+            log "Bundle '$1' failed to download; see /logs/model_downloader.log"
+            return 1
+        fi
+        if [ "$timeout" -gt 0 ] && [ "$waited" -ge "$timeout" ]; then
+            log "Timed out waiting for bundle '$1'"
+            return 1
+        fi
+        sleep 5
+        waited=$((waited + 5))
+    done
+    return 0
+}
+
 # Start Jupyter Lab with improved error handling
 start_jupyter() {
     local service_name="Jupyter"
@@ -613,6 +681,13 @@ monitor_services() {
             echo "VisoMaster restarted at $(date)" >> "$LOG_DIR/service_restarts.log"
         fi
         
+        # Check and restart the model downloader if needed
+        if [ -f "$MODEL_MANIFEST" ] && ! is_running "$DOWNLOADER_SCRIPT --daemon"; then
+            log "WARNING: Model downloader not running, restarting..."
+            start_model_downloader
+            echo "Model downloader restarted at $(date)" >> "$LOG_DIR/service_restarts.log"
+        fi
+        
         # Sleep before next check
         sleep 30
     done
@@ -626,7 +701,8 @@ setup_environment
 
 # Start each service and track status
 log "Starting essential services..."
-start_vnc     # Start VNC first using the startup script
+start_model_downloader # Background daemon first, so downloads overlap everything else
+start_vnc     # Start VNC using the startup script
 start_jupyter
 start_visomaster
 
@@ -636,7 +712,7 @@ echo "-------- Services Status Summary --------" > "$LOG_DIR/services_summary.tx
 echo "Generated at: $(date)" >> "$LOG_DIR/services_summary.txt"
 echo "" >> "$LOG_DIR/services_summary.txt"
 
-for service in "Jupyter" "VNC" "VisoMaster"; do
+for service in "Jupyter" "VNC" "VisoMaster" "ModelDownloader"; do
     if [ -f "$LOG_DIR/${service}_FAILED.status" ]; then
         echo "❌ $service: FAILED - $(cat "$LOG_DIR/${service}_FAILED.status" | head -1)" >> "$LOG_DIR/services_summary.txt"
     elif [ -f "$LOG_DIR/${service}_STATUS.txt" ]; then